@@ -0,0 +1,187 @@
+"""
+Compact binary format for block checkpoints.
+
+A block is stored as a .npz holding the block's gate names, one opcode and
+one row of qudits per operation, and every parameter as float64. Loading one
+is a handful of numpy reads instead of a QASM parse, which matters because
+kernel fitting, stats and synthesis all reload the same blocks many times.
+QASM stays the interchange format: partitions are still written as QASM and
+the .npz copies are made the first time a block is loaded, export_qasm turns
+a .npz back into QASM.
+"""
+from __future__ import annotations
+from functools import lru_cache
+from os import getpid, listdir, makedirs, replace, stat
+from os.path import basename, dirname, exists, normpath
+import argparse
+
+import numpy as np
+from bqskit import Circuit
+from bqskit.ir.gate import Gate
+from bqskit.ir.lang.qasm2.qasm2 import OPENQASM2Language
+
+
+@lru_cache(maxsize=None)
+def gate_table() -> dict[str, Gate]:
+	"""Every parameterless-constructible bqskit gate, by QASM name."""
+	import bqskit.ir.gates as gates
+	table = {}
+	for name in gates.__all__:
+		cls = getattr(gates, name)
+		if not isinstance(cls, type) or not issubclass(cls, Gate):
+			continue
+		try:
+			gate = cls()
+			table.setdefault(gate.qasm_name, gate)
+		except (TypeError, AttributeError):
+			continue
+	return table
+
+
+def encode_circuit(
+	circuit : Circuit,
+) -> dict[str, np.ndarray]:
+	"""
+	Arrays describing `circuit`, see save_npz.
+
+	Raises:
+		ValueError: If the circuit has a gate that can not be stored by name.
+	"""
+	table = gate_table()
+	names = []
+	opcodes = []
+	locations = []
+	params = []
+	for op in circuit:
+		name = op.gate.qasm_name if hasattr(op.gate, "_qasm_name") else None
+		if name is None or name not in table or \
+			table[name].num_qudits != op.gate.num_qudits:
+			raise ValueError(f"Can not store gate {op.gate} in a npz block.")
+		if name not in names:
+			names.append(name)
+		opcodes.append(names.index(name))
+		locations.append(list(op.location))
+		params.extend(op.params)
+	width = max([len(loc) for loc in locations], default=0)
+	return {
+		"radixes" : np.array(circuit.radixes, dtype=np.int32),
+		"names" : np.array(names, dtype=str),
+		"opcodes" : np.array(opcodes, dtype=np.uint16),
+		"locations" : np.array(
+			[loc + [-1] * (width - len(loc)) for loc in locations],
+			dtype=np.int32,
+		).reshape(len(locations), width),
+		"params" : np.array(params, dtype=np.float64),
+	}
+
+
+def decode_circuit(
+	arrays : dict[str, np.ndarray],
+) -> Circuit:
+	table = gate_table()
+	gates = [table[str(name)] for name in arrays["names"]]
+	circuit = Circuit(len(arrays["radixes"]), arrays["radixes"].tolist())
+	params = arrays["params"].tolist()
+	start = 0
+	for opcode, location in zip(
+		arrays["opcodes"].tolist(), arrays["locations"].tolist()
+	):
+		gate = gates[opcode]
+		end = start + gate.num_params
+		circuit.append_gate(
+			gate, [q for q in location if q >= 0], params[start:end]
+		)
+		start = end
+	return circuit
+
+
+def save_npz(
+	npz_path : str,
+	circuit : Circuit,
+) -> None:
+	"""
+	Write a block as a .npz.
+
+	Raises:
+		ValueError: If the circuit has a gate that can not be stored by name.
+	"""
+	arrays = encode_circuit(circuit)
+	makedirs(dirname(npz_path), exist_ok=True)
+	# np.savez appends .npz to names without it
+	tmp_path = f"{npz_path[:-len('.npz')]}.{getpid()}.tmp.npz"
+	np.savez(tmp_path, **arrays)
+	replace(tmp_path, npz_path)
+
+
+def load_npz(
+	npz_path : str,
+) -> Circuit:
+	with np.load(npz_path) as arrays:
+		return decode_circuit(dict(arrays))
+
+
+def npz_path_for(block_path : str) -> str:
+	"""
+	Where the .npz copy of a .qasm or .pickle block is kept. Copies live in
+	a mirror of the block's directory under block_cache/ so that the
+	partition directories only ever contain the files other tools expect.
+	"""
+	directory = normpath(dirname(block_path)).lstrip("/")
+	stem = basename(block_path).rsplit(".", 1)[0]
+	return f"block_cache/{directory}/{stem}.npz"
+
+
+def is_current(
+	npz_path : str,
+	block_path : str,
+) -> bool:
+	"""True if npz_path exists and is not older than block_path."""
+	if not exists(npz_path):
+		return False
+	if not exists(block_path):
+		return True
+	return stat(npz_path).st_mtime_ns >= stat(block_path).st_mtime_ns
+
+
+def export_qasm(
+	npz_path : str,
+	qasm_path : str | None = None,
+) -> str:
+	"""QASM of a .npz block, also written to qasm_path if provided."""
+	qasm = OPENQASM2Language().encode(load_npz(npz_path))
+	if qasm_path is not None:
+		with open(qasm_path, "w") as f:
+			f.write(qasm)
+	return qasm
+
+
+if __name__ == "__main__":
+	"""
+	>>> python block_format.py convert block_files/qft_64_preoptimized_mesh_64_blocksize_4_scan
+	>>> python block_format.py export block_cache/block_files/qft_64_preoptimized_mesh_64_blocksize_4_scan qasm_blocks
+
+	convert stores a .npz copy of every QASM block in a directory, export
+	writes the QASM of every .npz block in a directory to another directory.
+	"""
+	parser = argparse.ArgumentParser(
+		description="Convert block checkpoints between QASM and npz"
+	)
+	parser.add_argument("command", type=str, help="[convert | export]")
+	parser.add_argument("input_dir", type=str)
+	parser.add_argument("output_dir", type=str, nargs="?", default=None)
+	args = parser.parse_args()
+
+	converted = 0
+	for name in sorted(listdir(args.input_dir)):
+		path = f"{args.input_dir}/{name}"
+		if args.command == "convert" and name.endswith(".qasm"):
+			if is_current(npz_path_for(path), path):
+				continue
+			with open(path, "r") as f:
+				save_npz(npz_path_for(path), OPENQASM2Language().decode(f.read()))
+			converted += 1
+		elif args.command == "export" and name.endswith(".npz"):
+			makedirs(args.output_dir, exist_ok=True)
+			export_qasm(path, f"{args.output_dir}/{name[:-len('.npz')]}.qasm")
+			converted += 1
+	print(f"{args.command}: {converted} blocks from {args.input_dir}")
@@ -0,0 +1,356 @@
+"""
+Block level scheduling for the synthesis stage. Blocks are handed out to a
+pool of worker processes so that many blocks are synthesized at once, with the
+most expensive blocks started first.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Sequence
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from re import match
+
+from bqskit import Circuit
+from bqskit.ir.gates.constant.cx import CNOTGate
+
+from old_codebase import synthesize, synthesize_circuit, check_for_leap_files
+from profiling import Profiler, measure
+from synthesis_backends import get_backend
+from resources import CoreBudget, limited_blas_threads, pin_blas_threads
+from interactions import get_logical_operations, qasm_interactions
+from predictor import worth_synthesizing
+from topology import kernel_type
+from util import load_block_topology, read_block_qasm
+
+
+def block_cost(
+	block_path : str,
+	qudit_group : Sequence[int],
+) -> tuple[int, int]:
+	"""
+	Estimate how expensive a block will be to synthesize.
+
+	Args:
+		block_path (str): Path to the QASM file of the block.
+
+		qudit_group (Sequence[int]): Qudits the block acts on.
+
+	Returns:
+		cost (tuple[int,int]): The (width, cnot count) of the block. Search
+			time grows exponentially in the width and roughly linearly in the
+			number of CNOTs, so tuples compare in the right order.
+	"""
+	cnots = 0
+	for line in read_block_qasm(block_path).splitlines():
+		if match("cx", line):
+			cnots += 1
+	return (len(qudit_group), cnots)
+
+
+def block_costs(
+	block_list : Sequence[int],
+	block_names : Sequence[str],
+	structure : Sequence[Sequence[int]],
+	options : dict[str, Any],
+) -> dict[int, tuple[int, int]]:
+	"""block_cost of every block in block_list, by block number."""
+	return {
+		block_num : block_cost(
+			f"{options['partition_dir']}/{block_names[block_num]}.qasm",
+			structure[block_num],
+		) for block_num in block_list
+	}
+
+
+def pending_blocks(
+	block_names : Sequence[str],
+	options : dict[str, Any],
+) -> list[int]:
+	"""
+	Block numbers that do not have a finished checkpoint in the synthesis
+	directory. Partially completed LEAP projects are cleaned up here.
+	"""
+	return [
+		block_num for block_num, block_name in enumerate(block_names) if not
+		check_for_leap_files(f"{options['synthesis_dir']}/{block_name}")
+	]
+
+
+def order_blocks(
+	block_list : Sequence[int],
+	block_names : Sequence[str],
+	structure : Sequence[Sequence[int]],
+	options : dict[str, Any],
+	costs : dict[int, tuple[int, int]] | None = None,
+) -> list[int]:
+	"""
+	Sort the work queue so that the most expensive blocks are started first.
+	With options["predict_action"] set to "defer", blocks the predictor does
+	not expect to improve (see predictor.py) go after all others. Ties keep
+	their original block order. Block costs are read from the blocks unless
+	given as `costs` (see block_costs).
+	"""
+	if costs is None:
+		costs = block_costs(block_list, block_names, structure, options)
+	deferred = set([])
+	if options.get("predict_action") == "defer":
+		deferred = set([
+			block_num for block_num in block_list if not worth_synthesizing(
+				qasm_interactions(read_block_qasm(
+					f"{options['partition_dir']}/{block_names[block_num]}.qasm"
+				).splitlines())[0],
+				len(structure[block_num]),
+				load_block_topology(
+					f"{options['subtopology_dir']}/{block_names[block_num]}"
+					"_kernel.pickle"
+				),
+				options,
+			)
+		])
+	return sorted(
+		block_list,
+		key=lambda x: (x not in deferred, costs[x]),
+		reverse=True,
+	)
+
+
+def num_block_workers(
+	num_blocks : int,
+	options : dict[str, Any],
+) -> int:
+	"""
+	Number of blocks to synthesize at once, at most one per core of the
+	budget (see resources.py). Backends that cannot run in several processes
+	(see synthesis_backends.py) get one, and use every core for each block
+	instead.
+	"""
+	if not get_backend(options).parallel_blocks:
+		return 1
+	return CoreBudget.for_machine(options.get("max_cores")).block_workers(
+		options["synth_workers"], num_blocks
+	)
+
+
+def _synthesize_block(
+	block_num : int,
+	block_name : str,
+	qudit_group : Sequence[int],
+	options : dict[str, Any],
+) -> int:
+	synthesize(
+		block_name=block_name,
+		qudit_group=qudit_group,
+		options=options,
+	)
+	return block_num
+
+
+def schedule_synthesis(
+	block_names : Sequence[str],
+	structure : Sequence[Sequence[int]],
+	options : dict[str, Any],
+	profiler : Profiler | None = None,
+) -> None:
+	"""
+	Synthesize every block that does not already have a checkpoint.
+
+	Args:
+		block_names (Sequence[str]): Names of the blocks in the partition.
+
+		structure (Sequence[Sequence[int]]): Qudit group of each block.
+
+		options (dict[str, Any]):
+			synth_workers (int): Maximum number of blocks synthesized at
+				once. The physical cores, or max_cores, are split evenly
+				among the workers when sizing each qsearch run.
+
+		profiler (Profiler | None): If provided, every synthesized block is
+			recorded as a "synthesis/<block name>" event.
+
+	Raises:
+		RuntimeError: If any block failed to synthesize. All other blocks are
+			still finished and checkpointed so a rerun resumes from there.
+	"""
+	block_list = pending_blocks(block_names, options)
+	if len(block_list) < len(block_names):
+		print(
+			f"    Found {len(block_names) - len(block_list)} synthesized "
+			f"blocks, {len(block_list)} left to synthesize"
+		)
+	costs = block_costs(block_list, block_names, structure, options)
+	block_list = order_blocks(
+		block_list, block_names, structure, options, costs
+	)
+	block_info = {}
+	if profiler is not None and profiler.enabled:
+		for block_num in block_list:
+			(width, cnots) = costs[block_num]
+			subtopology = load_block_topology(
+				f"{options['subtopology_dir']}/{block_names[block_num]}"
+				"_kernel.pickle"
+			)
+			block_info[block_num] = {
+				"kernel" : kernel_type(subtopology, width),
+				"cnots" : cnots,
+			}
+
+	num_workers = num_block_workers(len(block_list), options)
+	worker_options = dict(options)
+	worker_options["num_synth_procs"] = num_workers
+	_run_blocks(
+		block_list,
+		block_names,
+		_synthesize_block,
+		{
+			block_num : (
+				block_names[block_num],
+				structure[block_num],
+				worker_options,
+			) for block_num in block_list
+		},
+		num_workers,
+		profiler,
+		block_info,
+	)
+
+
+def _synthesize_circuit_block(
+	block_num : int,
+	block_name : str,
+	circuit : Circuit,
+	subtopology : Sequence[Sequence[int]],
+	options : dict[str, Any],
+) -> str:
+	return synthesize_circuit(block_name, circuit, subtopology, options)
+
+
+def schedule_circuit_synthesis(
+	block_names : Sequence[str],
+	blocks : Sequence[Circuit],
+	subtopologies : Sequence[Sequence[Sequence[int]]],
+	options : dict[str, Any],
+	profiler : Profiler | None = None,
+) -> list[str]:
+	"""
+	Same as schedule_synthesis, but for blocks and kernels that are already
+	in memory. Nothing is read from or written to the checkpoint directories.
+
+	Returns:
+		qasm (list[str]): The synthesized QASM of every block.
+	"""
+	deferred = set([])
+	if options.get("predict_action") == "defer":
+		deferred = set([
+			block_num for block_num in range(len(blocks))
+			if not worth_synthesizing(
+				get_logical_operations(blocks[block_num]),
+				blocks[block_num].num_qudits,
+				subtopologies[block_num],
+				options,
+			)
+		])
+	block_list = sorted(
+		range(len(blocks)),
+		key=lambda x: (
+			x not in deferred,
+			blocks[x].num_qudits,
+			blocks[x].count(CNOTGate()),
+		),
+		reverse=True,
+	)
+	num_workers = num_block_workers(len(block_list), options)
+	worker_options = dict(options)
+	worker_options["num_synth_procs"] = num_workers
+	results = _run_blocks(
+		block_list,
+		block_names,
+		_synthesize_circuit_block,
+		{
+			block_num : (
+				block_names[block_num],
+				blocks[block_num],
+				subtopologies[block_num],
+				worker_options,
+			) for block_num in block_list
+		},
+		num_workers,
+		profiler,
+		{
+			block_num : {
+				"kernel" : kernel_type(
+					subtopologies[block_num], blocks[block_num].num_qudits
+				),
+				"cnots" : blocks[block_num].count(CNOTGate()),
+			} for block_num in block_list
+		},
+	)
+	return [results[block_num] for block_num in range(len(blocks))]
+
+
+def _run_blocks(
+	block_list : Sequence[int],
+	block_names : Sequence[str],
+	task : Callable,
+	task_args : dict[int, tuple],
+	num_workers : int,
+	profiler : Profiler | None = None,
+	block_info : dict[int, dict[str, Any]] | None = None,
+) -> dict[int, Any]:
+	"""
+	Call task(block_num, *task_args[block_num]) for every block in
+	block_list, in order, on up to num_workers processes. Each call is
+	measured and added to the profiler along with the block's block_info.
+	"""
+	def record(block_num, measurement):
+		if profiler is not None:
+			profiler.add(
+				f"synthesis/{block_names[block_num]}",
+				measurement,
+				**(block_info or {}).get(block_num, {}),
+			)
+
+	results = {}
+	if len(block_list) == 0:
+		return results
+
+	# Every core runs its own process, see resources.py. Later stages of
+	# this process keep their BLAS threads.
+	failed = []
+	if num_workers == 1:
+		with limited_blas_threads():
+			for count, block_num in enumerate(block_list):
+				print(
+					f"    Synthesizing block {block_num+1}/{len(block_names)} "
+					f"({count+1}/{len(block_list)} remaining blocks)"
+				)
+				results[block_num], measurement = measure(
+					task, block_num, *task_args[block_num]
+				)
+				record(block_num, measurement)
+		return results
+
+	print(f"    Synthesizing {len(block_list)} blocks on {num_workers} workers")
+	with ProcessPoolExecutor(
+		max_workers=num_workers, initializer=pin_blas_threads
+	) as executor:
+		futures = {
+			executor.submit(
+				measure, task, block_num, *task_args[block_num]
+			) : block_num for block_num in block_list
+		}
+		for count, future in enumerate(as_completed(futures)):
+			block_num = futures[future]
+			try:
+				results[block_num], measurement = future.result()
+				record(block_num, measurement)
+				print(
+					f"    Finished block {block_num+1}/{len(block_names)} "
+					f"({count+1}/{len(block_list)})"
+				)
+			except Exception as e:
+				print(f"  WARNING: Block {block_names[block_num]} failed: {e}")
+				failed.append(block_names[block_num])
+
+	if len(failed) > 0:
+		raise RuntimeError(
+			f"Synthesis failed for {len(failed)} blocks: {failed}"
+		)
+	return results
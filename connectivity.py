@@ -3,7 +3,6 @@ from pickle import load, dump
 from typing import Sequence
 
 import networkx as nx
-import re
 import argparse
 from os import listdir
 import gc
@@ -13,12 +12,29 @@ from bqskit.ir.lang.qasm2.qasm2 import OPENQASM2Language
 from bqskit.ir.gates.constant.cx import CNOTGate
 from bqskit.ir.gates.parameterized.u3 import U3Gate
 
+from interactions import block_interactions
+from partition_store import open_partition
+
 # Take as input a Sequence[Sequence[int]]
 # Create a networkx graph
 # Get the 2nd eigenvalue of the Laplacian
 # Get the modularity or Q-value
 # Get the graph expansion
 
+def algebraic_connectivity(
+	edges : Sequence[Sequence[int]],
+) -> float:
+	"""
+	Second smallest eigenvalue of the normalized Laplacian of the graph made
+	of `edges`, 0 if there are no edges or the graph is disconnected.
+	"""
+	graph = nx.Graph()
+	graph.add_edges_from([(u,v) for (u,v) in edges if u != v])
+	if len(graph.nodes) == 0:
+		return 0
+	return nx.algebraic_connectivity(graph, normalized=True)
+
+
 class Connectivity:
 
 	def __init__(
@@ -41,7 +57,7 @@ class Connectivity:
 			synthesized_file (str): Synthesized version of qasm_file. 
 		"""
 		# Convert qasm file to a list of edges
-		self.edge_list = self._parse_qasm_file(qasm_file)
+		(self.edge_list, _, _) = block_interactions(qasm_file)
 		#edges = list(set(self.edge_list.copy()))
 		#self.weights = {x: self.edge_list.count(x) for x in edges}
 
@@ -69,25 +85,6 @@ class Connectivity:
 				self.synth_circuit = OPENQASM2Language().decode(f.read())
 
 
-	def _parse_qasm_file(
-		self, 
-		qasm_file : str
-	) -> Sequence[Sequence[int]]:
-		# Open the file
-		edges = []
-		# All blocks should be in the CX and U3 gate set
-		with open(qasm_file, "r") as f:
-			# Check each multi
-			for line in f:
-				if re.match(r"cx", line):
-					(a,b) = re.findall(r"\d+", line)
-					edges.append((a,b))
-					#self.cnots += 1
-				#elif re.match(r"u3", line):
-					#self.u3s += 1
-		return edges
-
-
 	def measure(self) -> Sequence[float,float]:
 		width = self.circuit.num_qudits
 		depth = self.circuit.depth
@@ -113,9 +110,9 @@ class Connectivity:
 
 		if len(self.logical_graph.nodes) > 0:
 			log_edges = len(self.logical_graph.edges)
-			log_eig = nx.algebraic_connectivity(self.logical_graph, normalized=True)
+			log_eig = algebraic_connectivity(self.logical_graph.edges)
 			synth_edges = len(self.subtopology_graph.edges)
-			synth_eig = nx.algebraic_connectivity(self.subtopology_graph, normalized=True)
+			synth_eig = algebraic_connectivity(self.subtopology_graph.edges)
 
 		return (
 			width, 
@@ -138,8 +135,9 @@ if __name__ == "__main__":
 	parser.add_argument("synthesis_dir", type=str)
 	args = parser.parse_args()
 
-	block_list = sorted(listdir(args.partition_dir))
-	block_list.remove("structure.pickle")
+	# partition_dir may also be a partition store, see partition_store.py
+	partition = open_partition(args.partition_dir)
+	block_list = [f"{name}.qasm" for name in partition.block_names]
 	subtopology_list = sorted(listdir(args.subtopology_dir))
 	subtopology_list.remove("summary.txt")
 	synthesis_list = sorted([x for x in listdir(args.synthesis_dir) if x.endswith(".qasm")])
@@ -149,7 +147,7 @@ if __name__ == "__main__":
 			f"Unequal number of block and subtopology files!"
 		)
 	
-	output_name = f"{args.partition_dir.split('/')[-1]}.pickle"
+	output_name = f"{args.partition_dir.split('/')[-1].split('.part')[0]}.pickle"
 	if output_name == ".pickle":
 		output_name = f"{args.partition_dir.split('/')[-2]}.pickle"
 
@@ -158,7 +156,7 @@ if __name__ == "__main__":
 		block_name = block_list[block_num]
 		subtopology_name = subtopology_list[block_num]
 		analyzer = Connectivity(
-			f"{args.partition_dir}/{block_name}",
+			partition.block_path(block_num),
 			f"{args.subtopology_dir}/{subtopology_name}",
 			f"{args.synthesis_dir}/{block_name}",
 		)
@@ -2,14 +2,10 @@ import argparse
 import os
 import pickle
 
+from edge_set import EdgeSet
+
 def check_subtopology_equal(edges_a, edges_b):
-	for edge in edges_a:
-		if edge not in edges_b:
-			return False
-	for edge in edges_b:
-		if edge not in edges_a:
-			return False
-	return True
+	return EdgeSet(edges_a) == EdgeSet(edges_b)
 
 # Given a neighbors directory, check to see if we can copy over some
 # already synthesized sythesis_files
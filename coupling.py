@@ -5,9 +5,14 @@ from __future__ import annotations
 from typing import Sequence
 from math import sqrt, ceil
 from pickle import dump, load
-from os.path import exists
+from os import getpid, replace
+from os.path import exists, getmtime
+from functools import lru_cache
 from re import match, findall
 
+import numpy as np
+from networkx import Graph
+
 def mesh(
     n : int,
     m : int = None,
@@ -95,6 +100,20 @@ def make_coupling_map(
     return coup_map
 
 
+def load_coupling_file(file_name : str) -> set[tuple[int]]:
+    """
+    Load a pickled coupling map. Maps are only read from disk once per
+    process unless the file changes, callers must not modify the result.
+    """
+    return _load_coupling_file(file_name, getmtime(file_name))
+
+
+@lru_cache(maxsize=None)
+def _load_coupling_file(file_name : str, mtime : float) -> set[tuple[int]]:
+    with open(file_name, 'rb') as f:
+        return load(f)
+
+
 def get_coupling_map(
     coupling_type_or_file : str, 
     num_q : int = -1,
@@ -102,8 +121,7 @@ def get_coupling_map(
 ) -> tuple[int, Sequence[Sequence[int]]] | None:
     # If the file name was provided, return that file
     if exists(coupling_type_or_file):
-        with open(coupling_type_or_file, 'rb') as f:
-            coup_map = load(f)
+        coup_map = load_coupling_file(coupling_type_or_file)
         qudits = [x[0] for x in coup_map]
         qudits.extend([x[1] for x in coup_map])
         num_p = 0
@@ -121,8 +139,7 @@ def get_coupling_map(
         file_name = 'coupling_maps/%s'%(file_name) 
 
     if exists(file_name):
-        with open(file_name, 'rb') as f:
-            coup_map = load(f)
+        coup_map = load_coupling_file(file_name)
     elif make_coupling_map_flag:
         coup_map = make_coupling_map(coupling_type_or_file, num_q)
     else:
@@ -132,6 +149,120 @@ def get_coupling_map(
     return (num_p, coup_map)
 
 
+def distances_path_for(file_name : str) -> str:
+    """Path of the saved all pairs distances of a coupling map."""
+    return f"{file_name}.distances.npy"
+
+
+class CouplingGraph:
+
+    def __init__(self, file_name : str) -> None:
+        """
+        A coupling map file with its adjacency in CSR form, the distances
+        between all pairs of qubits and its diameter.
+
+        Distances are computed on first use with one breadth first search per
+        qubit and saved next to the map (see distances_path_for), later uses
+        memory map the saved copy. A saved copy older than the map is
+        recomputed.
+
+        neighbors, has_edge and `in` work as on a networkx Graph, graph()
+        gives the networkx Graph itself.
+
+        Args:
+            file_name (str): Pickled coupling map, see load_coupling_file.
+        """
+        self.file_name = file_name
+        self.edge_set = load_coupling_file(file_name)
+        self.num_qudits = 1 + max(
+            [max(u, v) for (u, v) in self.edge_set], default=-1
+        )
+        adjacency = [set() for _ in range(self.num_qudits)]
+        for (u, v) in self.edge_set:
+            if u != v:
+                adjacency[u].add(v)
+                adjacency[v].add(u)
+        self.indptr = np.zeros(self.num_qudits + 1, dtype=np.int32)
+        self.indptr[1:] = np.cumsum([len(a) for a in adjacency])
+        self.indices = np.array(
+            [w for a in adjacency for w in sorted(a)], dtype=np.int32
+        )
+        self._distances = None
+        self._graph = None
+
+    def __contains__(self, qudit : int) -> bool:
+        return 0 <= qudit < self.num_qudits
+
+    def neighbors(self, qudit : int) -> np.ndarray:
+        return self.indices[self.indptr[qudit]:self.indptr[qudit + 1]]
+
+    def has_edge(self, u : int, v : int) -> bool:
+        if u not in self or v not in self:
+            return False
+        return bool(np.any(self.neighbors(u) == v))
+
+    @property
+    def distances(self) -> np.ndarray:
+        """Hops between each pair of qubits, -1 if they are not connected."""
+        if self._distances is None:
+            path = distances_path_for(self.file_name)
+            if not exists(path) or getmtime(path) < getmtime(self.file_name):
+                tmp_path = f"{path}.{getpid()}.tmp.npy"
+                np.save(tmp_path, self._all_pairs_distances())
+                replace(tmp_path, path)
+            self._distances = np.load(path, mmap_mode="r")
+        return self._distances
+
+    def _all_pairs_distances(self) -> np.ndarray:
+        n = self.num_qudits
+        distances = np.full((n, n), -1, dtype=np.int16)
+        for source in range(n):
+            row = distances[source]
+            row[source] = 0
+            frontier = np.array([source], dtype=np.int32)
+            hops = 0
+            while len(frontier) > 0:
+                hops += 1
+                reached = np.concatenate(
+                    [self.neighbors(v) for v in frontier]
+                )
+                reached = np.unique(reached[row[reached] < 0])
+                row[reached] = hops
+                frontier = reached
+        return distances
+
+    def distance(self, u : int, v : int) -> int:
+        return int(self.distances[u, v])
+
+    @property
+    def diameter(self) -> int:
+        """Largest distance between two connected qubits."""
+        if self.num_qudits == 0:
+            return 0
+        return int(np.max(self.distances))
+
+    def graph(self) -> Graph:
+        """The coupling map as a networkx Graph, callers must not modify it."""
+        if self._graph is None:
+            self._graph = Graph()
+            self._graph.add_nodes_from(range(self.num_qudits))
+            self._graph.add_edges_from(self.edge_set)
+        return self._graph
+
+
+def coupling_graph(file_name : str) -> CouplingGraph:
+    """
+    The CouplingGraph of a coupling map file, built once per process unless
+    the file changes.
+    """
+    return _coupling_graph(file_name, getmtime(file_name))
+
+
+@lru_cache(maxsize=None)
+def _coupling_graph(file_name : str, mtime : float) -> CouplingGraph:
+    return CouplingGraph(file_name)
+
+
 if __name__ == "__main__":
     get_coupling_map("mesh", 4, True)
     get_coupling_map("mesh", 9, True)
@@ -16,16 +16,18 @@ import matplotlib.pyplot as plot
 import re
 import numpy as np
 
+from coupling import CouplingGraph, coupling_graph
+
 
 
 def draw_subtopology(
     hybrid_topology : Graph,
-    physical_topology : Graph,
+    physical_topology : Graph | CouplingGraph,
     qudit_group : Sequence[int],
     save_path : str,
 ) -> None:    
-    logical_edges = [(u,v) for (u,v) in hybrid_topology.edges if (u,v) 
-        not in physical_topology.edges and (v,u) not in physical_topology.edges]
+    logical_edges = [(u,v) for (u,v) in hybrid_topology.edges if not
+        physical_topology.has_edge(u,v)]
     subgraph = hybrid_topology.subgraph(qudit_group)
     colored_subgraph = Graph()
     colored_subgraph.add_nodes_from(qudit_group)
@@ -77,10 +79,9 @@ if __name__ == "__main__":
 
     coup = re.findall("mesh_\d+_\d+", args.hybrid_topology)[0]
     num_q_sqrt = int(re.findall("\d+", coup)[0])
-    with open(f"coupling_maps/mesh_{num_q_sqrt}_{num_q_sqrt}", "rb") as f:
-        physical = pickle.load(f)
-    physical_topology = Graph()
-    physical_topology.add_weighted_edges_from([(u,v,1) for u,v in physical])
+    physical_topology = coupling_graph(
+        f"coupling_maps/mesh_{num_q_sqrt}_{num_q_sqrt}"
+    )
 
     save_dir = f"figures/{args.hybrid_topology}"
     if not os.path.exists(save_dir):
@@ -0,0 +1,165 @@
+"""
+Classification of a block's interactions against the physical topology.
+
+An interaction of a block on qudit_group is
+	direct:   on an edge of the physical topology,
+	indirect: between qudits connected through the group, but not adjacent,
+	external: between qudits not connected within the group, so that a
+		logical edge has to be added to the hybrid topology.
+
+The distances between all qudits of a group, within the subgraph the group
+induces, are cached by frozenset(qudit_group). The interactions are then
+labeled together by indexing the distance matrix. The physical topology may
+be a networkx Graph, searched breadth first from every qudit of the group, or
+a coupling.CouplingGraph, whose precomputed all pairs distances give the
+group's adjacency without a search. Within group distances are then expanded
+from that adjacency with boolean matrix products.
+"""
+from __future__ import annotations
+from typing import Sequence
+from weakref import WeakKeyDictionary
+
+import numpy as np
+from networkx import Graph
+
+from coupling import CouplingGraph
+
+
+# Per physical topology, (index of each qudit, distances) by group
+_group_distances = WeakKeyDictionary()
+MAX_GROUPS = 4096
+
+
+def group_distances(
+	physical_topology : Graph | CouplingGraph,
+	qudit_group : Sequence[int],
+) -> tuple[dict[int,int], np.ndarray]:
+	"""
+	Distances between the qudits of a group within the subgraph it induces.
+
+	Returns:
+		index (dict[int,int]): Row of each qudit of the group.
+
+		distances (np.ndarray): Hops from qudit to qudit, -1 if not connected
+			within the group.
+	"""
+	key = frozenset(qudit_group)
+	cache = _group_distances.setdefault(physical_topology, {})
+	if key in cache:
+		return cache[key]
+
+	qudits = sorted(key)
+	index = {q : i for i, q in enumerate(qudits)}
+	if isinstance(physical_topology, CouplingGraph):
+		distances = _coupling_group_distances(physical_topology, qudits, index)
+	else:
+		distances = _search_group_distances(physical_topology, qudits, index)
+
+	if len(cache) >= MAX_GROUPS:
+		cache.clear()
+	cache[key] = (index, distances)
+	return (index, distances)
+
+
+def _search_group_distances(
+	physical_topology : Graph,
+	qudits : Sequence[int],
+	index : dict[int,int],
+) -> np.ndarray:
+	neighbors = [
+		[index[w] for w in physical_topology.neighbors(q) if w in index]
+		if q in physical_topology else [] for q in qudits
+	]
+	distances = np.full((len(qudits), len(qudits)), -1, dtype=np.int16)
+	for source in range(len(qudits)):
+		distances[source, source] = 0
+		frontier = [source]
+		hops = 0
+		while len(frontier) > 0:
+			hops += 1
+			reached = []
+			for v in frontier:
+				for w in neighbors[v]:
+					if distances[source, w] < 0:
+						distances[source, w] = hops
+						reached.append(w)
+			frontier = reached
+	return distances
+
+
+def _coupling_group_distances(
+	physical_topology : CouplingGraph,
+	qudits : Sequence[int],
+	index : dict[int,int],
+) -> np.ndarray:
+	inside = [q for q in qudits if q in physical_topology]
+	rows = [index[q] for q in inside]
+	adjacency = np.zeros((len(qudits), len(qudits)), dtype=bool)
+	adjacency[np.ix_(rows, rows)] = \
+		physical_topology.distances[np.ix_(inside, inside)] == 1
+
+	distances = np.full((len(qudits), len(qudits)), -1, dtype=np.int16)
+	np.fill_diagonal(distances, 0)
+	reached = np.eye(len(qudits), dtype=bool)
+	for hops in range(1, len(qudits)):
+		frontier = (reached.astype(np.int32) @ adjacency) > 0
+		new = frontier & ~reached
+		if not new.any():
+			break
+		distances[new] = hops
+		reached |= new
+	return distances
+
+
+def classify_edges(
+	logical_operations : Sequence[Sequence[int]],
+	physical_topology : Graph | CouplingGraph,
+	qudit_group : Sequence[int],
+) -> tuple[list[tuple[int,int]], list[tuple[int,int]], list[tuple[int,int]]]:
+	"""
+	Split the interactions of a block on qudit_group into direct, indirect
+	and external interactions, each kept in order.
+
+	Interactions with a qudit outside of the group are direct if they are on
+	a physical edge and external otherwise.
+
+	Returns:
+		direct (list[tuple[int,int]]): Interactions on physical edges.
+
+		indirect (list[tuple[int,int]]): Interactions connected through the
+			group.
+
+		external (list[tuple[int,int]]): Interactions not connected through
+			the group.
+	"""
+	(index, distances) = group_distances(physical_topology, qudit_group)
+	edges = [(u,v) for (u,v) in logical_operations]
+	if len(edges) == 0:
+		return ([], [], [])
+	rows = np.array([index.get(u, -1) for (u,_) in edges])
+	cols = np.array([index.get(v, -1) for (_,v) in edges])
+	in_group = (rows >= 0) & (cols >= 0)
+	hops = np.where(in_group, distances[rows, cols], -1)
+	outside = [
+		i for i in np.flatnonzero(~in_group)
+		if physical_topology.has_edge(*edges[i])
+	]
+	is_direct = hops == 1
+	is_direct[outside] = True
+	is_indirect = (hops >= 0) & ~is_direct
+	direct = [edges[i] for i in np.flatnonzero(is_direct)]
+	indirect = [edges[i] for i in np.flatnonzero(is_indirect)]
+	external = [edges[i] for i in np.flatnonzero(~is_direct & ~is_indirect)]
+	return (direct, indirect, external)
+
+
+def is_internal(
+	physical_topology: Graph | CouplingGraph,
+	qudit_group: Sequence[int],
+	edge: tuple[int],
+) -> bool:
+	"""True if the qudits of `edge` are connected within the group."""
+	(index, distances) = group_distances(physical_topology, qudit_group)
+	if edge[0] not in index or edge[1] not in index:
+		return False
+	return bool(distances[index[edge[0]], index[edge[1]]] >= 0)
@@ -0,0 +1,171 @@
+"""
+Undirected edge sets stored as bitmasks.
+
+The edge (u,v), u < v, is bit v*(v-1)/2 + u, so the edges of a block of n
+qudits are the first n(n-1)/2 bits whatever n is: 28 bits for 8 qudits.
+Membership, equality, subsets and unions are single integer operations
+instead of scans of lists of tuples, and an EdgeSet can be hashed. Edges are
+unordered, (u,v) and (v,u) are the same edge. Self loops are not edges.
+"""
+from __future__ import annotations
+from typing import Iterable, Iterator, Sequence
+from collections import Counter
+
+import numpy as np
+
+
+def edge_bit(u : int, v : int) -> int:
+	"""Bit of the edge (u,v) in an EdgeSet mask."""
+	if u > v:
+		(u,v) = (v,u)
+	return v * (v - 1) // 2 + u
+
+
+def bit_edge(bit : int) -> tuple[int,int]:
+	"""The edge (u,v), u < v, of a bit in an EdgeSet mask."""
+	v = 1
+	while (v + 1) * v // 2 <= bit:
+		v += 1
+	return (bit - v * (v - 1) // 2, v)
+
+
+def num_edge_bits(num_qudits : int) -> int:
+	"""Number of possible edges between num_qudits qudits."""
+	return num_qudits * (num_qudits - 1) // 2
+
+
+def _bits(mask : int) -> Iterator[int]:
+	while mask:
+		low = mask & -mask
+		yield low.bit_length() - 1
+		mask ^= low
+
+
+class EdgeSet:
+
+	__slots__ = ("mask",)
+
+	def __init__(
+		self,
+		edges : Iterable[Sequence[int]] = (),
+	):
+		"""
+		Arguments:
+			edges (Iterable[Sequence[int]]): Edges as pairs of vertices, or a
+				networkx Graph.
+		"""
+		if hasattr(edges, "edges"):
+			edges = edges.edges
+		mask = 0
+		for (u,v) in edges:
+			if u != v:
+				mask |= 1 << edge_bit(u, v)
+		self.mask = mask
+
+
+	@classmethod
+	def from_mask(cls, mask : int) -> EdgeSet:
+		edge_set = cls.__new__(cls)
+		edge_set.mask = mask
+		return edge_set
+
+
+	def __contains__(self, edge : Sequence[int]) -> bool:
+		(u,v) = edge
+		return u != v and bool((self.mask >> edge_bit(u, v)) & 1)
+
+
+	def __iter__(self) -> Iterator[tuple[int,int]]:
+		"""Edges as (u,v) with u < v, in bit order."""
+		for bit in _bits(self.mask):
+			yield bit_edge(bit)
+
+
+	def __len__(self) -> int:
+		# int.bit_count needs Python 3.10
+		return bin(self.mask).count("1")
+
+
+	def __bool__(self) -> bool:
+		return self.mask != 0
+
+
+	def __eq__(self, other : object) -> bool:
+		if not isinstance(other, EdgeSet):
+			return NotImplemented
+		return self.mask == other.mask
+
+
+	def __hash__(self) -> int:
+		return hash(self.mask)
+
+
+	def __or__(self, other : EdgeSet) -> EdgeSet:
+		return EdgeSet.from_mask(self.mask | other.mask)
+
+
+	def __and__(self, other : EdgeSet) -> EdgeSet:
+		return EdgeSet.from_mask(self.mask & other.mask)
+
+
+	def __sub__(self, other : EdgeSet) -> EdgeSet:
+		return EdgeSet.from_mask(self.mask & ~other.mask)
+
+
+	def __xor__(self, other : EdgeSet) -> EdgeSet:
+		return EdgeSet.from_mask(self.mask ^ other.mask)
+
+
+	def __le__(self, other : EdgeSet) -> bool:
+		return self.mask & ~other.mask == 0
+
+
+	def __repr__(self) -> str:
+		return f"EdgeSet({list(self)})"
+
+
+	def edges(self) -> list[tuple[int,int]]:
+		return list(self)
+
+
+	def induced(self, vertices : Iterable[int]) -> EdgeSet:
+		"""Edges with both ends in `vertices`."""
+		vertices = set(vertices)
+		mask = 0
+		for bit in _bits(self.mask):
+			(u,v) = bit_edge(bit)
+			if u in vertices and v in vertices:
+				mask |= 1 << bit
+		return EdgeSet.from_mask(mask)
+
+
+	def degrees(self, num_qudits : int) -> list[int]:
+		degrees = [0] * num_qudits
+		for (u,v) in self:
+			degrees[u] += 1
+			degrees[v] += 1
+		return degrees
+
+
+	def score(self, freqs : Sequence[int] | Counter) -> int:
+		"""Sum of the frequencies of the edges in the set."""
+		return sum([freqs[bit] for bit in _bits(self.mask)])
+
+
+def edge_frequencies(
+	edges : Iterable[Sequence[int]],
+	num_qudits : int | None = None,
+) -> np.ndarray | Counter:
+	"""
+	How often each edge appears in `edges`, indexed by edge bit. A numpy
+	vector of length num_edge_bits(num_qudits) if num_qudits is given, edges
+	outside it are dropped. Otherwise a Counter, which has no size limit.
+	"""
+	counts = Counter([edge_bit(u, v) for (u,v) in edges if u != v])
+	if num_qudits is None:
+		return counts
+	freqs = np.zeros(num_edge_bits(num_qudits), dtype=np.int64)
+	for bit, count in counts.items():
+		if bit < len(freqs):
+			freqs[bit] = count
+	return freqs
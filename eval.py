@@ -2,6 +2,8 @@ from sys import argv
 from os import listdir
 from re import match
 
+from partition_store import open_partition
+
 def count_cx(qasm_file):
 	count = 0
 	with open(qasm_file, "r") as f:
@@ -11,16 +13,15 @@ def count_cx(qasm_file):
 	return count
 
 if __name__ == "__main__":
-	blocks = sorted(listdir(argv[1]))
+	partition = open_partition(argv[1])
 	synths = sorted(listdir(argv[2]))
-	blocks.remove("structure.pickle")
 	for b in synths:
 		if not b.endswith(".qasm"):
 			synths.remove(b)
 
 	string = ""
-	for num in range(len(blocks)):
-		orig = count_cx(f"{argv[1]}/{blocks[num]}")
+	for num in range(len(partition)):
+		orig = count_cx(partition.block_path(num))
 		opti = count_cx(f"{argv[2]}/{synths[num]}")
 		string += f"{orig}, {opti}\n"
 		
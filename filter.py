@@ -6,7 +6,7 @@ overall performance of a circuit.
 import argparse
 import os
 import bqskit
-from topology import kernel_type
+from graph_table import kernel_difficulty
 from bqskit.ir.gates.constant.cx import CNOTGate
 
 
@@ -20,21 +20,10 @@ def score_connectivity(circuit):
 	5 : 'theta'
 	6 : 'all'
 	"""
-	edges= set([])
-	for op in circuit:
-		if len(op.location) == 2:
-			edges.add(op.location)
-	
-	# line < star < ring < kite < theta < alls
-	tops = ('discon', 'line', 'star', 'ring', 'kite', 'theta', 'all')
-	type = kernel_type(edges, circuit.num_qudits)
-
-	top_score = 6
-	for score, t in enumerate(tops):
-		if t in type:
-			top_score = score
+	edges = [op.location for op in circuit if len(op.location) == 2]
 
-	return top_score
+	# line < star < ring < kite < theta < alls, see graph_table.py
+	return kernel_difficulty(edges, circuit.num_qudits)
 
 
 def check_if_should_substitute(
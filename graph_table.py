@@ -0,0 +1,242 @@
+"""
+Lookup table of kernel shapes.
+
+Every graph on up to 7 vertices (the graphs of networkx's graph atlas) is
+stored under its canonical form, the smallest EdgeSet mask of any relabeling
+of its vertices, with its name, its number of automorphisms and how difficult
+it is to synthesize to. Classifying a kernel is then a canonicalization,
+cached per kernel, and a dictionary lookup instead of a chain of degree list
+checks.
+
+Isolated vertices are ignored when naming a kernel, so a 3-line in a block of
+4 qudits is still a 3-line. Shapes with a template (see templates.py) keep
+their template's name, other shapes are named after their atlas entry, e.g.
+"5-atlas96". Kernels with more than 7 connected vertices are named only if
+they belong to a template family.
+"""
+from __future__ import annotations
+from typing import Sequence
+from functools import lru_cache
+from itertools import permutations
+from math import factorial
+
+import numpy as np
+from networkx import graph_atlas_g
+
+from edge_set import EdgeSet
+from templates import (
+	ALLS_3, ALLS_4, ALLS_5, DIPPER_5, DISCON_2_2, DISCON_2_3, KITE_4, LINE_2,
+	LINE_3, LINE_4, LINE_5, RING_4, STAR_4, STAR_5, TEES_5, THETA_4,
+	LARGE_FAMILIES, family_name,
+)
+
+
+# Largest number of connected vertices in the table
+MAX_TABLE_VERTICES = 7
+
+# Shapes named by hand, whose names carry their difficulty
+LABELLED_SHAPES = {
+	"2-line" : LINE_2,
+	"3-line" : LINE_3,
+	"3-all" : ALLS_3,
+	"2-2-discon" : DISCON_2_2,
+	"4-line" : LINE_4,
+	"4-star" : STAR_4,
+	"4-ring" : RING_4,
+	"4-kite" : KITE_4,
+	"4-theta" : THETA_4,
+	"4-all" : ALLS_4,
+	"2-3-discon" : DISCON_2_3,
+	"5-line" : LINE_5,
+	"5-tee" : TEES_5,
+	"5-star" : STAR_5,
+	"5-dipper" : DIPPER_5,
+	"5-all" : ALLS_5,
+}
+NAMED_SHAPES = dict(LABELLED_SHAPES)
+for _n in range(6, MAX_TABLE_VERTICES + 1):
+	for _family, _template in LARGE_FAMILIES.items():
+		NAMED_SHAPES[f"{_n}-{_family}"] = _template(_n)
+
+# Difficulty of shapes, easiest first, as filter.py has always ranked them.
+# Shapes in LABELLED_SHAPES rank by the last of these words in their name,
+# other shapes by their structure (see _structural_difficulty).
+DIFFICULTY_WORDS = ('discon', 'line', 'star', 'ring', 'kite', 'theta', 'all')
+
+
+@lru_cache(maxsize=None)
+def _permutations(num_vertices : int) -> np.ndarray:
+	return np.array(
+		list(permutations(range(num_vertices))), dtype=np.int64
+	).reshape(factorial(num_vertices), num_vertices)
+
+
+@lru_cache(maxsize=65536)
+def canonical_form(mask : int, num_vertices : int) -> tuple[int,int]:
+	"""
+	Canonical form of a graph given as an EdgeSet mask.
+
+	Returns:
+		canonical_mask (int): Smallest mask of any relabeling of the graph.
+
+		automorphisms (int): Number of relabelings that leave the graph
+			unchanged.
+	"""
+	edges = EdgeSet.from_mask(mask).edges()
+	if len(edges) == 0:
+		return (0, factorial(num_vertices))
+	perms = _permutations(num_vertices)
+	u = perms[:, [e[0] for e in edges]]
+	v = perms[:, [e[1] for e in edges]]
+	(low, high) = (np.minimum(u, v), np.maximum(u, v))
+	masks = np.bitwise_or.reduce(
+		np.left_shift(1, high * (high - 1) // 2 + low), axis=1
+	)
+	canonical_mask = int(masks.min())
+	# Relabelings reaching the smallest mask are a coset of the automorphisms
+	return (canonical_mask, int(np.count_nonzero(masks == canonical_mask)))
+
+
+def _connected_part(
+	kernel_edges : Sequence[Sequence[int]],
+) -> tuple[int, int]:
+	"""The EdgeSet mask and size of a kernel without its isolated vertices."""
+	edge_set = EdgeSet(kernel_edges)
+	vertices = sorted(set([q for edge in edge_set for q in edge]))
+	local = {q : i for i, q in enumerate(vertices)}
+	return (
+		EdgeSet([(local[u], local[v]) for (u,v) in edge_set]).mask,
+		len(vertices),
+	)
+
+
+def _structural_difficulty(mask : int, num_vertices : int) -> int:
+	"""
+	Difficulty of an unnamed shape on the DIFFICULTY_WORDS scale: forests
+	rank as lines or stars, graphs with one cycle as rings, or kites if
+	anything hangs off the cycle, graphs with more cycles as thetas.
+	"""
+	edges = EdgeSet.from_mask(mask)
+	degrees = edges.degrees(num_vertices)
+	if len(edges) == num_vertices * (num_vertices - 1) // 2:
+		return DIFFICULTY_WORDS.index("all")
+	parent = list(range(num_vertices))
+	def find(x):
+		while parent[x] != x:
+			x = parent[x]
+		return x
+	for (u,v) in edges:
+		parent[find(u)] = find(v)
+	components = len(set([find(q) for q in range(num_vertices)]))
+	cycles = len(edges) - num_vertices + components
+	if cycles == 0:
+		return DIFFICULTY_WORDS.index("line" if max(degrees) <= 2 else "star")
+	elif cycles == 1:
+		return DIFFICULTY_WORDS.index("ring" if max(degrees) == 2 else "kite")
+	return DIFFICULTY_WORDS.index("theta")
+
+
+def _word_difficulty(name : str) -> int:
+	difficulty = len(DIFFICULTY_WORDS) - 1
+	for score, word in enumerate(DIFFICULTY_WORDS):
+		if word in name:
+			difficulty = score
+	return difficulty
+
+
+def _shape_difficulty(name : str, mask : int, num_vertices : int) -> int:
+	if name in LABELLED_SHAPES:
+		return _word_difficulty(name)
+	return _structural_difficulty(mask, num_vertices)
+
+
+@lru_cache(maxsize=None)
+def shape_table(num_vertices : int) -> dict[int, tuple[str, int, int]]:
+	"""
+	(name, automorphisms, difficulty) of every graph on num_vertices
+	vertices, none of them isolated, by canonical mask.
+	"""
+	names = {}
+	for name, template in NAMED_SHAPES.items():
+		(mask, size) = _connected_part(template)
+		if size == num_vertices:
+			names[canonical_form(mask, size)[0]] = name
+	table = {}
+	for index, graph in enumerate(graph_atlas_g()):
+		if graph.number_of_nodes() != num_vertices:
+			continue
+		if any([degree == 0 for (_, degree) in graph.degree()]):
+			continue
+		(canonical_mask, automorphisms) = canonical_form(
+			EdgeSet(graph).mask, num_vertices
+		)
+		name = names.get(canonical_mask, f"{num_vertices}-atlas{index}")
+		difficulty = _shape_difficulty(name, canonical_mask, num_vertices)
+		table[canonical_mask] = (name, automorphisms, difficulty)
+	return table
+
+
+@lru_cache(maxsize=65536)
+def _classify(mask : int, num_vertices : int, num_isolated : int):
+	if mask == 0:
+		return ("empty", factorial(num_isolated), _word_difficulty("empty"))
+	isolated = factorial(num_isolated)
+	if num_vertices <= MAX_TABLE_VERTICES:
+		(canonical_mask, _) = canonical_form(mask, num_vertices)
+		(name, automorphisms, difficulty) = \
+			shape_table(num_vertices)[canonical_mask]
+		return (name, automorphisms * isolated, difficulty)
+	family = family_name(EdgeSet.from_mask(mask).edges(), num_vertices)
+	(_, automorphisms) = canonical_form(mask, num_vertices)
+	if family is None:
+		return (
+			"unknown",
+			automorphisms * isolated,
+			_structural_difficulty(mask, num_vertices),
+		)
+	name = f"{num_vertices}-{family}"
+	return (
+		name,
+		automorphisms * isolated,
+		_shape_difficulty(name, mask, num_vertices),
+	)
+
+
+def classify_kernel(
+	kernel_edges : Sequence[Sequence[int]],
+	num_qudits : int,
+) -> tuple[str, int, int]:
+	"""
+	Look up the shape of a kernel.
+
+	Args:
+		kernel_edges (Sequence[Sequence[int]]): Edges of the kernel, or a
+			networkx Graph. Direction and repeated edges are ignored.
+
+		num_qudits (int): Number of qudits of the block.
+
+	Returns:
+		name (str): Name of the shape, "empty" if there are no edges.
+
+		automorphisms (int): Number of relabelings of the block's qudits that
+			leave the kernel unchanged.
+
+		difficulty (int): Index into DIFFICULTY_WORDS, higher is harder to
+			synthesize to.
+	"""
+	(mask, num_vertices) = _connected_part(kernel_edges)
+	return _classify(mask, num_vertices, max(num_qudits - num_vertices, 0))
+
+
+def kernel_shape_name(
+	kernel_edges : Sequence[Sequence[int]],
+	num_qudits : int,
+) -> str:
+	return classify_kernel(kernel_edges, num_qudits)[0]
+
+
+def kernel_difficulty(
+	kernel_edges : Sequence[Sequence[int]],
+	num_qudits : int,
+) -> int:
+	return classify_kernel(kernel_edges, num_qudits)[2]
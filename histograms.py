@@ -6,7 +6,6 @@ logical-physical topology.
 from __future__ import annotations
 import os
 import pickle
-from posix import listdir
 
 from networkx import Graph
 import argparse
@@ -14,26 +13,26 @@ import matplotlib.pyplot as plot
 import re
 import statistics
 
+from partition_store import open_partition
+
 
 
 def cnot_histograms(
     partition_dir : str,
 ) -> None:
     # TODO: Implement support for non-qasm checkpointing
-    block_files = sorted(listdir(partition_dir))
-    block_names = [x.split("/")[-1].split(".")[0] for x in block_files]
-    block_names.remove("structure")
+    partition = open_partition(partition_dir)
 
     # Get CNOT counts for each block
     cnots_list = []
-    for block in block_names:
+    for block_num in range(len(partition)):
         # Get CNOT count
         cnots = 0
-        with open(f"{partition_dir}/{block}.qasm", "r") as qasmfile:
-            for line in qasmfile:
-                if re.match("cx", line):
-                    cnots += 1
+        for line in partition.block_qasm(block_num).splitlines():
+            if re.match("cx", line):
+                cnots += 1
         cnots_list.append(cnots)
+    partition.close()
     
     # Create a histogram
     cnots_set = set(cnots_list)
@@ -99,20 +98,18 @@ def volume_histograms(
 
 def block_stats(partition_dir : str):
     # TODO: Implement support for non-qasm checkpointing
-    block_files = sorted(listdir(partition_dir))
-    block_names = [x.split("/")[-1].split(".")[0] for x in block_files]
-    block_names.remove("structure")
+    partition = open_partition(partition_dir)
 
     # Get CNOT counts for each block
     cnots_list = []
-    for block in block_names:
+    for block_num in range(len(partition)):
         # Get CNOT count
         cnots = 0
-        with open(f"{partition_dir}/{block}.qasm", "r") as qasmfile:
-            for line in qasmfile:
-                if re.match("cx", line):
-                    cnots += 1
+        for line in partition.block_qasm(block_num).splitlines():
+            if re.match("cx", line):
+                cnots += 1
         cnots_list.append(cnots)
+    partition.close()
     
     mean = statistics.mean(cnots_list)
     median = statistics.median(cnots_list)
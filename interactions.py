@@ -0,0 +1,203 @@
+"""
+Two qudit interactions of a block, extracted in one pass.
+
+Every interaction is an edge (a,b), a < b, taken from the first two qudits of
+a gate on more than one qudit. A single pass gives the interactions in order,
+how often each edge occurs and how often each qudit is used. Edges are
+counted with a Counter rather than with list.count per distinct edge.
+
+Blocks in files can be read with block_interactions, which streams the QASM
+line by line and never builds a bqskit Circuit.
+"""
+from __future__ import annotations
+from typing import Iterable, Sequence
+from collections import Counter
+from os.path import exists
+from re import compile, findall, match
+
+from bqskit import Circuit
+
+from partition_store import find_block_qasm
+
+
+# Statements that are not gates
+_NOT_GATES = (
+	"OPENQASM", "include", "qreg", "creg", "measure", "barrier", "reset", "if",
+	"opaque",
+)
+_QREG = compile(r"qreg\s+(\w+)\s*\[\s*(\d+)\s*\]")
+_OPERAND = compile(r"(\w+)\s*\[\s*(\d+)\s*\]")
+
+
+def check_multi(qasm_line) -> tuple[int] | None:
+	"""
+	Determine if a line of QASM code is a multi-qubit interaction. If it is,
+	return a tuple of ints (control, target).
+	"""
+	if bool(match("cx", qasm_line)) or bool(match("swap", qasm_line)):
+		# line is in the form - cx q[<control>], q[<target>];
+		q = findall('\d+', qasm_line)
+		u = min(int(q[0]), int(q[1]))
+		v = max(int(q[0]), int(q[1]))
+		return (u,v)
+	else:
+		return None
+
+
+def _count(
+	locations : Iterable[Sequence[int]],
+	qudits : Sequence[int],
+	qudit_group : Sequence[int] | None,
+) -> tuple[list[tuple[int,int]], Counter, dict[int,int]]:
+	logical_operations = []
+	frequencies = Counter()
+	vertex_uses = {x:0 for x in qudits}
+	for location in locations:
+		if qudit_group is not None:
+			(a,b) = (qudit_group[location[0]], qudit_group[location[1]])
+		else:
+			(a,b) = (location[0], location[1])
+		edge = (a,b) if a < b else (b,a)
+		logical_operations.append(edge)
+		frequencies[edge] += 1
+		vertex_uses[a] = vertex_uses.get(a, 0) + 1
+		vertex_uses[b] = vertex_uses.get(b, 0) + 1
+	return (logical_operations, frequencies, vertex_uses)
+
+
+def count_interactions(
+	circuit : Circuit,
+	qudit_group : Sequence[int] | None = None,
+) -> tuple[list[tuple[int,int]], Counter, dict[int,int]]:
+	"""
+	Interactions of a circuit.
+
+	Args:
+		circuit (Circuit): The block.
+
+		qudit_group (Sequence[int] | None): If given, qudit q of the block is
+			relabeled qudit_group[q].
+
+	Returns:
+		logical_operations (list[tuple[int,int]]): Edge of each multi qudit
+			gate, in the order the circuit is iterated.
+
+		frequencies (Counter): Number of gates on each edge.
+
+		vertex_uses (dict[int,int]): Number of gates on each qudit, including
+			unused qudits.
+	"""
+	qudits = qudit_group if qudit_group is not None \
+		else range(circuit.num_qudits)
+	return _count(
+		(op.location for op in circuit if len(op.location) > 1),
+		qudits,
+		qudit_group,
+	)
+
+
+def _qasm_locations(
+	lines : Iterable[str],
+	registers : dict[str,int],
+) -> Iterable[tuple[int]]:
+	"""
+	Qudits of each multi qudit gate in QASM lines. Quantum registers are laid
+	out one after another in the order they are declared, as bqskit does, and
+	their sizes are collected into `registers` as they are read.
+	"""
+	offsets = {}
+	in_definition = False
+	for line in lines:
+		line = line.split("//")[0]
+		for statement in line.split(";"):
+			statement = statement.strip()
+			if in_definition:
+				if "}" in statement:
+					in_definition = False
+				continue
+			if len(statement) == 0:
+				continue
+			# Gate definitions run until their closing brace
+			if statement.startswith("gate"):
+				in_definition = "}" not in statement
+				continue
+			if statement.startswith("qreg"):
+				qreg = _QREG.match(statement)
+				offsets[qreg.group(1)] = sum(registers.values())
+				registers[qreg.group(1)] = int(qreg.group(2))
+				continue
+			if statement.startswith(_NOT_GATES):
+				continue
+			# Skip the parameters, which may hold expressions
+			if ")" in statement:
+				statement = statement[statement.rindex(")") + 1:]
+			operands = _OPERAND.findall(statement)
+			if len(operands) > 1:
+				yield tuple(
+					offsets.get(name, 0) + int(index) for (name, index) in operands
+				)
+
+
+def qasm_interactions(
+	lines : Iterable[str],
+	qudit_group : Sequence[int] | None = None,
+) -> tuple[list[tuple[int,int]], Counter, dict[int,int]]:
+	"""
+	count_interactions for QASM, read one line at a time. Interactions are in
+	program order. Gates applied to whole registers at once are not counted.
+
+	Args:
+		lines (Iterable[str]): QASM lines, e.g. an open file.
+
+		qudit_group (Sequence[int] | None): See count_interactions.
+
+	Returns:
+		See count_interactions.
+	"""
+	registers = {}
+	(logical_operations, frequencies, vertex_uses) = _count(
+		_qasm_locations(lines, registers), (), qudit_group,
+	)
+	qudits = qudit_group if qudit_group is not None \
+		else range(sum(registers.values()))
+	uses = {q:0 for q in qudits}
+	uses.update(vertex_uses)
+	return (logical_operations, frequencies, uses)
+
+
+def block_interactions(
+	block_path : str,
+	qudit_group : Sequence[int] | None = None,
+) -> tuple[list[tuple[int,int]], Counter, dict[int,int]]:
+	"""
+	qasm_interactions of a QASM block file, also found in partition stores
+	(see partition_store.py).
+	"""
+	if not exists(block_path):
+		qasm = find_block_qasm(block_path)
+		if qasm is not None:
+			return qasm_interactions(qasm.splitlines(), qudit_group)
+	with open(block_path, "r") as f:
+		return qasm_interactions(f, qudit_group)
+
+
+def get_logical_operations(
+	circuit: Circuit,
+	qudit_group: Sequence[int] | None = None,
+) -> Sequence[Sequence[int]]:
+	return count_interactions(circuit, qudit_group)[0]
+
+
+def get_frequencies(
+	circuit: Circuit,
+	qudit_group: Sequence[int] | None = None,
+) -> Counter:
+	return count_interactions(circuit, qudit_group)[1]
+
+
+def get_num_vertex_uses(logical_operations, num_qudits) -> dict[int,int]:
+	degrees = {x:0 for x in range(num_qudits)}
+	for a,b in logical_operations:
+		degrees[a] += 1
+		degrees[b] += 1
+	return degrees
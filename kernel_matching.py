@@ -0,0 +1,265 @@
+"""
+Batched kernel matching.
+
+Fitting a kernel scores every template under every vertex permutation. Here
+a block's interactions are counted once into a vector of per-edge
+frequencies, and every distinct labeled kernel of the templates (see
+templates.kernel_table) is scored at once as a product of that vector with
+the table's kernel-by-edge incidence matrix.
+
+Whole partitions are scored together by best_permuted_kernels: the frequency
+vectors of all blocks with the same width and templates are stacked into one
+matrix and multiplied with the table once.
+
+Tables grow with n!, so blocks of more than 5 qudits are instead matched by a
+branch and bound search that places template vertices on qudits one at a
+time and abandons a partial placement once even the most frequent remaining
+interactions could not beat the best kernel found so far.
+"""
+from __future__ import annotations
+from typing import Sequence
+
+import numpy as np
+
+from edge_set import bit_edge, edge_frequencies, num_edge_bits
+from templates import kernel_table
+
+
+# Largest block matched with a kernel table, bigger blocks are searched
+MAX_TABLE_QUDITS = 5
+
+
+def best_permuted_kernel(
+	logical_ops : Sequence[tuple[int]],
+	templates : Sequence[Sequence[tuple[int]]],
+	num_qudits : int,
+) -> Sequence[tuple[int]]:
+	"""
+	The permuted template covering the most interactions of a block.
+
+	Gives the same kernel as scoring each template under each permutation in
+	turn with kernel_score_function and keeping the first strictly better
+	edge score.
+
+	Args:
+		logical_ops (Sequence[tuple[int]]): Two qudit interactions of the
+			block, one entry per gate.
+
+		templates (Sequence[Sequence[tuple[int]]]): Kernel templates.
+
+		num_qudits (int): Number of qudits in the block.
+
+	Returns:
+		kernel (Sequence[tuple[int]]): Edges of the best kernel, or an empty
+			list if no kernel covers any interaction.
+	"""
+	if len(templates) == 0:
+		return []
+	if num_qudits > MAX_TABLE_QUDITS:
+		return search_permuted_kernel(logical_ops, templates, num_qudits)
+	table = kernel_table(templates, num_qudits)
+	scores = table.incidence @ edge_frequencies(logical_ops, num_qudits)
+	# argmax returns the first maximum, as the serial search does
+	best = int(np.argmax(scores))
+	if scores[best] <= 0:
+		return []
+	return list(table.kernels[best])
+
+
+def best_permuted_kernels(
+	block_ops : Sequence[Sequence[tuple[int]]],
+	block_templates : Sequence[Sequence[Sequence[tuple[int]]]],
+	widths : Sequence[int],
+) -> list[Sequence[tuple[int]]]:
+	"""
+	best_permuted_kernel of many blocks at once.
+
+	Args:
+		block_ops (Sequence[Sequence[tuple[int]]]): Two qudit interactions
+			of each block.
+
+		block_templates (Sequence[Sequence[Sequence[tuple[int]]]]): Kernel
+			templates of each block.
+
+		widths (Sequence[int]): Number of qudits in each block.
+
+	Returns:
+		kernels (list[Sequence[tuple[int]]]): Kernel of each block, as
+			best_permuted_kernel gives it.
+	"""
+	kernels = [[] for _ in range(len(block_ops))]
+	groups = {}
+	for block_num, (templates, num_qudits) in \
+		enumerate(zip(block_templates, widths)):
+		if len(templates) == 0:
+			continue
+		if num_qudits > MAX_TABLE_QUDITS:
+			kernels[block_num] = search_permuted_kernel(
+				block_ops[block_num], templates, num_qudits
+			)
+			continue
+		key = (
+			num_qudits,
+			tuple(tuple(tuple(edge) for edge in t) for t in templates),
+		)
+		groups.setdefault(key, []).append(block_num)
+
+	for (num_qudits, templates), members in groups.items():
+		table = kernel_table(templates, num_qudits)
+		freqs = stacked_frequencies(
+			[block_ops[block_num] for block_num in members], num_qudits
+		)
+		scores = freqs @ table.incidence.T
+		best = np.argmax(scores, axis=1)
+		for row, block_num in enumerate(members):
+			if scores[row, best[row]] > 0:
+				kernels[block_num] = list(table.kernels[best[row]])
+	return kernels
+
+
+def stacked_frequencies(
+	block_ops : Sequence[Sequence[tuple[int]]],
+	num_qudits : int,
+) -> np.ndarray:
+	"""
+	edge_frequencies of each block as the rows of one matrix, counted with a
+	single np.add.at over the interactions of every block.
+	"""
+	num_bits = num_edge_bits(num_qudits)
+	freqs = np.zeros((len(block_ops), num_bits), dtype=np.int64)
+	lengths = [len(ops) for ops in block_ops]
+	if sum(lengths) == 0:
+		return freqs
+	ops = np.array(
+		[edge for ops in block_ops for edge in ops], dtype=np.int64
+	).reshape(-1, 2)
+	rows = np.repeat(np.arange(len(block_ops)), lengths)
+	(low, high) = (ops.min(axis=1), ops.max(axis=1))
+	bits = high * (high - 1) // 2 + low
+	# Self loops and edges outside the block are dropped, as in edge_frequencies
+	keep = (low != high) & (high < num_qudits)
+	np.add.at(freqs, (rows[keep], bits[keep]), 1)
+	return freqs
+
+
+def _search_order(
+	template : Sequence[tuple[int]],
+	num_qudits : int,
+) -> list[int]:
+	"""
+	Template vertices in the order they are placed: breadth first from the
+	highest degree vertex, so that each placement closes edges early.
+	"""
+	neighbors = {v : [] for v in range(num_qudits)}
+	for (u,v) in template:
+		neighbors[u].append(v)
+		neighbors[v].append(u)
+	order = []
+	while len(order) < num_qudits:
+		start = max(
+			[v for v in range(num_qudits) if v not in order],
+			key=lambda v: len(neighbors[v]),
+		)
+		queue = [start]
+		order.append(start)
+		while len(queue) > 0:
+			v = queue.pop(0)
+			for w in sorted(neighbors[v], key=lambda w: -len(neighbors[w])):
+				if w not in order:
+					order.append(w)
+					queue.append(w)
+	return order
+
+
+def search_permuted_kernel(
+	logical_ops : Sequence[tuple[int]],
+	templates : Sequence[Sequence[tuple[int]]],
+	num_qudits : int,
+) -> Sequence[tuple[int]]:
+	"""
+	Branch and bound version of best_permuted_kernel for larger blocks. It
+	finds a placement with the maximum score, ties are broken by template
+	order and then by search order.
+
+	Args:
+		logical_ops (Sequence[tuple[int]]): Two qudit interactions of the
+			block, one entry per gate.
+
+		templates (Sequence[Sequence[tuple[int]]]): Kernel templates.
+
+		num_qudits (int): Number of qudits in the block.
+
+	Returns:
+		kernel (Sequence[tuple[int]]): Edges of the best kernel, or an empty
+			list if no kernel covers any interaction.
+	"""
+	freq_vector = edge_frequencies(logical_ops, num_qudits)
+	freqs = [[0] * num_qudits for _ in range(num_qudits)]
+	pairs = []
+	for bit, count in enumerate(freq_vector.tolist()):
+		(u,v) = bit_edge(bit)
+		freqs[u][v] = count
+		freqs[v][u] = count
+		if count > 0:
+			pairs.append((count, u, v))
+	# Most frequent pairs first, for the bound
+	pairs.sort(reverse=True)
+
+	best_score = 0
+	best_kernel = []
+	for template in templates:
+		order = _search_order(template, num_qudits)
+		position = {v : i for i, v in enumerate(order)}
+		# Edges closed by placing each vertex, as the earlier endpoint
+		closes = [[] for _ in range(num_qudits)]
+		for (u,v) in template:
+			(first, last) = sorted([u, v], key=lambda x: position[x])
+			closes[position[last]].append(first)
+		remaining = [
+			sum([len(closes[j]) for j in range(i, num_qudits)])
+			for i in range(num_qudits + 1)
+		]
+		placement = {}
+		used = [False] * num_qudits
+
+		def bound(depth : int) -> int:
+			"""Score the edges not yet closed could add at most."""
+			left = remaining[depth]
+			total = 0
+			for (count, u, v) in pairs:
+				if left == 0:
+					break
+				# Pairs between placed qudits can no longer be used
+				if used[u] and used[v]:
+					continue
+				total += count
+				left -= 1
+			return total
+
+		def place(depth : int, score : int) -> None:
+			nonlocal best_score, best_kernel
+			if depth == num_qudits:
+				if score > best_score:
+					best_score = score
+					best_kernel = [
+						(
+							min(placement[u], placement[v]),
+							max(placement[u], placement[v]),
+						) for (u,v) in template
+					]
+				return
+			if score + bound(depth) <= best_score:
+				return
+			vertex = order[depth]
+			for qudit in range(num_qudits):
+				if used[qudit]:
+					continue
+				gain = sum([freqs[qudit][placement[w]] for w in closes[depth]])
+				used[qudit] = True
+				placement[vertex] = qudit
+				place(depth + 1, score + gain)
+				used[qudit] = False
+				del placement[vertex]
+
+		place(0, 0)
+	return best_kernel
@@ -0,0 +1,185 @@
+"""
+Memo of kernel selections. Blocks of a benchmark often interact in exactly
+the same way up to a relabeling of their qudits (every block of a QFT ladder
+does), so the kernel chosen for one of them is reused for the others.
+
+Entries are keyed by the canonical form of the block's weighted interaction
+graph together with the selector, its settings (including its templates) and
+MEMO_VERSION. The kernel is always selected for the block in the canonical
+labeling, stored in it and relabeled back onto each block, so every relabeling
+of a block gets the same kernel whether it hits or misses. When several
+kernels score the same, that may be another one than the selector would pick
+for the block's own labeling. Entries are kept in memory for the life of the
+process and, if a memo directory is given, in files that every process of a
+sweep shares. Without a memo directory, kernels are selected for the block's
+own labeling and nothing is memoized.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Sequence
+from collections import OrderedDict
+from hashlib import sha256
+from math import factorial, prod
+from os import getpid, makedirs, replace
+from os.path import exists
+import pickle
+
+from edge_set import bit_edge, edge_frequencies
+from synthesis_cache import class_permutations, inverse_permutation
+
+
+# Blocks with more labelings than this to compare are not memoized
+MAX_RELABELINGS = 5040
+MAX_ENTRIES = 4096
+
+# Part of every key, changed whenever selectors pick other kernels than the
+# ones already memoized
+MEMO_VERSION = 2
+
+_memo = OrderedDict()
+
+
+def canonical_interactions(
+	logical_ops : Sequence[tuple[int]],
+	num_qudits : int,
+) -> tuple[tuple, list[int]] | None:
+	"""
+	A relabeling of the qudits of a block's interaction graph that does not
+	depend on how the block was labeled, found as in
+	synthesis_cache.canonical_form.
+
+	Returns:
+		description (tuple): Interaction counts of each qudit pair in the
+			canonical labeling.
+
+		perm (list[int]): Qudit q of the block is qudit perm[q] in the
+			canonical labeling.
+
+		None is returned instead if there are too many labelings to compare.
+	"""
+	counts = [
+		(bit_edge(bit), count) for bit, count in
+		enumerate(edge_frequencies(logical_ops, num_qudits).tolist())
+		if count > 0
+	]
+	incident = [[] for _ in range(num_qudits)]
+	for ((u,v), count) in counts:
+		incident[u].append(count)
+		incident[v].append(count)
+	signatures = [
+		(sum(incident[q]), tuple(sorted(incident[q]))) for q in range(num_qudits)
+	]
+	classes = {}
+	for q in range(num_qudits):
+		classes.setdefault(signatures[q], []).append(q)
+	classes = [classes[sig] for sig in sorted(classes.keys())]
+	if prod([factorial(len(c)) for c in classes]) > MAX_RELABELINGS:
+		return None
+
+	best = None
+	best_perm = None
+	for perm in class_permutations(classes):
+		description = sorted(
+			(min(perm[u], perm[v]), max(perm[u], perm[v]), count)
+			for ((u,v), count) in counts
+		)
+		if best is None or description < best:
+			best = description
+			best_perm = perm
+	return ((num_qudits,) + tuple(best), best_perm)
+
+
+def _relabel(
+	kernel : Sequence[Sequence[int]],
+	perm : Sequence[int],
+	ordered : bool = False,
+) -> list[tuple[int,int]]:
+	"""Relabel edges, keeping u < v in every edge if `ordered`."""
+	if ordered:
+		return [
+			(min(perm[u], perm[v]), max(perm[u], perm[v])) for (u,v) in kernel
+		]
+	return [(perm[u], perm[v]) for (u,v) in kernel]
+
+
+def _entry_path(key : str, memo_dir : str) -> str:
+	return f"{memo_dir}/{key[:2]}/{key}.pickle"
+
+
+def memoized_kernel(
+	selector : str,
+	settings : Sequence[Any],
+	logical_ops : Sequence[tuple[int]],
+	num_qudits : int,
+	select : Callable[[Sequence[int]], Sequence[tuple[int]]],
+	memo_dir : str | None = None,
+) -> Sequence[tuple[int]]:
+	"""
+	Kernel of a block, from the memo if an equivalent block was seen before,
+	otherwise from select.
+
+	Args:
+		selector (str): Name of the kernel selection method.
+
+		settings (Sequence[Any]): Everything besides the interactions the
+			selection depends on, e.g. the topology and templates.
+
+		logical_ops (Sequence[tuple[int]]): Two qudit interactions of the
+			block, in the block's own labels.
+
+		num_qudits (int): Number of qudits in the block.
+
+		select (Callable): select(perm) computes the kernel of the block
+			with its qudit q relabeled perm[q], in those labels.
+
+		memo_dir (str | None): Directory of the memo shared between
+			processes. If None, the memo is not used at all.
+
+	Returns:
+		kernel (Sequence[tuple[int]]): The kernel in the block's labels.
+	"""
+	identity = list(range(num_qudits))
+	if memo_dir is None:
+		return select(identity)
+	canonical = canonical_interactions(logical_ops, num_qudits)
+	if canonical is None:
+		return select(identity)
+	(description, perm) = canonical
+	key = sha256(
+		repr((MEMO_VERSION, selector, tuple(settings), description)).encode()
+	).hexdigest()
+	inverse = inverse_permutation(perm)
+
+	if key in _memo:
+		_memo.move_to_end(key)
+		return _relabel(_memo[key][0], inverse, _memo[key][1])
+	if exists(_entry_path(key, memo_dir)):
+		try:
+			with open(_entry_path(key, memo_dir), "rb") as f:
+				entry = pickle.load(f)
+			_remember(key, entry)
+			return _relabel(entry[0], inverse, entry[1])
+		except (EOFError, pickle.UnpicklingError):
+			pass
+
+	canonical_kernel = list(select(perm))
+	# Kernels whose edges were all written as (low, high) stay that way
+	ordered = all([u < v for (u,v) in canonical_kernel])
+	entry = (canonical_kernel, ordered)
+	_remember(key, entry)
+	makedirs(f"{memo_dir}/{key[:2]}", exist_ok=True)
+	tmp_path = f"{_entry_path(key, memo_dir)}.{getpid()}.tmp"
+	with open(tmp_path, "wb") as f:
+		pickle.dump(entry, f)
+	replace(tmp_path, _entry_path(key, memo_dir))
+	return _relabel(canonical_kernel, inverse, ordered)
+
+
+def _remember(
+	key : str,
+	entry : tuple[list[tuple[int,int]], bool],
+) -> None:
+	"""Keep (canonical kernel, ordered) in this process's LRU memo."""
+	_memo[key] = entry
+	_memo.move_to_end(key)
+	while len(_memo) > MAX_ENTRIES:
+		_memo.popitem(last=False)
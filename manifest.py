@@ -0,0 +1,151 @@
+"""
+Per-run manifest of the inputs and parameters used to produce each stage's
+outputs. A stage (or block) is only recomputed when the hashes of its inputs
+or its parameters changed since its outputs were written.
+"""
+from __future__ import annotations
+from typing import Any, Sequence
+from hashlib import sha1
+from os import listdir, makedirs, replace, stat
+from os.path import dirname, exists, isdir
+import json
+
+from partition_store import SOURCE_SEPARATOR, block_source_digest
+
+
+class Manifest:
+
+	def __init__(
+		self,
+		manifest_file : str,
+	):
+		"""
+		Load the manifest of a run, or start an empty one.
+
+		Arguments:
+			manifest_file (str): JSON file the manifest is kept in.
+		"""
+		self.manifest_file = manifest_file
+		self.stages = {}
+		# path -> [mtime, size, digest], avoids rehashing unchanged files
+		self.hashes = {}
+		if exists(manifest_file):
+			with open(manifest_file, "r") as f:
+				data = json.load(f)
+			self.stages = data["stages"]
+			self.hashes = data["hashes"]
+
+
+	def file_hash(
+		self,
+		path : str,
+	) -> str | None:
+		"""
+		Digest of a file's contents, of every file in a directory, or of a
+		block of a partition store (see PartitionStore.block_source). Returns
+		None if the path does not exist.
+		"""
+		if not exists(path):
+			if SOURCE_SEPARATOR in path:
+				return block_source_digest(path)
+			return None
+		if isdir(path):
+			digest = sha1()
+			for name in sorted(listdir(path)):
+				digest.update(name.encode())
+				digest.update(str(self.file_hash(f"{path}/{name}")).encode())
+			return digest.hexdigest()
+
+		info = stat(path)
+		if path in self.hashes:
+			(mtime, size, cached) = self.hashes[path]
+			if mtime == info.st_mtime and size == info.st_size:
+				return cached
+		digest = sha1()
+		with open(path, "rb") as f:
+			while chunk := f.read(2**20):
+				digest.update(chunk)
+		self.hashes[path] = [info.st_mtime, info.st_size, digest.hexdigest()]
+		return digest.hexdigest()
+
+
+	def _describe(
+		self,
+		inputs : Sequence[str],
+		params : dict[str, Any],
+	) -> dict[str, Any]:
+		return {
+			"inputs" : {path : self.file_hash(path) for path in inputs},
+			"params" : json.loads(json.dumps(params, sort_keys=True)),
+		}
+
+
+	def is_current(
+		self,
+		stage : str,
+		inputs : Sequence[str],
+		params : dict[str, Any],
+		outputs : Sequence[str],
+	) -> bool:
+		"""
+		True if every output of `stage` exists and was produced from the same
+		inputs and parameters.
+
+		Outputs that exist but were never recorded (e.g. produced before the
+		manifest existed) are adopted as current and recorded, so older runs
+		are not recomputed from scratch.
+
+		Arguments:
+			stage (str): Name of the stage, e.g. "layout" or
+				"synthesis/block_003".
+
+			inputs (Sequence[str]): Files or directories the stage reads.
+
+			params (dict[str, Any]): JSON serializable parameters that change
+				the stage's outputs.
+
+			outputs (Sequence[str]): Files or directories the stage writes.
+		"""
+		if not all([exists(path) for path in outputs]):
+			return False
+		if stage not in self.stages:
+			self.record(stage, inputs, params, outputs)
+			return True
+		record = self.stages[stage]
+		current = self._describe(inputs, params)
+		return (
+			record["inputs"] == current["inputs"] and
+			record["params"] == current["params"]
+		)
+
+
+	def record(
+		self,
+		stage : str,
+		inputs : Sequence[str],
+		params : dict[str, Any],
+		outputs : Sequence[str],
+	) -> None:
+		"""
+		Remember the inputs and parameters that produced `stage`'s outputs.
+		Call save() to write the manifest to disk.
+		"""
+		self.stages[stage] = self._describe(inputs, params)
+		self.stages[stage]["outputs"] = list(outputs)
+
+
+	def invalidate(
+		self,
+		stage_prefix : str,
+	) -> None:
+		"""Forget every stage whose name starts with `stage_prefix`."""
+		for stage in [s for s in self.stages if s.startswith(stage_prefix)]:
+			del self.stages[stage]
+
+
+	def save(self) -> None:
+		if dirname(self.manifest_file) != "":
+			makedirs(dirname(self.manifest_file), exist_ok=True)
+		with open(f"{self.manifest_file}.tmp", "w") as f:
+			json.dump({"stages" : self.stages, "hashes" : self.hashes}, f)
+		replace(f"{self.manifest_file}.tmp", self.manifest_file)
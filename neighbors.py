@@ -5,8 +5,11 @@ from bqskit.ir.gates.circuitgate import CircuitGate
 import argparse
 import pickle
 import os
-from itertools import permutations
-from topology import construct_permuted_kernel, kernel_score_function
+from kernel_matching import best_permuted_kernel
+from kernel_memo import memoized_kernel
+from templates import get_templates
+from edge_set import EdgeSet
+from interactions import count_interactions
 
 
 def calculate_overlap(group_a, group_b):
@@ -27,11 +30,7 @@ def get_induced_edges(edges, vertices):
 	"""
 	Return list of edges induced by vertices.
 	"""
-	induced_edges = []
-	for a,b in edges:
-		if a in vertices and b in vertices:
-			induced_edges.append((a,b))
-	return induced_edges
+	return EdgeSet(edges).induced(vertices).edges()
 
 
 def relative_to_absolute_edges(qubit_group, relative_edges):
@@ -85,88 +84,11 @@ def get_block_logical_edges(circuit):
 	"""
 	Get list of logical connectivity edges indexed by block number.
 	"""
-	edge_list = []
-	for op in circuit:
-		if len(op.location) >= 2:
-			edge_list.append(op.location)
-	return edge_list
-
-
-def get_templates(category, num_qubits):
-	"""
-	Valid template categories are:
-		blocksize 3:
-			lines, alls
-		blocksize 4:
-			lines, stars, rings, alls, embedded, trees
-		blocksize 5:
-			lines, stars, tees, dippers, alls, embedded, trees
-	
-	NOTE: embedded means embedded in a 2D nearest neighbor mesh
-	"""
-
-	line_2 = [(0,1)]
-	line_3 = [(0,1), (1,2)]
-	line_4 = [(0,1), (1,2), (2,3)]
-	line_5 = [(0,1), (1,2), (2,3), (3,4)]
-	alls_3 = [(0,1), (0,2), (1,2)]
-	alls_4 = [(0,1), (0,2), (0,3), (1,2), (1,3), (2,3)]
-	alls_5 = [(0,1), (0,2), (0,3), (0,4), (1,2), (1,3), (1,4), (2,3), (2,4), (3,4)]
-	ring_4 = [(0,1), (1,2), (2,3), (0,3)]
-	star_4 = [(0,1), (0,2), (0,3)]
-	star_5 = [(0,1), (0,2), (0,3), (0,4)]
-	dipper = [(0,1), (1,2), (2,3), (0,3), (0,4)]
-	tees_5 = [(0,1), (1,2), (1,3), (3,4)]
-
-	if num_qubits < 2:
-		return []
-	elif num_qubits == 2:
-		return [line_2]
-	elif num_qubits == 3:
-		if category in ("lines", "stars", "rings", "embedded"):
-			return [line_3]
-		elif category == "alls":
-			return [alls_3]
-		else:
-			raise RuntimeError(f"Unrecognized category {category}")
-	elif num_qubits == 4:
-		if category == "lines":
-			return [line_4]
-		elif category == "stars":
-			return [star_4]
-		elif category == "rings":
-			return [ring_4]
-		elif category == "alls":
-			return [alls_4]
-		elif category == "embedded":
-			return [line_4, star_4, ring_4]
-		elif category == "trees":
-			return [line_4, star_4]
-		else:
-			raise RuntimeError(f"Unrecognized category {category}")
-	elif num_qubits == 5:
-		if category == "lines":
-			return [line_5]
-		elif category == "stars":
-			return [star_5]
-		elif category == "tees":
-			return [tees_5]
-		elif category == "dippers":
-			return [tees_5]
-		elif category == "alls":
-			return [alls_5]
-		elif category == "embedded":
-			return [line_5, star_5, tees_5, dipper]
-		elif category == "trees":
-			return [line_5, star_5, tees_5]
-		else:
-			raise RuntimeError(f"Unrecognized category {category}")
-	else:
-		raise RuntimeError("Only upto 5 qubits blocks supported.")
+	return count_interactions(circuit)[0]
 
 
 def match_kernel(
-	logical_ops, num_qubits, category
+	logical_ops, num_qubits, category, memo_dir=None
 ):
 	"""
 	Valid template categories are:
@@ -178,24 +100,24 @@ def match_kernel(
 			lines, stars, tees, dippers, alls, embedded, trees
 	
 	NOTE: embedded means embedded in a 2D nearest neighbor mesh
+
+	Kernels are memoized, see kernel_memo.py. memo_dir is the directory of
+	the memo shared between processes.
 	"""
 
 	# handle the only 1-qubit gates case to avoid trying all options
 	templates = get_templates(category, num_qubits)
 
-	vertex_list  = list(range(num_qubits))
-	vertex_perms = list(permutations(vertex_list, num_qubits))
-	best_kernel = []
-	best_score  = 0
-	for template in templates:
-		for perm in vertex_perms:
-			permuted_kernel = construct_permuted_kernel(template, perm)
-			edge_score, node_score = kernel_score_function(logical_ops, permuted_kernel)
-			if edge_score > best_score:
-				best_kernel = permuted_kernel
-				best_score = edge_score
-
-	return best_kernel
+	return memoized_kernel(
+		"neighbors.match_kernel",
+		(category, templates),
+		logical_ops,
+		num_qubits,
+		lambda perm: best_permuted_kernel(
+			[(perm[u], perm[v]) for (u,v) in logical_ops], templates, num_qubits
+		),
+		memo_dir,
+	)
 
 
 class debug_args():
@@ -332,7 +254,7 @@ if __name__ == '__main__':
 	for block_num in range(block_count):
 		shared_logical_edges.append(
 			get_induced_edges(
-				list(set(logical_edges[block_num])),
+				logical_edges[block_num],
 				flat_relative_overlap[block_num]
 			)
 		)
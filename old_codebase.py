@@ -1,6 +1,5 @@
 from __future__ import annotations
 from typing import Any, Sequence
-from qiskit.circuit.quantumcircuit import QuantumCircuit
 
 from qsearch import (
 	Project,
@@ -12,13 +11,27 @@ from qsearch import (
 	multistart_solvers
 )
 from util import load_block_topology, load_block_circuit
+from synthesis_cache import (
+	cache_key,
+	cache_lookup,
+	cache_store,
+	inverse_permutation,
+	relabel_qasm,
+)
+from synthesis_backends import route_block, synthesize_block
+from resources import CoreBudget
+from run_report import clear_fallback, count_cnots, record_fallback
+from predictor import worth_synthesizing
+from interactions import get_logical_operations
+from bqskit.ir.gates.constant.cx import CNOTGate
+from bqskit.ir.lang.qasm2.qasm2 import OPENQASM2Language
 from shutil import rmtree
+from os import replace
 from os.path import exists
-from psutil import cpu_count
 from re import search
-from qiskit.compiler import transpile
 
 from numpy import ndarray
+from bqskit import Circuit
 
 def weighted_astar(circ, v, weight, options):
 	"""
@@ -44,16 +57,20 @@ def weighted_astar(circ, v, weight, options):
 	return  astar_cost + gateset_weight
 
 
-def num_tasks(num_synth_procs : int) -> int:
-	return min([max([cpu_count(logical=False)//num_synth_procs, 1]), 128])
-
-
 def call_old_codebase_leap(
 	unitary   : ndarray, 
 	graph	 : Sequence[Sequence[int]], 
 	proj_name : str,
 	num_synth_procs : int = 1,
+	budget : CoreBudget | None = None,
 ) -> str:
+	"""
+	Synthesize a unitary onto the edges of `graph` with LEAP in a qsearch
+	project. Search and post processing stay within `budget`, by default the
+	machine's cores split among num_synth_procs processes (see resources.py).
+	"""
+	if budget is None:
+		budget = CoreBudget.for_machine().share(num_synth_procs)
 	# No need to reverse endianness from QASM because we are interacting with
 	# unitaries produced by bqskit.
 	block_name = search("block_\d+", proj_name)[0]
@@ -69,7 +86,7 @@ def call_old_codebase_leap(
 	#		max_weight = edge[2]
 	#project['max_gateset_weight'] = max_weight
 	project["max_synth_procs"] = num_synth_procs
-	project["num_tasks"] = num_tasks(num_synth_procs)
+	project["num_tasks"] = budget.search_tasks()
 	#project['heuristic'] = weighted_astar
 
 	# Run
@@ -77,8 +94,9 @@ def call_old_codebase_leap(
 	# Post processing
 	project.post_process(
 		post_processing.LEAPReoptimizing_PostProcessor(),
-		solver = multistart_solvers.MultiStart_Solver(8),
+		solver = multistart_solvers.MultiStart_Solver(budget.multistarts()),
 		parallelizer = parallelizers.ProcessPoolParallelizer,
+		num_tasks = budget.post_processing_tasks(),
 		weight_limit = 5
 	)
 	qasm = project.assemble(
@@ -135,19 +153,79 @@ def synthesize(
 		#]
 		# Load circuit
 		subcircuit = load_block_circuit(block_path, options)
-		unitary = subcircuit.get_unitary().numpy
-		# Synthesize
-		print("Using edges: ", subtopology)
-		subcircuit_qasm = call_old_codebase_leap(
-			unitary,
-			subtopology,
-			synth_dir,
+		subcircuit_qasm = synthesize_circuit(
+			block_name, subcircuit, subtopology, options
 		)
-		subcircuit_qasm = transpile(
-			QuantumCircuit().from_qasm_str(subcircuit_qasm),
-			basis_gates=['cx','u3']
-		).qasm()
 
-		with open(f"{synth_dir}.qasm", "w") as f:
+		# Write to a temporary file first so that an interrupted worker never
+		# leaves behind a partial checkpoint.
+		with open(f"{synth_dir}.qasm.tmp", "w") as f:
 			f.write(subcircuit_qasm)
+		replace(f"{synth_dir}.qasm.tmp", f"{synth_dir}.qasm")
+
 
+def synthesize_circuit(
+	block_name : str,
+	subcircuit : Circuit,
+	subtopology : Sequence[Sequence[int]],
+	options : dict[str, Any],
+) -> str:
+	"""
+	Synthesize a loaded block onto its kernel and return the result as QASM.
+	Nothing is written to the synthesis directory other than the qsearch
+	backend's own project files (see synthesis_backends.py) and the record of
+	a block that ran out of budget or was skipped by the predictor (see
+	run_report.py). Such blocks are not added to the synthesis cache.
+	"""
+	# Look for the same block and kernel in the synthesis cache
+	# Cache entries are stored in a canonical qudit labeling, relabel
+	# them back to the block's own labeling on a hit.
+	keyed = None
+	if options.get("cache_dir") is not None:
+		keyed = cache_key(subcircuit, subtopology)
+	if keyed is not None:
+		key, perm = keyed
+		cached_qasm = cache_lookup(key, options)
+		if cached_qasm is not None:
+			print(f"  Found block {block_name} in synthesis cache")
+			clear_fallback(block_name, options)
+			return relabel_qasm(cached_qasm, inverse_permutation(perm))
+
+	# Blocks synthesis is not expected to reduce are kept as they are, only
+	# routed onto their kernel like blocks that ran out of budget
+	if options.get("predictor_file") is not None and \
+		options.get("predict_action") == "skip" and not worth_synthesizing(
+		get_logical_operations(subcircuit),
+		subcircuit.num_qudits,
+		subtopology,
+		options,
+	):
+		print(f"  Skipping block {block_name}, not expected to improve")
+		routed = route_block(subcircuit, subtopology)
+		record_fallback(
+			block_name,
+			"skipped",
+			subcircuit.count(CNOTGate()),
+			routed.count(CNOTGate()),
+			options,
+		)
+		return OPENQASM2Language().encode(routed)
+
+	# Synthesize
+	print("Using edges: ", subtopology)
+	subcircuit_qasm, fallback = synthesize_block(
+		block_name, subcircuit, subtopology, options
+	)
+	if fallback is not None:
+		record_fallback(
+			block_name,
+			fallback,
+			subcircuit.count(CNOTGate()),
+			count_cnots(subcircuit_qasm),
+			options,
+		)
+		return subcircuit_qasm
+	clear_fallback(block_name, options)
+	if keyed is not None:
+		cache_store(key, relabel_qasm(subcircuit_qasm, perm), options)
+	return subcircuit_qasm
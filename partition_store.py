@@ -0,0 +1,364 @@
+"""
+Single file container for a partitioned circuit.
+
+A store holds every block's QASM, the structure list and an index of where
+each block starts, so reading a partition is one open and an mmap instead of
+one open per block (which is slow over NFS for partitions with thousands of
+blocks). Blocks are read by number or name without loading the others.
+
+Layout of a store file:
+	8 bytes   magic, b"QTPSTORE"
+	8 bytes   length of the index, little endian
+	index     JSON with the block names, offsets, lengths and structure
+	payload   the QASM of every block, back to back
+
+The block_files/<partition> directory layout written by SaveIntermediatePass
+remains the import/export format, see import_partition and export_partition.
+open_partition reads either.
+"""
+from __future__ import annotations
+from typing import Sequence
+from functools import lru_cache
+from mmap import mmap, ACCESS_READ
+from os import getpid, listdir, makedirs, remove, replace, stat
+from os.path import exists, isdir, isfile
+from hashlib import sha1
+from shutil import rmtree
+from tempfile import mkdtemp
+from weakref import finalize
+import argparse
+import json
+import pickle
+import struct
+
+from bqskit import Circuit
+from bqskit.ir.lang.qasm2.qasm2 import OPENQASM2Language
+
+
+MAGIC = b"QTPSTORE"
+HEADER = struct.Struct("<8sQ")
+
+# Separates a store's path from a block's name in PartitionStore.block_source
+SOURCE_SEPARATOR = "#"
+
+
+def store_path_for(partition_dir : str) -> str:
+	"""Where the store of a partition directory is kept."""
+	return f"{partition_dir.rstrip('/')}.part"
+
+
+class PartitionStore:
+
+	def __init__(
+		self,
+		path : str,
+	):
+		"""
+		Open a partition store for reading.
+
+		Arguments:
+			path (str): The store file.
+		"""
+		self.path = path
+		self.structure_source = path
+		self._file = open(path, "rb")
+		self._mmap = mmap(self._file.fileno(), 0, access=ACCESS_READ)
+		(magic, index_length) = HEADER.unpack_from(self._mmap, 0)
+		if magic != MAGIC:
+			raise RuntimeError(f"{path} is not a partition store.")
+		index = json.loads(
+			self._mmap[HEADER.size:HEADER.size + index_length].decode()
+		)
+		self._data_start = HEADER.size + index_length
+		self.block_names = index["names"]
+		self.structure = index["structure"]
+		self._offsets = index["offsets"]
+		self._lengths = index["lengths"]
+		self._numbers = {name : n for n, name in enumerate(self.block_names)}
+		self._tmp_dir = None
+		self._remove_tmp_dir = None
+
+
+	def __len__(self) -> int:
+		return len(self.block_names)
+
+
+	def __enter__(self) -> PartitionStore:
+		return self
+
+
+	def __exit__(self, *args) -> None:
+		self.close()
+
+
+	def close(self) -> None:
+		self._mmap.close()
+		self._file.close()
+		if self._remove_tmp_dir is not None:
+			self._remove_tmp_dir()
+
+
+	def block_number(self, block_name : str) -> int:
+		return self._numbers[block_name]
+
+
+	def _block_bytes(self, block_num : int) -> bytes:
+		start = self._data_start + self._offsets[block_num]
+		return self._mmap[start:start + self._lengths[block_num]]
+
+
+	def block_qasm(self, block_num : int) -> str:
+		return self._block_bytes(block_num).decode()
+
+
+	def block_digest(self, block_num : int) -> str:
+		return sha1(self._block_bytes(block_num)).hexdigest()
+
+
+	def block_circuit(self, block_num : int) -> Circuit:
+		return OPENQASM2Language().decode(self.block_qasm(block_num))
+
+
+	def block_source(self, block_num : int) -> str:
+		"""
+		Where a block is read from, e.g. for hashing: the store and the
+		block's name, see block_source_digest. Only the block's own bytes are
+		hashed, so repartitioning only changes the sources of blocks that
+		changed.
+		"""
+		return f"{self.path}{SOURCE_SEPARATOR}{self.block_names[block_num]}"
+
+
+	def block_path(self, block_num : int) -> str:
+		"""
+		A QASM file of the block, for tools that can only read files. Files
+		are written to a temporary directory the first time they are asked
+		for, which is removed when the store is closed or collected.
+		"""
+		if self._tmp_dir is None:
+			self._tmp_dir = mkdtemp(prefix="partition_")
+			self._remove_tmp_dir = finalize(
+				self, rmtree, self._tmp_dir, ignore_errors=True
+			)
+		path = f"{self._tmp_dir}/{self.block_names[block_num]}.qasm"
+		if not exists(path):
+			with open(path, "w") as f:
+				f.write(self.block_qasm(block_num))
+		return path
+
+
+class PartitionDir:
+
+	def __init__(
+		self,
+		path : str,
+	):
+		"""
+		Read a partition stored as a directory of QASM blocks with the same
+		interface as PartitionStore.
+
+		Arguments:
+			path (str): The partition directory.
+		"""
+		self.path = path.rstrip("/")
+		self.structure_source = f"{self.path}/structure.pickle"
+		self.block_names = sorted([
+			x.split(".qasm")[0] for x in listdir(self.path)
+			if x.endswith(".qasm")
+		])
+		with open(self.structure_source, "rb") as f:
+			self.structure = pickle.load(f)
+		self._numbers = {name : n for n, name in enumerate(self.block_names)}
+
+
+	def __len__(self) -> int:
+		return len(self.block_names)
+
+
+	def __enter__(self) -> PartitionDir:
+		return self
+
+
+	def __exit__(self, *args) -> None:
+		self.close()
+
+
+	def close(self) -> None:
+		pass
+
+
+	def block_number(self, block_name : str) -> int:
+		return self._numbers[block_name]
+
+
+	def block_qasm(self, block_num : int) -> str:
+		with open(self.block_path(block_num), "r") as f:
+			return f.read()
+
+
+	def block_circuit(self, block_num : int) -> Circuit:
+		return OPENQASM2Language().decode(self.block_qasm(block_num))
+
+
+	def block_source(self, block_num : int) -> str:
+		return self.block_path(block_num)
+
+
+	def block_path(self, block_num : int) -> str:
+		return f"{self.path}/{self.block_names[block_num]}.qasm"
+
+
+def open_partition(
+	path : str,
+) -> PartitionStore | PartitionDir:
+	"""
+	Open a partition given either its store file or its directory. If both a
+	directory and its store exist, the store is used unless the directory was
+	written after it.
+	"""
+	if isfile(path):
+		return PartitionStore(path)
+	store_path = store_path_for(path)
+	if exists(store_path):
+		if not isdir(path) or not exists(f"{path}/structure.pickle") or \
+			stat(store_path).st_mtime_ns >= \
+			stat(f"{path}/structure.pickle").st_mtime_ns:
+			return PartitionStore(store_path)
+	return PartitionDir(path)
+
+
+@lru_cache(maxsize=8)
+def _cached_store(
+	store_path : str,
+	mtime : int,
+) -> PartitionStore:
+	return PartitionStore(store_path)
+
+
+def find_block_qasm(
+	block_path : str,
+) -> str | None:
+	"""
+	QASM of `block_path` taken from the store of its directory, or None if
+	there is no store with that block. Stores stay open for the life of the
+	process.
+	"""
+	partition_dir, block_file = block_path.rsplit("/", 1)
+	store_path = store_path_for(partition_dir)
+	if not exists(store_path):
+		return None
+	store = _cached_store(store_path, stat(store_path).st_mtime_ns)
+	block_name = block_file.rsplit(".", 1)[0]
+	if block_name not in store._numbers:
+		return None
+	return store.block_qasm(store.block_number(block_name))
+
+
+def block_source_digest(
+	source : str,
+) -> str | None:
+	"""
+	Digest of the block named by a PartitionStore.block_source, or None if
+	there is no such store or block.
+	"""
+	(store_path, _, block_name) = source.rpartition(SOURCE_SEPARATOR)
+	if not exists(store_path):
+		return None
+	store = _cached_store(store_path, stat(store_path).st_mtime_ns)
+	if block_name not in store._numbers:
+		return None
+	return store.block_digest(store.block_number(block_name))
+
+
+def write_partition_store(
+	store_path : str,
+	block_names : Sequence[str],
+	block_qasm : Sequence[str],
+	structure : Sequence[Sequence[int]],
+) -> None:
+	"""Write a partition store, replacing any existing one atomically."""
+	payloads = [qasm.encode() for qasm in block_qasm]
+	offsets = []
+	position = 0
+	for payload in payloads:
+		offsets.append(position)
+		position += len(payload)
+	index = json.dumps({
+		"names" : list(block_names),
+		"offsets" : offsets,
+		"lengths" : [len(payload) for payload in payloads],
+		"structure" : [list(group) for group in structure],
+	}).encode()
+	tmp_path = f"{store_path}.{getpid()}.tmp"
+	with open(tmp_path, "wb") as f:
+		f.write(HEADER.pack(MAGIC, len(index)))
+		f.write(index)
+		for payload in payloads:
+			f.write(payload)
+	replace(tmp_path, store_path)
+
+
+def import_partition(
+	partition_dir : str,
+	store_path : str | None = None,
+) -> str:
+	"""Pack a partition directory into a store. Returns the store's path."""
+	store_path = store_path_for(partition_dir) if store_path is None \
+		else store_path
+	partition = PartitionDir(partition_dir)
+	write_partition_store(
+		store_path,
+		partition.block_names,
+		[partition.block_qasm(n) for n in range(len(partition))],
+		partition.structure,
+	)
+	return store_path
+
+
+def export_partition(
+	store_path : str,
+	partition_dir : str,
+) -> None:
+	"""Unpack a store into the directory layout SaveIntermediatePass writes."""
+	makedirs(partition_dir, exist_ok=True)
+	with PartitionStore(store_path) as store:
+		for block_num, block_name in enumerate(store.block_names):
+			with open(f"{partition_dir}/{block_name}.qasm", "w") as f:
+				f.write(store.block_qasm(block_num))
+		with open(f"{partition_dir}/structure.pickle", "wb") as f:
+			pickle.dump(store.structure, f)
+
+
+if __name__ == "__main__":
+	"""
+	>>> python partition_store.py import block_files/qft_64_preoptimized_mesh_64_blocksize_4_scan
+	>>> python partition_store.py export block_files/qft_64_preoptimized_mesh_64_blocksize_4_scan.part
+
+	import packs a partition directory into <directory>.part, export unpacks a
+	store back into the directory next to it.
+	"""
+	parser = argparse.ArgumentParser(
+		description="Convert partitions between directories and stores"
+	)
+	parser.add_argument("command", type=str, help="[import | export]")
+	parser.add_argument("path", type=str)
+	parser.add_argument("--remove", action="store_true",
+		help="remove the directory or store that was converted"
+	)
+	args = parser.parse_args()
+
+	if args.command == "import":
+		store_path = import_partition(args.path)
+		print(f"Packed {args.path} into {store_path}")
+		if args.remove:
+			rmtree(args.path)
+	elif args.command == "export":
+		if not args.path.endswith(".part"):
+			raise ValueError(f"{args.path} is not a .part store")
+		partition_dir = args.path[:-len(".part")]
+		export_partition(args.path, partition_dir)
+		print(f"Unpacked {args.path} into {partition_dir}")
+		if args.remove:
+			remove(args.path)
+	else:
+		raise ValueError(f"Unknown command {args.command}")
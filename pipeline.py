@@ -0,0 +1,378 @@
+"""
+In memory version of the partitioning, kernel fitting, synthesis and assembly
+stages. Blocks are passed between stages as bqskit Circuits and kernels as
+edge lists, so no stage has to parse QASM written by the stage before it.
+Checkpoints of the intermediate results are optional and are written by a
+background thread so they never hold up the pipeline.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Sequence
+from collections import Counter
+from itertools import combinations
+from os import makedirs, replace
+from os.path import dirname, exists
+from shutil import rmtree
+from queue import Queue
+from threading import Thread
+import pickle
+
+from bqskit.ir.circuit import Circuit
+from bqskit.ir.gates.constant.cx import CNOTGate
+from bqskit.ir.lang.qasm2.qasm2 import OPENQASM2Language
+from bqskit.passes.partitioning.scan import ScanPartitioner
+from bqskit.passes.partitioning.greedy import GreedyPartitioner
+from bqskit.passes.partitioning.quick import QuickPartitioner
+
+from topology import get_logical_operations, kernel_type, match_circuit_kernel, match_ops_kernel
+from neighbors import match_kernel as match_category_kernel
+from interactions import qasm_interactions
+from kernel_matching import MAX_TABLE_QUDITS, best_permuted_kernels
+from partition_store import open_partition
+from templates import MAX_BLOCKSIZE, get_templates, topology_templates
+from block_scheduler import schedule_circuit_synthesis
+from profiling import Profiler
+from run_report import write_report
+from util import load_qasm_circuit
+
+
+class CheckpointWriter:
+
+	def __init__(
+		self,
+		enabled : bool = True,
+	):
+		"""
+		Writes checkpoint files from a background thread. Contents may be
+		given as a callable so that encoding also happens off the main thread.
+
+		Arguments:
+			enabled (bool): If False, every write is dropped.
+		"""
+		self.enabled = enabled
+		self.error = None
+		self.queue = Queue()
+		self.thread = None
+		if enabled:
+			self.thread = Thread(target=self._run)
+			self.thread.start()
+
+
+	def _run(self) -> None:
+		while (item := self.queue.get()) is not None:
+			(path, contents, mode) = item
+			if self.error is not None:
+				continue
+			try:
+				if callable(contents):
+					contents = contents()
+				if dirname(path) != "":
+					makedirs(dirname(path), exist_ok=True)
+				with open(f"{path}.tmp", mode) as f:
+					f.write(contents)
+				replace(f"{path}.tmp", path)
+			except Exception as e:
+				self.error = e
+
+
+	def write_text(
+		self,
+		path : str,
+		contents : str | Callable[[], str],
+	) -> None:
+		if self.enabled:
+			self.queue.put((path, contents, "w"))
+
+
+	def write_circuit(
+		self,
+		path : str,
+		circuit : Circuit,
+	) -> None:
+		self.write_text(path, lambda: OPENQASM2Language().encode(circuit))
+
+
+	def write_pickle(
+		self,
+		path : str,
+		obj : Any,
+	) -> None:
+		if self.enabled:
+			self.queue.put((path, lambda: pickle.dumps(obj), "wb"))
+
+
+	def close(self) -> None:
+		"""
+		Wait for every queued checkpoint to be written.
+
+		Raises:
+			Exception: The first error hit while writing a checkpoint.
+		"""
+		if self.thread is not None:
+			self.queue.put(None)
+			self.thread.join()
+			self.thread = None
+		if self.error is not None:
+			raise self.error
+
+
+def get_partitioner(
+	partitioner : str,
+	blocksize : int,
+):
+	if partitioner == "greedy":
+		return GreedyPartitioner(blocksize)
+	elif partitioner == "quick":
+		return QuickPartitioner(blocksize)
+	else:
+		return ScanPartitioner(blocksize)
+
+
+def extract_blocks(
+	circuit : Circuit,
+) -> tuple[list[str], list[Circuit], list[list[int]]]:
+	"""
+	Split a partitioned circuit into its blocks, in the same order and with
+	the same names SaveIntermediatePass gives the block files.
+
+	Returns:
+		block_names (list[str]): Names of the blocks, e.g. "block_007".
+
+		blocks (list[Circuit]): Each block, unfolded onto its own qudits.
+
+		structure (list[list[int]]): Qudit group of each block.
+	"""
+	blocks = []
+	structure = []
+	for op in circuit:
+		block = Circuit(op.num_qudits, op.radixes)
+		block.append_gate(op.gate, list(range(op.num_qudits)), op.params)
+		block.unfold_all()
+		blocks.append(block)
+		structure.append(list(op.location))
+	digits = len(str(len(blocks)))
+	block_names = [
+		f"block_{str(block_num).zfill(digits)}"
+		for block_num in range(len(blocks))
+	]
+	return (block_names, blocks, structure)
+
+
+def fit_kernel(
+	circuit : Circuit,
+	qudit_group : Sequence[int],
+	options : dict[str, Any],
+) -> Sequence[Sequence[int]]:
+	"""
+	Pick the edges a block is synthesized to, depending on whether the run
+	targets all to all, logical or kernel connectivity. Kernels are limited to
+	one template category (see templates.get_templates) if options["category"]
+	is set.
+	"""
+	if options["alltoall"]:
+		subtopology = set([])
+		for i in range(options["blocksize"]):
+			for j in range(options["blocksize"]-1, i, -1):
+				subtopology.add((i,j))
+		print(subtopology)
+	elif options["logical_connectivity"]:
+		subtopology = set(get_logical_operations(circuit))
+		print(subtopology)
+	elif options["category"] is not None:
+		subtopology = match_category_kernel(
+			get_logical_operations(circuit),
+			len(qudit_group),
+			options["category"],
+			options.get("kernel_memo_dir"),
+		)
+	else:
+		subtopology = match_circuit_kernel(circuit, qudit_group, options)
+	return subtopology
+
+
+def fit_kernels(
+	blocks : str | Sequence[Circuit],
+	structure : Sequence[Sequence[int]] | None,
+	options : dict[str, Any],
+	block_nums : Sequence[int] | None = None,
+) -> list[Sequence[Sequence[int]]]:
+	"""
+	fit_kernel for a whole partition at once. Blocks of partition files are
+	read as QASM without building Circuits, and all blocks of the same width
+	are scored in one pass (see kernel_matching.best_permuted_kernels).
+
+	Arguments:
+		blocks (str | Sequence[Circuit]): Partition directory or store (see
+			partition_store.py), or the blocks themselves.
+
+		structure (Sequence[Sequence[int]] | None): Qudit group of each
+			block. Read from the partition if None.
+
+		options (dict[str, Any]): As for fit_kernel.
+
+		block_nums (Sequence[int] | None): Only fit kernels to these blocks.
+
+	Returns:
+		subtopologies (list[Sequence[Sequence[int]]]): Kernel of each block
+			in block_nums.
+	"""
+	if isinstance(blocks, str):
+		partition = open_partition(blocks)
+		structure = partition.structure if structure is None else structure
+		read_ops = lambda block_num: qasm_interactions(
+			partition.block_qasm(block_num).splitlines()
+		)[0]
+	else:
+		read_ops = lambda block_num: get_logical_operations(blocks[block_num])
+	block_nums = range(len(structure)) if block_nums is None else block_nums
+	block_ops = [read_ops(block_num) for block_num in block_nums]
+	widths = [len(structure[block_num]) for block_num in block_nums]
+
+	if options["alltoall"]:
+		return [
+			set(combinations(range(options["blocksize"]), 2)) for _ in block_nums
+		]
+	elif options["logical_connectivity"]:
+		return [set(ops) for ops in block_ops]
+	if options["category"] is None and options["blocksize"] > MAX_BLOCKSIZE:
+		raise RuntimeError(
+			f"Only blocksizes up to {MAX_BLOCKSIZE} are currently supported."
+		)
+
+	# Searched kernels are expensive enough to go through the kernel memo
+	block_templates = []
+	searched = {}
+	for i, (ops, width) in enumerate(zip(block_ops, widths)):
+		if width > MAX_TABLE_QUDITS and options["category"] is not None:
+			searched[i] = match_category_kernel(
+				ops, width, options["category"], options.get("kernel_memo_dir")
+			)
+		elif width > MAX_TABLE_QUDITS:
+			searched[i] = match_ops_kernel(ops, width, options)
+		elif options["category"] is not None:
+			block_templates.append(get_templates(options["category"], width))
+			continue
+		elif len(ops) > 0:
+			block_templates.append(topology_templates(width, options["topology"]))
+			continue
+		block_templates.append([])
+	kernels = best_permuted_kernels(block_ops, block_templates, widths)
+	return [searched.get(i, kernel) for i, kernel in enumerate(kernels)]
+
+
+def print_kernel_counts(
+	subtopologies : Sequence[Sequence[Sequence[int]]],
+	block_nums : Sequence[int],
+	structure : Sequence[Sequence[int]],
+) -> None:
+	"""Print how many of the blocks got each kernel shape."""
+	counts = Counter([
+		kernel_type(subtopology, len(structure[block_num]))
+		for block_num, subtopology in zip(block_nums, subtopologies)
+	])
+	for name, count in counts.most_common():
+		print(f"    {name}: {count}")
+
+
+def run_in_memory(
+	options : dict[str, Any],
+	optimize : bool = False,
+	partition_only : bool = False,
+	profiler : Profiler | None = None,
+) -> Circuit | None:
+	"""
+	Partition, fit kernels to, synthesize and reassemble the layout circuit
+	without going through the block, kernel and synthesis files. The
+	synthesized circuit is written to options["synthesized_qasm_file"] so the
+	qiskit based relayout and routing stages can pick it up.
+
+	Arguments:
+		options (dict[str, Any]):
+			write_checkpoints (bool): Also write the block, kernel and
+				synthesis files of the file based pipeline, in the
+				background.
+
+		optimize (bool): Run ScanningGateRemovalPass on synthesized blocks.
+
+		partition_only (bool): Stop after kernel fitting.
+
+		profiler (Profiler | None): Records each stage and block if provided.
+
+	Returns:
+		synthesized_circuit (Circuit | None): The reassembled circuit, or None
+			if partition_only is set.
+	"""
+	profiler = Profiler(False) if profiler is None else profiler
+	writer = CheckpointWriter(options["write_checkpoints"])
+	try:
+		# Partitioning
+		print(f"  Partitioning {options['layout_qasm_file']}...")
+		with profiler.stage("partitioning"):
+			circuit = load_qasm_circuit(options["layout_qasm_file"])
+			get_partitioner(
+				options["partitioner"], options["blocksize"]
+			).run(circuit)
+			block_names, blocks, structure = extract_blocks(circuit)
+		if options["write_checkpoints"] and exists(options["partition_dir"]):
+			rmtree(options["partition_dir"])
+		for block_name, block in zip(block_names, blocks):
+			writer.write_circuit(
+				f"{options['partition_dir']}/{block_name}.qasm", block
+			)
+		writer.write_pickle(
+			f"{options['partition_dir']}/structure.pickle", structure
+		)
+
+		# Kernel fitting
+		print(f"  Fitting kernels to {len(blocks)} blocks...")
+		with profiler.stage("kernel_fitting"):
+			subtopologies = fit_kernels(blocks, structure, options)
+			for block_name, subtopology in zip(block_names, subtopologies):
+				writer.write_pickle(
+					f"{options['subtopology_dir']}/{block_name}_kernel.pickle",
+					subtopology,
+				)
+		print_kernel_counts(subtopologies, range(len(blocks)), structure)
+
+		if partition_only:
+			return None
+
+		# Synthesis
+		print(f"  Synthesizing {len(blocks)} blocks...")
+		with profiler.stage("synthesis"):
+			synthesized_qasm = schedule_circuit_synthesis(
+				block_names, blocks, subtopologies, options, profiler
+			)
+		write_report(block_names, options)
+		for block_name, qasm in zip(block_names, synthesized_qasm):
+			writer.write_text(
+				f"{options['synthesis_dir']}/{block_name}.qasm", qasm
+			)
+
+		# Assembly
+		with profiler.stage("assembly"):
+			synthesized_circuit = Circuit(options["num_p"])
+			for block_num, qasm in enumerate(synthesized_qasm):
+				subcircuit = OPENQASM2Language().decode(qasm)
+				if optimize:
+					from bqskit.passes.processing.scan import ScanningGateRemovalPass
+					print(f"Optimizing block {block_num+1}/{len(blocks)}")
+					opt_subcircuit = subcircuit.copy()
+					with profiler.stage(f"optimize/{block_names[block_num]}"):
+						ScanningGateRemovalPass().run(opt_subcircuit)
+					writer.write_circuit(
+						f"{options['opt_dir']}/{block_names[block_num]}.qasm",
+						opt_subcircuit,
+					)
+					if opt_subcircuit.count(CNOTGate()) < \
+						subcircuit.count(CNOTGate()):
+						subcircuit = opt_subcircuit
+				qudit_group = [
+					structure[block_num][x] for x in range(subcircuit.num_qudits)
+				]
+				synthesized_circuit.append_circuit(subcircuit, qudit_group)
+
+			with open(options["synthesized_qasm_file"], "w") as f:
+				f.write(OPENQASM2Language().encode(synthesized_circuit))
+	finally:
+		writer.close()
+	return synthesized_circuit
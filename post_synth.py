@@ -7,15 +7,17 @@ from typing import Any
 from bqskit.ir.circuit import Circuit
 
 from networkx.drawing import layout
-from coupling import get_coupling_map
+from coupling import coupling_graph, get_coupling_map
 from mapping import do_routing
 import math
 import pickle
 import re
-import networkx as nx
-from weighted_topology import check_multi, collect_stats_tuples, get_logical_operations, is_same
+from weighted_topology import collect_stats_tuples, is_same
+from interactions import check_multi, get_logical_operations
 from bqskit.ir.lang.qasm2.qasm2 import OPENQASM2Language
 from posix import listdir
+from partition_store import open_partition
+from util import read_block_qasm
 
 
 def count_swaps(
@@ -88,18 +90,13 @@ def replace_blocks(
 ):
 	topologies = sorted(listdir(options["subtopology_dir"]))
 	topologies.remove("summary.txt")
-	blocks = sorted(listdir(options["partition_dir"]))
-	blocks.remove("structure.pickle")
-	with open(f"{options['partition_dir']}/structure.pickle", "rb") as f:
-		structure = pickle.load(f)
+	partition = open_partition(options["partition_dir"])
+	blocks = [f"{name}.qasm" for name in partition.block_names]
+	structure = partition.structure
 	synthblocks = sorted(listdir(options["synthesis_dir"]))
 	for sb in synthblocks:
 		if ".qasm" not in sb:
 			synthblocks.remove(sb)
-	with open(options["coupling_map"], "rb") as f:
-		edge_set = pickle.load(f)
-	physical_graph = nx.Graph()
-	physical_graph.add_edges_from(edge_set)
 	
 	# Make a directory for the non-synthesized blocks
 	if not exists(options["nosynth_dir"]):
@@ -111,15 +108,16 @@ def replace_blocks(
 	# Route each block
 	reroute_flag = False
 	for block_num in range(len(blocks)):
-		input_qasm_file = options["partition_dir"] + "/" + blocks[block_num]
+		# Routing reads files, blocks of a store are written out as needed
+		input_qasm_file = partition.block_path(block_num)
 		output_qasm_file = options["nosynth_dir"] + "/" + blocks[block_num]
 		topology = options["subtopology_dir"] + "/" + topologies[block_num]
 		if not exists(output_qasm_file):
 			reroute_flag = True
-			(_, coupling_graph) = get_coupling_map(topology)
+			(_, coupling_edges) = get_coupling_map(topology)
 			print(
 				f"Routing block {block_num+1}/{len(blocks)} "
-				f"with coupling map {coupling_graph}..."
+				f"with coupling map {coupling_edges}..."
 			)
 			# If routing cannot be done, copy over synthesized file
 			synthesized_qasm_file = options["synthesis_dir"] + "/" + blocks[block_num]
@@ -207,8 +205,9 @@ def count_stats(
 			hybrid = pickle.load(f)
 
 		# load pre synth circuit
-		with open(f"{block_path}/{blocks[i]}", "r") as f:
-			block = OPENQASM2Language().decode(f.read())
+		block = OPENQASM2Language().decode(
+			read_block_qasm(f"{block_path}/{blocks[i]}")
+		)
 
 		# load post synth circuit
 		with open(f"{synth_path}/{synthblocks[i]}", "r") as f:
@@ -265,10 +264,7 @@ if __name__ == "__main__":
 	# load physical graph
 	map_type = re.search("mesh_\d+", short_name)[0]
 	coupling_map = f"coupling_maps/{map_type}"
-	with open(coupling_map, "rb") as f:
-		edge_set = pickle.load(f)
-	physical = nx.Graph()
-	physical.add_edges_from(edge_set)
+	physical = coupling_graph(coupling_map)
 
 	tops = sorted(listdir(topo_path))
 	tops.remove("summary.txt")
@@ -276,12 +272,11 @@ if __name__ == "__main__":
 	for c in circs:
 		if ".qasm" not in c:
 			circs.remove(c)
-	blocks = sorted(listdir(block_path))
-	blocks.remove("structure.pickle")
+	partition = open_partition(block_path)
+	blocks = [f"{name}.qasm" for name in partition.block_names]
 
 	# Load qudit groups
-	with open(f"{block_path}/structure.pickle", "rb") as f:
-		structure = pickle.load(f)
+	structure = partition.structure
 
 	num_q_sqrt = int(re.search("\d+", map_type)[0])
 	num_q = num_q_sqrt ** 2
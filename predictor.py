@@ -0,0 +1,277 @@
+"""
+Predicts how much synthesis will reduce the CNOT count of a block before it
+is synthesized, so that blocks unlikely to improve are skipped or synthesized
+last (options["predict_action"], "skip" or "defer").
+
+The prediction is linear in cheap features of the block and its kernel:
+
+	cnots: Two qudit gates of the block.
+	active_qudits: Qudits the block's two qudit gates act on.
+	difficulty: Difficulty of the kernel's shape (see graph_table.py).
+	edge_fraction: Edge score of the kernel (see
+		topology.kernel_score_function) over the block's two qudit gates.
+	connectivity: Algebraic connectivity of the block's interaction graph
+		(see connectivity.py).
+
+The predicted value is the fraction of CNOTs removed by synthesis. Blocks
+predicted below options["predict_threshold"] are not worth synthesizing.
+Weights are fitted with least squares on finished runs:
+
+	python predictor.py reports/<target>.json [...] [--model <file>]
+
+The report of each run (see run_report.py) says where its blocks, kernels and
+synthesized blocks are, and which blocks were not synthesized.
+"""
+from __future__ import annotations
+from typing import Any, Sequence
+from functools import lru_cache
+from os import replace, stat
+from os.path import exists
+import argparse
+import json
+
+import numpy as np
+
+from connectivity import algebraic_connectivity
+from graph_table import kernel_difficulty
+from interactions import qasm_interactions
+from partition_store import open_partition
+from run_report import count_cnots
+from topology import kernel_score_function
+from util import load_block_topology
+
+
+FEATURES = (
+	"bias",
+	"cnots",
+	"active_qudits",
+	"difficulty",
+	"edge_fraction",
+	"connectivity",
+)
+
+
+def block_features(
+	logical_ops : Sequence[tuple[int,int]],
+	num_qudits : int,
+	kernel_edges : Sequence[Sequence[int]],
+) -> np.ndarray:
+	"""
+	Features of a block and its kernel, in the order of FEATURES.
+
+	Args:
+		logical_ops (Sequence[tuple[int,int]]): Two qudit gates of the block.
+
+		num_qudits (int): Number of qudits of the block.
+
+		kernel_edges (Sequence[Sequence[int]]): Kernel of the block.
+	"""
+	kernel_edges = [(u,v) for (u,v) in kernel_edges]
+	cnots = len(logical_ops)
+	(edge_score, _) = kernel_score_function(logical_ops, kernel_edges)
+	return np.array([
+		1,
+		cnots,
+		len(set([q for op in logical_ops for q in op])),
+		kernel_difficulty(kernel_edges, num_qudits),
+		edge_score / cnots if cnots > 0 else 0,
+		algebraic_connectivity(logical_ops),
+	], dtype=np.float64)
+
+
+class Predictor:
+
+	def __init__(
+		self,
+		weights : Sequence[float],
+	):
+		"""
+		Linear model of the fraction of CNOTs synthesis removes from a block.
+
+		Arguments:
+			weights (Sequence[float]): Weight of each of FEATURES.
+		"""
+		self.weights = np.array(weights, dtype=np.float64)
+
+
+	def predict(
+		self,
+		logical_ops : Sequence[tuple[int,int]],
+		num_qudits : int,
+		kernel_edges : Sequence[Sequence[int]],
+	) -> float:
+		"""Predicted fraction of the block's CNOTs removed by synthesis."""
+		if len(logical_ops) == 0:
+			return 0
+		return float(
+			block_features(logical_ops, num_qudits, kernel_edges) @ self.weights
+		)
+
+
+	@staticmethod
+	def fit(
+		features : np.ndarray,
+		reductions : np.ndarray,
+	) -> tuple[Predictor, float]:
+		"""
+		Least squares fit of a Predictor.
+
+		Args:
+			features (np.ndarray): One row of block_features per block.
+
+			reductions (np.ndarray): Fraction of CNOTs synthesis removed
+				from each block.
+
+		Returns:
+			predictor (Predictor): The fitted model.
+
+			rms_error (float): Root mean square error on the given blocks.
+		"""
+		(weights, _, _, _) = np.linalg.lstsq(features, reductions, rcond=None)
+		rms_error = float(np.sqrt(np.mean((features @ weights - reductions)**2)))
+		return (Predictor(weights), rms_error)
+
+
+	def save(
+		self,
+		model_file : str,
+		**info : Any,
+	) -> None:
+		with open(f"{model_file}.tmp", "w") as f:
+			json.dump(dict(
+				info,
+				features=list(FEATURES),
+				weights=self.weights.tolist(),
+			), f, indent=1)
+		replace(f"{model_file}.tmp", model_file)
+
+
+@lru_cache(maxsize=8)
+def _load_predictor(
+	model_file : str,
+	mtime : float,
+) -> Predictor:
+	with open(model_file, "r") as f:
+		model = json.load(f)
+	if tuple(model["features"]) != FEATURES:
+		raise ValueError(
+			f"{model_file} was fitted on features {model['features']}, "
+			f"recalibrate it with predictor.py"
+		)
+	return Predictor(model["weights"])
+
+
+def load_predictor(
+	options : dict[str, Any],
+) -> Predictor | None:
+	"""The predictor in options["predictor_file"], None if not set."""
+	model_file = options.get("predictor_file")
+	if model_file is None:
+		return None
+	return _load_predictor(model_file, stat(model_file).st_mtime)
+
+
+def worth_synthesizing(
+	logical_ops : Sequence[tuple[int,int]],
+	num_qudits : int,
+	kernel_edges : Sequence[Sequence[int]],
+	options : dict[str, Any],
+) -> bool:
+	"""
+	False if a predictor is configured and the block is predicted to lose
+	less than options["predict_threshold"] of its CNOTs.
+	"""
+	predictor = load_predictor(options)
+	if predictor is None:
+		return True
+	reduction = predictor.predict(logical_ops, num_qudits, kernel_edges)
+	return reduction >= options.get("predict_threshold", 0.05)
+
+
+def calibration_samples(
+	report_file : str,
+) -> tuple[list[np.ndarray], list[float]]:
+	"""
+	Features and CNOT reductions of the synthesized blocks of one run, given
+	its report (see run_report.py). Blocks that were not synthesized are left
+	out.
+
+	Raises:
+		RuntimeError: If the report does not say where the run's blocks are.
+			Rerunning qutop.py rewrites it.
+	"""
+	with open(report_file, "r") as f:
+		report = json.load(f)
+	if "partition_dir" not in report:
+		raise RuntimeError(
+			f"{report_file} predates partition_dir in reports, rerun the "
+			"synthesis stage to rewrite it"
+		)
+	synthesis_dir = report["synthesis_dir"]
+	subtopology_dir = report["subtopology_dir"]
+	not_synthesized = set(report["fallbacks"].keys())
+
+	features = []
+	reductions = []
+	with open_partition(report["partition_dir"]) as partition:
+		for block_num, block_name in enumerate(partition.block_names):
+			synth_file = f"{synthesis_dir}/{block_name}.qasm"
+			kernel_file = f"{subtopology_dir}/{block_name}_kernel.pickle"
+			if not exists(synth_file) or not exists(kernel_file) or \
+				block_name in not_synthesized:
+				continue
+			(ops, _, _) = qasm_interactions(
+				partition.block_qasm(block_num).splitlines()
+			)
+			if len(ops) == 0:
+				continue
+			with open(synth_file, "r") as f:
+				synth_cnots = count_cnots(f.read())
+			features.append(block_features(
+				ops,
+				len(partition.structure[block_num]),
+				load_block_topology(kernel_file),
+			))
+			reductions.append((len(ops) - synth_cnots) / len(ops))
+	return (features, reductions)
+
+
+if __name__ == "__main__":
+	"""
+	>>> python predictor.py \
+			reports/qft_64_preoptimized_mesh_64_blocksize_4_scan_kernel.json
+
+	Fits the predictor on every synthesized block of the given runs.
+	"""
+	parser = argparse.ArgumentParser(
+		description="Fit the synthesis benefit predictor on finished runs"
+	)
+	parser.add_argument("report_files", type=str, nargs="+",
+		help="reports/<target>.json of finished runs")
+	parser.add_argument("--model", type=str, default="predictor.json",
+		help="file the fitted model is written to")
+	args = parser.parse_args()
+
+	features = []
+	reductions = []
+	for report_file in args.report_files:
+		(run_features, run_reductions) = calibration_samples(report_file)
+		print(f"  {len(run_features)} blocks from {report_file}")
+		features += run_features
+		reductions += run_reductions
+	if len(features) < len(FEATURES):
+		raise RuntimeError(
+			f"Need at least {len(FEATURES)} synthesized blocks to calibrate, "
+			f"found {len(features)}"
+		)
+
+	(predictor, rms_error) = Predictor.fit(
+		np.array(features), np.array(reductions)
+	)
+	for name, weight in zip(FEATURES, predictor.weights):
+		print(f"    {name}: {weight:.4f}")
+	print(f"  RMS error {rms_error:.4f} over {len(features)} blocks")
+	predictor.save(
+		args.model, blocks=len(features), rms_error=rms_error,
+		runs=args.report_files,
+	)
@@ -0,0 +1,178 @@
+"""
+Wall time, CPU time and peak memory of each stage and block of a qutop run.
+
+Events are written as a Chrome trace (open with chrome://tracing or
+https://ui.perfetto.dev), blocks synthesized by worker processes show up on
+their worker's own row.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Iterator
+from contextlib import contextmanager
+from os import getpid, makedirs, times
+from os.path import dirname
+from time import time
+import json
+import resource
+
+
+def _cpu_seconds() -> float:
+	"""CPU time of this process and of every child it has waited for."""
+	t = times()
+	return t.user + t.system + t.children_user + t.children_system
+
+
+def _peak_rss_mb() -> float:
+	"""
+	Peak resident set size of this process and of its largest child so far.
+	These are high water marks over the life of the process, not per stage.
+	"""
+	own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+	# ru_maxrss is in kilobytes on Linux
+	return max([own, children]) / 1024
+
+
+def measure(
+	task : Callable,
+	*args,
+) -> tuple[Any, dict[str, Any]]:
+	"""
+	Call task(*args) and measure it. Meant to run inside worker processes,
+	the measurements are returned to the parent alongside the task's result.
+
+	Returns:
+		result (Any): What task returned.
+
+		measurement (dict[str, Any]): start (seconds since epoch), wall and cpu
+			seconds, peak_rss_mb and the pid of the process that ran the task.
+	"""
+	start = time()
+	cpu = _cpu_seconds()
+	result = task(*args)
+	return (result, {
+		"start" : start,
+		"wall" : time() - start,
+		"cpu" : _cpu_seconds() - cpu,
+		"peak_rss_mb" : _peak_rss_mb(),
+		"pid" : getpid(),
+	})
+
+
+class Profiler:
+
+	def __init__(
+		self,
+		enabled : bool = True,
+	):
+		"""
+		Collects a trace event for every stage and block of a run.
+
+		Arguments:
+			enabled (bool): If False, nothing is measured or recorded.
+		"""
+		self.enabled = enabled
+		self.events = []
+
+
+	@contextmanager
+	def stage(
+		self,
+		name : str,
+		**info,
+	) -> Iterator[None]:
+		"""
+		Measure the body of a with statement as the stage `name`. Keyword
+		arguments are kept with the event, e.g. the block's CNOT count.
+		"""
+		if not self.enabled:
+			yield
+			return
+		start = time()
+		cpu = _cpu_seconds()
+		try:
+			yield
+		finally:
+			self.add(name, {
+				"start" : start,
+				"wall" : time() - start,
+				"cpu" : _cpu_seconds() - cpu,
+				"peak_rss_mb" : _peak_rss_mb(),
+				"pid" : getpid(),
+			}, **info)
+
+
+	def add(
+		self,
+		name : str,
+		measurement : dict[str, Any],
+		**info,
+	) -> None:
+		"""Record a measurement taken elsewhere, see measure()."""
+		if self.enabled:
+			self.events.append(dict(measurement, name=name, info=info))
+
+
+	def blocks(self) -> list[dict[str, Any]]:
+		"""Events of synthesized blocks, slowest first."""
+		return sorted(
+			[e for e in self.events if e["name"].startswith("synthesis/")],
+			key=lambda e: e["wall"],
+			reverse=True,
+		)
+
+
+	def summary(
+		self,
+		num_blocks : int = 10,
+	) -> str:
+		"""Time spent per stage and the slowest synthesized blocks."""
+		string = "\nProfile:\n"
+		for event in self.events:
+			if "/" in event["name"]:
+				continue
+			string += (
+				f"  {event['name']:<16} wall {event['wall']:9.2f}s  "
+				f"cpu {event['cpu']:9.2f}s  "
+				f"peak rss {event['peak_rss_mb']:8.1f}MB\n"
+			)
+		blocks = self.blocks()
+		if len(blocks) > 0:
+			string += f"Slowest blocks ({len(blocks)} synthesized):\n"
+		for event in blocks[:num_blocks]:
+			info = event["info"]
+			string += (
+				f"  {event['name'].split('/')[-1]:<12} "
+				f"wall {event['wall']:9.2f}s  cpu {event['cpu']:9.2f}s  "
+				f"kernel {info.get('kernel', '?'):<12} "
+				f"cnots {info.get('cnots', '?')}\n"
+			)
+		return string
+
+
+	def write(
+		self,
+		trace_file : str,
+	) -> None:
+		"""Write every event to a Chrome trace JSON file."""
+		if not self.enabled:
+			return
+		trace_events = []
+		for event in self.events:
+			trace_events.append({
+				"name" : event["name"],
+				"cat" : event["name"].split("/")[0],
+				"ph" : "X",
+				"ts" : event["start"] * 1e6,
+				"dur" : event["wall"] * 1e6,
+				"pid" : event["pid"],
+				"tid" : 0,
+				"args" : dict(
+					event["info"],
+					cpu_seconds=event["cpu"],
+					peak_rss_mb=event["peak_rss_mb"],
+				),
+			})
+		if dirname(trace_file) != "":
+			makedirs(dirname(trace_file), exist_ok=True)
+		with open(trace_file, "w") as f:
+			json.dump({"traceEvents" : trace_events}, f, indent=1)
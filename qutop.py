@@ -1,6 +1,8 @@
 from __future__ import annotations
+from typing import Any, Sequence
 from os.path import exists
-from os import mkdir, listdir
+from os import mkdir, listdir, remove
+from shutil import rmtree
 import argparse
 import pickle
 from post_synth import replace_blocks
@@ -9,31 +11,38 @@ from bqskit.ir.circuit import Circuit
 from bqskit.ir.gates.constant.cx import CNOTGate
 from bqskit.ir.lang.qasm2.qasm2 import OPENQASM2Language
 from bqskit.compiler.machine import MachineModel
-from bqskit.passes.partitioning.scan import ScanPartitioner
-from bqskit.passes.partitioning.greedy import GreedyPartitioner
-from bqskit.passes.partitioning.quick import QuickPartitioner
 from bqskit.passes.util.intermediate import SaveIntermediatePass
 
 from mapping import do_layout, do_routing, random_layout
 from mapping import dummy_layout, dummy_routing, dummy_synthesis
-from topology import get_logical_operations, kernel_type, run_stats, match_kernel
+from topology import run_stats
 from util import (
-	load_block_circuit,
-	load_circuit_structure,
+	load_qasm_circuit,
 	save_block_topology,
 	setup_options,
 	get_summary,
 )
-from old_codebase import synthesize
+from block_scheduler import schedule_synthesis
+from manifest import Manifest
+from work_queue import wait_for_blocks
+from profiling import Profiler
+from run_report import write_report
+from synthesis_backends import get_backend, synthesis_params
+from pipeline import extract_blocks, fit_kernels, get_partitioner, print_kernel_counts, run_in_memory
+from partition_store import open_partition, store_path_for, write_partition_store
 
 # Enable logging
 import logging
 logging.getLogger('bqskit').setLevel(logging.INFO)
 
 
-if __name__ == '__main__':
-	# Run setup
-	#region setup
+def parse_args(
+	argv : Sequence[str] | None = None,
+) -> argparse.Namespace:
+	"""
+	Parse qutop's command line. `argv` defaults to sys.argv, other callers
+	(e.g. sweep.py) can pass their own argument list.
+	"""
 	parser = argparse.ArgumentParser(
 		description="Run subtopoloy aware synthesis"
 		" based on the hybrid logical-physical topology scheme"
@@ -76,213 +85,425 @@ if __name__ == '__main__':
 		default="none", type=str,
 		help="[none | random | sabre]"
 	)
-	args = parser.parse_args()
-	#endregion
+	parser.add_argument(
+		"--synth_workers", dest="synth_workers", action="store", default=1,
+		type=int, help="number of blocks to synthesize in parallel"
+	)
+	parser.add_argument("--max_cores", dest="max_cores", action="store",
+		default=None, type=int,
+		help="cores synthesis may use in total, all physical cores by default"
+	)
+	parser.add_argument("--synth_backend", dest="synth_backend",
+		action="store", default="qsearch", type=str,
+		help="[qsearch | bqskit] synthesis backend, see synthesis_backends.py"
+	)
+	parser.add_argument("--warm_start", action="store_true",
+		help="with the bqskit backend, only search for blocks with fewer "
+		"CNOTs than the partitioned block"
+	)
+	parser.add_argument("--block_time_budget", dest="block_time_budget",
+		action="store", default=None, type=float,
+		help="seconds each block may be synthesized for before falling back"
+	)
+	parser.add_argument("--block_expansion_budget",
+		dest="block_expansion_budget", action="store", default=None, type=int,
+		help="with the bqskit backend, LEAP nodes each block may expand"
+	)
+	parser.add_argument("--predictor", dest="predictor_file", action="store",
+		default=None, type=str,
+		help="model fitted with predictor.py, used to skip or defer blocks"
+	)
+	parser.add_argument("--predict_threshold", dest="predict_threshold",
+		action="store", default=0.05, type=float,
+		help="predicted fraction of CNOTs removed below which a block is "
+		"skipped or deferred"
+	)
+	parser.add_argument("--predict_action", dest="predict_action",
+		action="store", default="skip", type=str,
+		help="[skip | defer] what to do with blocks not expected to improve"
+	)
+	parser.add_argument("--cache_dir", dest="cache_dir", action="store",
+		default="synthesis_cache", type=str,
+		help="directory of the shared synthesis cache"
+	)
+	parser.add_argument("--no_cache", dest="cache_dir", action="store_const",
+		const=None, help="do not use the shared synthesis cache"
+	)
+	parser.add_argument("--cache_size_mb", dest="cache_size_mb",
+		action="store", default=1024, type=int,
+		help="size limit of the shared synthesis cache"
+	)
+	parser.add_argument("--kernel_memo_dir", dest="kernel_memo_dir",
+		action="store", default="kernel_memo", type=str,
+		help="directory of the kernel selections shared between runs"
+	)
+	parser.add_argument("--no_kernel_memo", dest="kernel_memo_dir",
+		action="store_const", const=None,
+		help="select every block's kernel without the kernel memo"
+	)
+	parser.add_argument("--in_memory", action="store_true",
+		help="pass blocks and kernels between stages without QASM files"
+	)
+	parser.add_argument("--no_checkpoints", action="store_true",
+		help="with --in_memory, do not write block, kernel or synthesis files"
+	)
+	parser.add_argument("--category", dest="category", action="store",
+		default=None, type=str,
+		help="only fit kernels from this template category, e.g. lines"
+	)
+	parser.add_argument("--queue", action="store_true",
+		help="synthesize through the shared work queue, see work_queue.py"
+	)
+	parser.add_argument("--checkpoint_format", dest="checkpoint_format",
+		action="store", default="qasm", type=str,
+		help="[qasm | npz] format blocks are reloaded from"
+	)
+	parser.add_argument("--partition_store", action="store_true",
+		help="keep the partition in one file instead of a directory of blocks"
+	)
+	parser.add_argument("--profile", action="store_true",
+		help="write a trace of each stage and block to profiles/"
+	)
+	return parser.parse_args(argv)
+
 
+def run(
+	args : argparse.Namespace,
+) -> dict[str, Any]:
+	"""
+	Run every stage of qutop for one benchmark, skipping the stages that are
+	already up to date.
+
+	Returns:
+		options (dict[str, Any]): The run's options, including the paths of
+			every file it produced.
+	"""
 	options = setup_options(args.qasm_file, args)
+	# Options the synthesis backend does not support fail before any stage
+	get_backend(options)
 	if not exists(options["synthesis_dir"]):
 		mkdir(options["synthesis_dir"])
+	# Stages are only recomputed when their inputs or parameters changed
+	manifest = Manifest(options["manifest_file"])
+	profiler = Profiler(args.profile)
 
 	# Layout
 	#region layout
 	print("="*80)
 	print(f"Doing layout for {options['target_name']}...")
 	print("="*80) 
-	if exists(options["layout_qasm_file"]):
-		print("Found existing file for %s, skipping layout" 
+	layout_stage = (
+		"layout",
+		[args.qasm_file, options["coupling_map"]],
+		{"layout" : args.layout},
+		[options["layout_qasm_file"]],
+	)
+	if manifest.is_current(*layout_stage):
+		print("Found up to date file for %s, skipping layout" 
 			%(options["layout_qasm_file"]))
 	else:
-		if args.layout == "sabre":
-			do_layout(
-				args.qasm_file, 
-				options["coupling_map"], 
-				options["layout_qasm_file"],
-			)
-		elif args.layout == "random": 
-			random_layout(
-				args.qasm_file,
-				options["coupling_map"], 
-				options["layout_qasm_file"],
-			)
-		else:
-			dummy_layout(
-				args.qasm_file, 
-				options["coupling_map"], 
-				options["layout_qasm_file"],
-			)
+		with profiler.stage("layout"):
+			if args.layout == "sabre":
+				do_layout(
+					args.qasm_file, 
+					options["coupling_map"], 
+					options["layout_qasm_file"],
+				)
+			elif args.layout == "random": 
+				random_layout(
+					args.qasm_file,
+					options["coupling_map"], 
+					options["layout_qasm_file"],
+				)
+			else:
+				dummy_layout(
+					args.qasm_file, 
+					options["coupling_map"], 
+					options["layout_qasm_file"],
+				)
+		manifest.record(*layout_stage)
+		manifest.save()
 	#endregion
 
-	# Partitioning on logical topology
-	#region partitioning
-	print("="*80)
-	print(f"Doing logical partitioning on {options['target_name']}...")
-	print("="*80)
-	if exists(f"{options['partition_dir']}/structure.pickle"):
-		print(
-			f"Found existing files for {options['partition_dir']}"
-			", skipping partitioning..."
+	if options["in_memory"]:
+		#region in memory
+		print("="*80)
+		print(f"Doing in memory synthesis on {options['target_name']}...")
+		print("="*80)
+		in_memory_stage = (
+			"in_memory",
+			[options["layout_qasm_file"]],
+			{
+				"partitioner" : options["partitioner"],
+				"blocksize" : args.blocksize,
+				"alltoall" : args.alltoall,
+				"logical_connectivity" : args.logical_connectivity,
+				"category" : args.category,
+				"topology" : options["topology"],
+				"optimize" : args.optimize,
+				"num_p" : options["num_p"],
+			},
+			[options["synthesized_qasm_file"]],
 		)
+		if not args.partition_only and manifest.is_current(*in_memory_stage):
+			print(
+				f"Found up to date file for {options['synthesized_qasm_file']}, "
+				"skipping in memory synthesis"
+			)
+		else:
+			run_in_memory(
+				options, args.optimize, args.partition_only, profiler
+			)
+			# Checkpoints written by the in memory stages were not produced
+			# through the file based stages, let those adopt them instead.
+			for prefix in ["partitioning", "kernel/", "synthesis/", "assembly"]:
+				manifest.invalidate(prefix)
+			if not args.partition_only:
+				manifest.record(*in_memory_stage)
+			manifest.save()
+		#endregion
 	else:
-		#with open(options["original_qasm_file"], 'r') as f:
-		with open(options["layout_qasm_file"], 'r') as f:
-			circuit = OPENQASM2Language().decode(f.read())
-		
-		if options["partitioner"] == "greedy":
-			partitioner = GreedyPartitioner(args.blocksize)
-		elif options["partitioner"] == "quick":
-			partitioner = QuickPartitioner(args.blocksize)
+		# Partitioning on logical topology
+		#region partitioning
+		print("="*80)
+		print(f"Doing logical partitioning on {options['target_name']}...")
+		print("="*80)
+		store_path = store_path_for(options["partition_dir"])
+		partition_stage = (
+			"partitioning",
+			[options["layout_qasm_file"]],
+			{
+				"partitioner" : options["partitioner"],
+				"blocksize" : args.blocksize,
+				"partition_store" : args.partition_store,
+			},
+			[store_path] if args.partition_store else
+				[f"{options['partition_dir']}/structure.pickle"],
+		)
+		if manifest.is_current(*partition_stage):
+			print(
+				f"Found up to date files for {options['partition_dir']}"
+				", skipping partitioning..."
+			)
 		else:
-			partitioner = ScanPartitioner(args.blocksize)
-
-		partitioner.run(circuit)
+			with profiler.stage("partitioning"):
+				# The saver would write to a new directory if the old one is kept
+				if exists(options["partition_dir"]):
+					rmtree(options["partition_dir"])
+				if exists(store_path):
+					remove(store_path)
+				#with open(options["original_qasm_file"], 'r') as f:
+				circuit = load_qasm_circuit(options["layout_qasm_file"])
+		
+				get_partitioner(options["partitioner"], args.blocksize).run(circuit)
 
-		saver = SaveIntermediatePass(
-			"block_files/", 
-			options["save_part_name"],
-			save_as_qasm=True,
-		)
-		saver.run(circuit, {})
+				if args.partition_store:
+					(names, blocks, groups) = extract_blocks(circuit)
+					write_partition_store(
+						store_path,
+						names,
+						[OPENQASM2Language().encode(block) for block in blocks],
+						groups,
+					)
+				else:
+					saver = SaveIntermediatePass(
+						"block_files/", 
+						options["save_part_name"],
+						save_as_qasm=True,
+					)
+					saver.run(circuit, {})
+			manifest.record(*partition_stage)
+			manifest.save()
 
-	block_files = sorted(listdir(options["partition_dir"]))
-	block_names = []
-	block_files.remove("structure.pickle")
-	for bf in block_files:
+		partition = open_partition(options["partition_dir"])
+		block_names = list(partition.block_names)
 		if options["checkpoint_as_qasm"]:
-			block_names.append(bf.split(".qasm")[0])
+			block_files = [f"{name}.qasm" for name in block_names]
 		else:
-			block_names.append(bf.split(".pickle")[0])
-	#endregion
+			block_files = [f"{name}.pickle" for name in block_names]
+		# Blocks are hashed from the store when the partition is kept in one
+		block_sources = [
+			partition.block_source(block_num)
+			for block_num in range(len(block_names))
+		]
+		#endregion
 
-	# Kernel Fitting
-	#region subtopology
-	print("="*80)
-	print(f"Doing subtopology analysis on {options['target_name']}...")
-	print("="*80)
-	if not exists(options["subtopology_dir"]):
-		mkdir(options["subtopology_dir"])
+		# Kernel Fitting
+		#region subtopology
+		print("="*80)
+		print(f"Doing subtopology analysis on {options['target_name']}...")
+		print("="*80)
+		if not exists(options["subtopology_dir"]):
+			mkdir(options["subtopology_dir"])
 	
-	if exists(f"{options['subtopology_dir']}/summary.txt"):
-		print(
-			f"Found existing files for {options['subtopology_dir']},"
-			" skipping subtopology generation..."
-		)
-	else:
-		structure = load_circuit_structure(options["partition_dir"])
-		for block_num in range(len(block_files)):
-			print(f"  Analyzing {block_names[block_num]}...")
-			block_path = f"{options['partition_dir']}/{block_files[block_num]}"
-			
-			if args.alltoall:
-				subtopology = set([])
-				for i in range(args.blocksize):
-					for j in range(args.blocksize-1, i, -1):
-						subtopology.add((i,j))
-				print(subtopology)
-			elif args.logical_connectivity:
-				subtopology = set(
-					get_logical_operations(
-						load_block_circuit(block_path, options)
-					)
-				)
-				print(subtopology)
-			else:
-				subtopology = match_kernel(
-					block_path,
-					structure[block_num],
-					options
-				)
-			subtopology_path = (
-				f"{options['subtopology_dir']}/{block_names[block_num]}"
-				f"_kernel.pickle"
-			)
-			# Saving the edge list
-			save_block_topology(subtopology, subtopology_path)
-			print(
-				f"    Group: {structure[block_num]}\n"
-				f"    Kernel: {kernel_type(subtopology, len(structure[block_num]))}"
-				f" - {subtopology}\n"
-			)
-		summary = get_summary(options, block_files)
-		with open(f"{options['subtopology_dir']}/summary.txt", "a") as f:
-			f.write(summary)
-	#endregion
+		structure = partition.structure
+		kernel_params = {
+			"alltoall" : args.alltoall,
+			"logical_connectivity" : args.logical_connectivity,
+			"category" : args.category,
+			"topology" : options["topology"],
+			"blocksize" : args.blocksize,
+		}
+		kernel_stages = [
+			(
+				f"kernel/{block_names[block_num]}",
+				[block_sources[block_num]],
+				dict(kernel_params, group=list(structure[block_num])),
+				[
+					f"{options['subtopology_dir']}/{block_names[block_num]}"
+					f"_kernel.pickle"
+				],
+			) for block_num in range(len(block_files))
+		]
+		stale_kernels = [
+			block_num for block_num in range(len(block_files))
+			if not manifest.is_current(*kernel_stages[block_num])
+		]
+		manifest.save()
+		# Kernels of blocks that are no longer in the partition
+		kernel_files = set([stage[3][0].split("/")[-1] for stage in kernel_stages])
+		for kf in listdir(options["subtopology_dir"]):
+			if kf.endswith("_kernel.pickle") and kf not in kernel_files:
+				remove(f"{options['subtopology_dir']}/{kf}")
 
-	# Synthesis
-	#region synthesis
-	print("="*80)
-	print(f"Doing Synthesis on {options['layout_qasm_file']}...")
-	print("="*80)
-	if exists(options['synthesized_qasm_file']):
-		print(
-			f"Found existing file for {options['synthesized_qasm_file']}, "
-			"skipping synthesis\n", "="*80
-		)
-	elif not args.partition_only:
-		synthesized_circuit = Circuit(options["num_p"])
-		structure = load_circuit_structure(options["partition_dir"])
-		block_list = list(range(0, len(block_files)))
-		for block_number in block_list:
+		if len(stale_kernels) == 0 and \
+			exists(f"{options['subtopology_dir']}/summary.txt"):
 			print(
-				f"    Synthesizing block {block_number+1}/{len(block_files)}"
-			)
-			synthesize(
-				block_name=block_names[block_number],
-				qudit_group=structure[block_number],
-				options=options,
+				f"Found up to date files for {options['subtopology_dir']},"
+				" skipping subtopology generation..."
 			)
+		else:
+			with profiler.stage("kernel_fitting"):
+				print(f"  Fitting kernels to {len(stale_kernels)} blocks...")
+				subtopologies = fit_kernels(
+					options["partition_dir"], structure, options, stale_kernels
+				)
+				for block_num, subtopology in zip(stale_kernels, subtopologies):
+					# Saving the edge list
+					save_block_topology(subtopology, kernel_stages[block_num][3][0])
+					manifest.record(*kernel_stages[block_num])
+				print_kernel_counts(subtopologies, stale_kernels, structure)
+			manifest.save()
+			summary = get_summary(options, block_files)
+			with open(f"{options['subtopology_dir']}/summary.txt", "w") as f:
+				f.write(summary)
+		#endregion
 
-		if not exists(options["opt_dir"]):
-			mkdir(options["opt_dir"])
-		# Format QASM as subcircuit & add to circuit
-		for block_num in range(len(block_files)):
-			with open(
-				f"{options['synthesis_dir']}/{block_names[block_num]}.qasm",
-				"r"
-			) as f:
-				subcircuit_qasm = f.read()
-			subcircuit = OPENQASM2Language().decode(subcircuit_qasm)
-			opt_subcircuit = OPENQASM2Language().decode(subcircuit_qasm)
-
-			if args.optimize:
-				print(f"Optimizing block {block_num+1}/{len(block_files)}")
-				if not exists(f"{options['opt_dir']}/{block_names[block_num]}.qasm"):
-					from bqskit.passes.processing.scan import ScanningGateRemovalPass
-					ScanningGateRemovalPass().run(opt_subcircuit)
-					with open(f"{options['opt_dir']}/{block_names[block_num]}.qasm", "w") as f:
-						f.write(OPENQASM2Language().encode(opt_subcircuit))
+		# Synthesis
+		#region synthesis
+		print("="*80)
+		print(f"Doing Synthesis on {options['layout_qasm_file']}...")
+		print("="*80)
+		if not args.partition_only:
+			synthesis_inputs = []
+			if "predictor_file" in synthesis_params(options):
+				synthesis_inputs.append(options["predictor_file"])
+			synthesis_stages = [
+				(
+					f"synthesis/{block_names[block_num]}",
+					[block_sources[block_num], kernel_stages[block_num][3][0]]
+					+ synthesis_inputs,
+					synthesis_params(options),
+					[f"{options['synthesis_dir']}/{block_names[block_num]}.qasm"],
+				) for block_num in range(len(block_files))
+			]
+			# Remove checkpoints that were synthesized from an older block or
+			# kernel so that the scheduler synthesizes them again.
+			for stage in synthesis_stages:
+				if exists(stage[3][0]) and not manifest.is_current(*stage):
+					remove(stage[3][0])
+			with profiler.stage("synthesis"):
+				if args.queue:
+					wait_for_blocks(
+						block_names, structure, options, args.synth_workers
+					)
 				else:
-					opt_subcircuit = Circuit(1).from_file(f"{options['opt_dir']}/{block_names[block_num]}.qasm")
-			if opt_subcircuit.count(CNOTGate()) < subcircuit.count(CNOTGate()):
-				subcircuit = opt_subcircuit
-			# Handle the case where the circuit is still smaller than the qudit
-			# group, should only happen on circuits synthesized in an older
-			# version.
-			group_len = subcircuit.num_qudits
-			qudit_group = [structure[block_num][x] for x in range(group_len)]
-			synthesized_circuit.append_circuit(subcircuit, qudit_group)
+					schedule_synthesis(block_names, structure, options, profiler)
+			write_report(block_names, options)
+			for stage in synthesis_stages:
+				manifest.record(*stage)
+			manifest.save()
 
-		with open(options["synthesized_qasm_file"], 'w') as f:
-			f.write(OPENQASM2Language().encode(synthesized_circuit))
-		#endregion
+			assembly_stage = (
+				"assembly",
+				[stage[3][0] for stage in synthesis_stages] + 
+					[partition.structure_source],
+				{"optimize" : args.optimize, "num_p" : options["num_p"]},
+				[options["synthesized_qasm_file"]],
+			)
+			if manifest.is_current(*assembly_stage):
+				print(
+					f"Found up to date file for {options['synthesized_qasm_file']}, "
+					"skipping assembly"
+				)
+			else:
+				with profiler.stage("assembly"):
+					synthesized_circuit = Circuit(options["num_p"])
+					if not exists(options["opt_dir"]):
+						mkdir(options["opt_dir"])
+					# Format QASM as subcircuit & add to circuit
+					for block_num in range(len(block_files)):
+						with open(
+							f"{options['synthesis_dir']}/{block_names[block_num]}.qasm",
+							"r"
+						) as f:
+							subcircuit_qasm = f.read()
+						subcircuit = OPENQASM2Language().decode(subcircuit_qasm)
+						opt_subcircuit = subcircuit.copy()
+
+						if args.optimize:
+							print(f"Optimizing block {block_num+1}/{len(block_files)}")
+							with profiler.stage(f"optimize/{block_names[block_num]}"):
+								if not exists(f"{options['opt_dir']}/{block_names[block_num]}.qasm"):
+									from bqskit.passes.processing.scan import ScanningGateRemovalPass
+									ScanningGateRemovalPass().run(opt_subcircuit)
+									with open(f"{options['opt_dir']}/{block_names[block_num]}.qasm", "w") as f:
+										f.write(OPENQASM2Language().encode(opt_subcircuit))
+								else:
+									opt_subcircuit = Circuit(1).from_file(f"{options['opt_dir']}/{block_names[block_num]}.qasm")
+						if opt_subcircuit.count(CNOTGate()) < subcircuit.count(CNOTGate()):
+							subcircuit = opt_subcircuit
+						# Handle the case where the circuit is still smaller than the qudit
+						# group, should only happen on circuits synthesized in an older
+						# version.
+						group_len = subcircuit.num_qudits
+						qudit_group = [structure[block_num][x] for x in range(group_len)]
+						synthesized_circuit.append_circuit(subcircuit, qudit_group)
 
+					with open(options["synthesized_qasm_file"], 'w') as f:
+						f.write(OPENQASM2Language().encode(synthesized_circuit))
+				manifest.record(*assembly_stage)
+				manifest.save()
+			#endregion
+
+	if not args.partition_only:
 		# Relayout
 		#region relayout
 		print("="*80)
 		print(f"Doing Relayout for {options['synthesized_qasm_file']}...")
 		print("="*80)
-		if exists(options["relayout_qasm_file"]):
+		relayout_stage = (
+			"relayout",
+			[options["synthesized_qasm_file"], options["coupling_map"]],
+			{},
+			[options["relayout_qasm_file"], options["relayout_remapping_file"]],
+		)
+		if manifest.is_current(*relayout_stage):
 			print(
-				f"Found existing file for {options['relayout_qasm_file']}, "
+				f"Found up to date file for {options['relayout_qasm_file']}, "
 				"skipping relayout" 
 			)
 		else:
-			logical_to_physical = do_layout(
-				options["synthesized_qasm_file"],
-				options["coupling_map"], 
-				options["relayout_qasm_file"],
-			)
-			with open(options["relayout_remapping_file"], "wb") as f:
-				pickle.dump(logical_to_physical, f)
+			with profiler.stage("relayout"):
+				logical_to_physical = do_layout(
+					options["synthesized_qasm_file"],
+					options["coupling_map"], 
+					options["relayout_qasm_file"],
+				)
+				with open(options["relayout_remapping_file"], "wb") as f:
+					pickle.dump(logical_to_physical, f)
+			manifest.record(*relayout_stage)
+			manifest.save()
 		#endregion
 
 		# Routing
@@ -290,25 +511,34 @@ if __name__ == '__main__':
 		print("="*80)
 		print(f"Doing Routing for {options['relayout_qasm_file']}...")
 		print("="*80)
-		if exists(options["mapped_qasm_file"]):
+		routing_stage = (
+			"routing",
+			[options["relayout_qasm_file"], options["coupling_map"]],
+			{"router" : args.router, "dummy_map" : args.dummy_map},
+			[options["mapped_qasm_file"]],
+		)
+		if manifest.is_current(*routing_stage):
 			print(
-				f"Found existing file for {options['mapped_qasm_file']}, "
+				f"Found up to date file for {options['mapped_qasm_file']}, "
 				"skipping routing" 
 			)
-		elif not args.partition_only:
-			if not args.dummy_map:
-				do_routing(
-					options["relayout_qasm_file"], 
-					options["coupling_map"], 
-					options["mapped_qasm_file"],
-					options,
-				)
-			else:
-				dummy_routing(
-					options["relayout_qasm_file"], 
-					options["coupling_map"], 
-					options["mapped_qasm_file"],
-				)
+		else:
+			with profiler.stage("routing"):
+				if not args.dummy_map:
+					do_routing(
+						options["relayout_qasm_file"], 
+						options["coupling_map"], 
+						options["mapped_qasm_file"],
+						options,
+					)
+				else:
+					dummy_routing(
+						options["relayout_qasm_file"], 
+						options["coupling_map"], 
+						options["mapped_qasm_file"],
+					)
+			manifest.record(*routing_stage)
+			manifest.save()
 		#endregion
 	## POST PROCESS
 	# post processing
@@ -319,3 +549,11 @@ if __name__ == '__main__':
 	#	if not exists(options["remapped_qasm_file"]):
 	#		replace_blocks(options)
 	#	print(run_stats(options, resynthesized=True))
+	if args.profile:
+		print(profiler.summary())
+		profiler.write(options["profile_file"])
+	return options
+
+
+if __name__ == '__main__':
+	run(parse_args())
@@ -3,9 +3,13 @@ from __future__ import annotations
 from sys import argv
 from os import listdir
 from pickle import load, dump
-from topology import kernel_score_function, get_logical_operations, construct_permuted_kernel
+from topology import get_logical_operations
 from util import load_block_circuit
-from itertools import permutations
+from kernel_matching import best_permuted_kernel
+from templates import (
+	LINE_2, LINE_3, LINE_4, LINE_5, ALLS_3, ALLS_4, ALLS_5, RING_4, STAR_4,
+	KITE_4, THETA_4, STAR_5, DIPPER_5, TEES_5,
+)
 import argparse
 
 
@@ -31,21 +35,6 @@ def match_kernel(
 		raise RuntimeError(
 			"Only blocksizes up to 5 are currently supported."
 		)
-	line_2 = [(0,1)]
-	line_3 = [(0,1), (1,2)]
-	line_4 = [(0,1), (1,2), (2,3)]
-	line_5 = [(0,1), (1,2), (2,3), (3,4)]
-	alls_3 = [(0,1), (0,2), (1,2)]
-	alls_4 = [(0,1), (0,2), (0,3), (1,2), (1,3), (2,3)]
-	alls_5 = [(0,1), (0,2), (0,3), (0,4), (1,2), (1,3), (1,4), (2,3), (2,4), (3,4)]
-	ring_4 = [(0,1), (1,2), (2,3), (0,3)]
-	star_4 = [(0,1), (0,2), (0,3)]
-	kite_4 = [(0,1), (1,2), (2,3), (1,3)]
-	theta_4 = [(0,1), (1,2), (2,3), (0,3), (1,3)]
-	star_5 = [(0,1), (0,2), (0,3), (0,4)]
-	dipper = [(0,1), (1,2), (2,3), (0,3), (0,4)]
-	tees_5 = [(0,1), (1,2), (1,3), (3,4)]
-
 	circuit = load_block_circuit(circuit_file, options)
 	logical_ops = get_logical_operations(circuit)
 	num_qubits = len(qudit_group)
@@ -55,67 +44,54 @@ def match_kernel(
 	if num_qubits < 2:
 		templates = []
 	elif num_qubits == 2:
-		templates = [line_2]
+		templates = [LINE_2]
 	elif num_qubits == 3:
 		if options['category'] in ("lines", "stars", "rings", "kites", "thetas"):
-			templates = [line_3]
+			templates = [LINE_3]
 		elif options['category'] == "alls":
-			templates = [alls_3]
+			templates = [ALLS_3]
 		else:
 			raise RuntimeError(f"Unrecognized options['category'] {options['category']}")
 	elif num_qubits == 4:
 		if options['category'] == "lines":
-			templates = [line_4]
+			templates = [LINE_4]
 		elif options['category'] == "stars":
-			templates = [star_4]
+			templates = [STAR_4]
 		elif options['category'] == "rings":
-			templates = [ring_4]
+			templates = [RING_4]
 		elif options['category'] == "alls":
-			templates = [alls_4]
+			templates = [ALLS_4]
 		elif options['category'] == "kites":
-			templates = [kite_4]
+			templates = [KITE_4]
 		elif options['category'] == "thetas":
-			templates = [theta_4]
+			templates = [THETA_4]
 		elif options['category'] == "embedded":
-			templates = [line_4, star_4, ring_4]
+			templates = [LINE_4, STAR_4, RING_4]
 		elif options['category'] == "trees":
-			templates = [line_4, star_4]
+			templates = [LINE_4, STAR_4]
 		else:
 			raise RuntimeError(f"Unrecognized options['category'] {options['category']}")
 	elif num_qubits == 5:
 		if options['category'] == "lines":
-			templates = [line_5]
+			templates = [LINE_5]
 		elif options['category'] == "stars":
-			templates = [star_5]
+			templates = [STAR_5]
 		elif options['category'] == "tees":
-			templates = [tees_5]
+			templates = [TEES_5]
 		elif options['category'] == "dippers":
-			templates = [tees_5]
+			templates = [TEES_5]
 		elif options['category'] == "alls":
-			templates = [alls_5]
+			templates = [ALLS_5]
 		elif options['category'] == "embedded":
-			templates = [line_5, star_5, tees_5, dipper]
+			templates = [LINE_5, STAR_5, TEES_5, DIPPER_5]
 		elif options['category'] == "trees":
-			templates = [line_5, star_5, tees_5]
+			templates = [LINE_5, STAR_5, TEES_5]
 		else:
 			raise RuntimeError(f"Unrecognized options['category'] {options['category']}")
 	else:
 		raise RuntimeError("Only upto 5 qubits blocks supported.")
 
-	vertex_list  = list(range(num_qubits))
-	vertex_perms = list(permutations(vertex_list, num_qubits))
-	best_kernel = []
-	best_score  = 0
-	for template in templates:
-		for perm in vertex_perms:
-			permuted_kernel = construct_permuted_kernel(template, perm)
-			edge_score, node_score = kernel_score_function(logical_ops, permuted_kernel)
-			#if edge_score + node_score > best_score:
-			if edge_score > best_score:
-				best_kernel = permuted_kernel
-				best_score = edge_score
-
-	return best_kernel
+	return best_permuted_kernel(logical_ops, templates, num_qubits)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,159 @@
+"""
+Core budget of the synthesis stage.
+
+Synthesis is parallel at several levels: blocks are synthesized at once by
+block_scheduler.py and work_queue.py, each qsearch run spreads its search
+over a pool of tasks, LEAP reoptimizing post processing runs its own pool,
+and every multistart solver in it starts several processes of its own. Sized
+independently from the core count, these multiply and oversubscribe the
+machine. Instead, every level takes its share of one CoreBudget:
+
+	blocks: at most one block worker per core (block_workers), each getting
+		an equal share of the cores (share).
+	search: one qsearch task per core of the share (search_tasks). The bqskit
+		backend searches in the block worker itself.
+	post processing: up to MAX_MULTISTARTS multistart processes
+		(multistarts), times as many parallel post processing tasks as fit
+		in the share (post_processing_tasks).
+
+Every core is then busy with one process, so BLAS libraries are limited to a
+single thread in each instead of starting a thread per core in every
+process: for good in processes that only synthesize (pin_blas_threads), and
+only while blocks are synthesized in a process that goes on to other stages
+(limited_blas_threads).
+
+The budget is the machine's physical cores, or options["max_cores"].
+"""
+from __future__ import annotations
+from typing import Any, Iterator
+from contextlib import contextmanager
+from os import environ
+
+from psutil import cpu_count
+
+
+# Upper limits kept from the original qsearch settings
+MAX_TASKS = 128
+MAX_MULTISTARTS = 8
+
+BLAS_THREAD_VARIABLES = (
+	"OMP_NUM_THREADS",
+	"OPENBLAS_NUM_THREADS",
+	"MKL_NUM_THREADS",
+	"VECLIB_MAXIMUM_THREADS",
+	"NUMEXPR_NUM_THREADS",
+)
+
+
+class CoreBudget:
+
+	def __init__(
+		self,
+		cores : int,
+	):
+		"""
+		A number of cores to be shared by nested levels of parallelism.
+
+		Arguments:
+			cores (int): Cores in the budget, at least 1.
+		"""
+		self.cores = max(cores, 1)
+
+
+	@staticmethod
+	def for_machine(
+		max_cores : int | None = None,
+	) -> CoreBudget:
+		"""Physical cores of the machine, or max_cores if given."""
+		if max_cores is not None:
+			return CoreBudget(max_cores)
+		return CoreBudget(cpu_count(logical=False) or 1)
+
+
+	def block_workers(
+		self,
+		requested : int,
+		num_blocks : int,
+	) -> int:
+		"""Number of blocks to synthesize at once, at most one per core."""
+		return max(min(requested, num_blocks, self.cores), 1)
+
+
+	def share(
+		self,
+		num_workers : int,
+	) -> CoreBudget:
+		"""Budget of each of num_workers processes sharing this one."""
+		return CoreBudget(self.cores // max(num_workers, 1))
+
+
+	def search_tasks(self) -> int:
+		return min(self.cores, MAX_TASKS)
+
+
+	def multistarts(self) -> int:
+		return min(self.cores, MAX_MULTISTARTS)
+
+
+	def post_processing_tasks(self) -> int:
+		return max(self.cores // self.multistarts(), 1)
+
+
+def block_budget(
+	options : dict[str, Any],
+) -> CoreBudget:
+	"""
+	Budget of one synthesis process: the machine's budget (see
+	options["max_cores"]) split among the options["num_synth_procs"]
+	processes synthesizing blocks on it.
+	"""
+	return CoreBudget.for_machine(options.get("max_cores")).share(
+		options.get("num_synth_procs", 1)
+	)
+
+
+def pin_blas_threads(
+	num_threads : int = 1,
+) -> None:
+	"""
+	Limit BLAS libraries to num_threads threads in this process and in every
+	process it starts. Libraries already loaded are only limited if
+	threadpoolctl is installed.
+	"""
+	for variable in BLAS_THREAD_VARIABLES:
+		environ[variable] = str(num_threads)
+	try:
+		from threadpoolctl import threadpool_limits
+	except ImportError:
+		return
+	threadpool_limits(num_threads)
+
+
+@contextmanager
+def limited_blas_threads(
+	num_threads : int = 1,
+) -> Iterator[None]:
+	"""
+	pin_blas_threads for the body only, the environment and the limits of
+	loaded libraries are restored after it.
+	"""
+	previous = {
+		variable : environ.get(variable) for variable in BLAS_THREAD_VARIABLES
+	}
+	for variable in BLAS_THREAD_VARIABLES:
+		environ[variable] = str(num_threads)
+	try:
+		from threadpoolctl import threadpool_limits
+		limits = threadpool_limits(num_threads)
+	except ImportError:
+		limits = None
+	try:
+		yield
+	finally:
+		if limits is not None:
+			limits.restore_original_limits()
+		for variable, value in previous.items():
+			if value is None:
+				environ.pop(variable, None)
+			else:
+				environ[variable] = value
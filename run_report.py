@@ -0,0 +1,113 @@
+"""
+Report of a run's synthesis stage, written to options["report_file"].
+
+Blocks that ran out of their synthesis budget (see
+synthesis_backends.synthesize_block) or that the predictor skipped (see
+predictor.py) are recorded as <synthesis_dir>/.fallbacks/<block name>.json by
+whichever process or machine handled them, and gathered into the report once
+the stage is done. A record is removed again when its block is synthesized
+without falling back.
+"""
+from __future__ import annotations
+from typing import Any, Sequence
+from collections import Counter
+from os import makedirs, remove, replace
+from os.path import dirname, exists
+from re import match
+import json
+
+
+def _fallback_path(
+	block_name : str,
+	options : dict[str, Any],
+) -> str:
+	return f"{options['synthesis_dir']}/.fallbacks/{block_name}.json"
+
+
+def count_cnots(qasm : str) -> int:
+	return len([line for line in qasm.splitlines() if match("cx", line)])
+
+
+def record_fallback(
+	block_name : str,
+	fallback : str,
+	original_cnots : int,
+	cnots : int,
+	options : dict[str, Any],
+) -> None:
+	"""
+	Note that a block fell back to a partial result or its original circuit,
+	or was not synthesized at all.
+
+	Args:
+		block_name (str): Name of the block.
+
+		fallback (str): "partial", "original" or "skipped".
+
+		original_cnots (int): CNOTs of the partitioned block.
+
+		cnots (int): CNOTs of the block that is used instead.
+
+		options (dict[str, Any]): Options of the run.
+	"""
+	path = _fallback_path(block_name, options)
+	makedirs(dirname(path), exist_ok=True)
+	with open(f"{path}.tmp", "w") as f:
+		json.dump({
+			"fallback" : fallback,
+			"original_cnots" : original_cnots,
+			"cnots" : cnots,
+		}, f)
+	replace(f"{path}.tmp", path)
+
+
+def clear_fallback(
+	block_name : str,
+	options : dict[str, Any],
+) -> None:
+	path = _fallback_path(block_name, options)
+	if exists(path):
+		remove(path)
+
+
+def write_report(
+	block_names : Sequence[str],
+	options : dict[str, Any],
+) -> dict[str, Any]:
+	"""
+	Gather the fallbacks of a partition's blocks into options["report_file"],
+	along with the directories the run's blocks, kernels and synthesized
+	blocks are in.
+
+	Returns:
+		report (dict[str, Any]): The report as written.
+	"""
+	fallbacks = {}
+	for block_name in block_names:
+		path = _fallback_path(block_name, options)
+		if exists(path):
+			with open(path, "r") as f:
+				fallbacks[block_name] = json.load(f)
+	report = {
+		"target_name" : options["target_name"],
+		"partition_dir" : options["partition_dir"],
+		"subtopology_dir" : options["subtopology_dir"],
+		"synthesis_dir" : options["synthesis_dir"],
+		"synth_backend" : options.get("synth_backend"),
+		"block_time_budget" : options.get("block_time_budget"),
+		"block_expansion_budget" : options.get("block_expansion_budget"),
+		"predictor_file" : options.get("predictor_file"),
+		"predict_threshold" : options.get("predict_threshold"),
+		"blocks" : len(block_names),
+		"fallbacks" : fallbacks,
+	}
+	report_file = options["report_file"]
+	if dirname(report_file) != "":
+		makedirs(dirname(report_file), exist_ok=True)
+	with open(f"{report_file}.tmp", "w") as f:
+		json.dump(report, f, indent=1)
+	replace(f"{report_file}.tmp", report_file)
+	kinds = Counter([record["fallback"] for record in fallbacks.values()])
+	for kind, count in sorted(kinds.items()):
+		print(f"    {kind}: {count} blocks, see {report_file}")
+	return report
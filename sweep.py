@@ -0,0 +1,240 @@
+"""
+Run qutop.py over a sweep of benchmarks and settings from a single command.
+
+Jobs are run by a pool of long lived worker processes. Each worker imports
+qiskit, pytket, qsearch and bqskit and loads the coupling maps once, instead
+of paying for a new interpreter per benchmark, and keeps the last few parsed
+layout circuits for jobs that only differ in their partitioner. Results of every job are collected into
+one CSV table.
+
+A sweep spec is a JSON file such as
+	{
+		"qasm_files" : ["qasm/qft_64_preoptimized.qasm"],
+		"topologies" : ["mesh", "falcon"],
+		"blocksizes" : [3, 4],
+		"partitioners" : ["scan"],
+		"categories" : [null, "lines", "stars"],
+		"args" : ["--router", "qiskit"]
+	}
+where every combination of the lists is run and "args" are passed on to
+qutop.py unchanged. A null category fits kernels from every template.
+
+Jobs run at once split the machine's cores (or --max_cores) evenly, each is
+passed its share as qutop.py's --max_cores unless "args" already sets it.
+"""
+from __future__ import annotations
+from typing import Any, Sequence
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from importlib import import_module
+from itertools import product
+from os import listdir, makedirs
+from os.path import exists
+from re import match
+from time import perf_counter
+import argparse
+import csv
+import json
+
+from resources import CoreBudget
+
+
+RESULT_FIELDS = [
+	"qasm_file",
+	"topology",
+	"blocksize",
+	"partitioner",
+	"category",
+	"target_name",
+	"status",
+	"seconds",
+	"original_cnots",
+	"synthesized_cnots",
+	"mapped_cnots",
+	"mapped_swaps",
+	"error",
+]
+
+
+def expand_jobs(
+	spec : dict[str, Any],
+) -> list[dict[str, Any]]:
+	"""
+	Every combination of qasm file, topology, blocksize, partitioner and
+	kernel category in the sweep spec.
+	"""
+	return [
+		{
+			"qasm_file" : qasm_file,
+			"topology" : topology,
+			"blocksize" : blocksize,
+			"partitioner" : partitioner,
+			"category" : category,
+		} for (qasm_file, topology, blocksize, partitioner, category) in product(
+			spec["qasm_files"],
+			spec.get("topologies", ["mesh"]),
+			spec.get("blocksizes", [3]),
+			spec.get("partitioners", ["quick"]),
+			spec.get("categories", [None]),
+		)
+	]
+
+
+def job_argv(
+	job : dict[str, Any],
+	extra_args : Sequence[str],
+) -> list[str]:
+	argv = [
+		job["qasm_file"],
+		"--topology", job["topology"],
+		"--blocksize", str(job["blocksize"]),
+		"--partitioner", job["partitioner"],
+	]
+	if job["category"] is not None:
+		argv += ["--category", job["category"]]
+	return argv + list(extra_args)
+
+
+def count_gates(
+	qasm_file : str,
+) -> tuple[int, int] | tuple[None, None]:
+	"""Number of (cx, swap) gates in a QASM file, if it exists."""
+	if not exists(qasm_file):
+		return (None, None)
+	cnots = 0
+	swaps = 0
+	with open(qasm_file, "r") as f:
+		for line in f:
+			if match("cx", line):
+				cnots += 1
+			elif match("swap", line):
+				swaps += 1
+	return (cnots, swaps)
+
+
+def _init_worker() -> None:
+	"""
+	Import the pipeline and load every coupling map once per worker so that
+	jobs only pay for the work specific to them.
+	"""
+	import_module("qutop")
+	from coupling import coupling_graph
+	for coupling_map in listdir("coupling_maps"):
+		if not coupling_map.endswith(".npy"):
+			coupling_graph(f"coupling_maps/{coupling_map}")
+
+
+def _run_job(
+	job : dict[str, Any],
+	extra_args : Sequence[str],
+	log_dir : str,
+) -> dict[str, Any]:
+	import qutop
+	from util import setup_options
+
+	args = qutop.parse_args(job_argv(job, extra_args))
+	options = setup_options(args.qasm_file, args)
+	row = dict(job)
+	row["target_name"] = options["target_name"]
+	start = perf_counter()
+	try:
+		with open(f"{log_dir}/{options['target_name']}.log", "w") as log:
+			with redirect_stdout(log):
+				qutop.run(args)
+		row["status"] = "ok"
+	except Exception as e:
+		row["status"] = "failed"
+		row["error"] = repr(e)
+	row["seconds"] = round(perf_counter() - start, 3)
+	row["original_cnots"] = count_gates(options["original_qasm_file"])[0]
+	row["synthesized_cnots"] = count_gates(options["synthesized_qasm_file"])[0]
+	(row["mapped_cnots"], row["mapped_swaps"]) = count_gates(
+		options["mapped_qasm_file"]
+	)
+	return row
+
+
+def run_sweep(
+	spec : dict[str, Any],
+	results_file : str,
+	num_workers : int = 1,
+	log_dir : str = "sweep_logs",
+	max_cores : int | None = None,
+) -> list[dict[str, Any]]:
+	"""
+	Run every job of a sweep spec and write one row per job to results_file.
+	Rows are written as jobs finish, so an interrupted sweep keeps the
+	results it already has. Rerunning a sweep only redoes out of date stages.
+
+	Args:
+		spec (dict[str, Any]): The sweep spec, see the module docstring.
+
+		results_file (str): CSV file the results table is written to.
+
+		num_workers (int): Number of jobs run at once.
+
+		log_dir (str): Each job's output goes to <log_dir>/<target>.log.
+
+		max_cores (int | None): Cores shared by all jobs run at once, all
+			physical cores if None.
+
+	Returns:
+		rows (list[dict[str, Any]]): The results table.
+	"""
+	jobs = expand_jobs(spec)
+	extra_args = list(spec.get("args", []))
+	if "--max_cores" not in extra_args:
+		share = CoreBudget.for_machine(max_cores).share(
+			min(num_workers, len(jobs))
+		)
+		extra_args += ["--max_cores", str(share.cores)]
+	makedirs(log_dir, exist_ok=True)
+	rows = []
+	with open(results_file, "w", newline="") as f:
+		writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+		writer.writeheader()
+		with ProcessPoolExecutor(
+			max_workers=num_workers, initializer=_init_worker
+		) as executor:
+			futures = [
+				executor.submit(_run_job, job, extra_args, log_dir)
+				for job in jobs
+			]
+			for count, future in enumerate(as_completed(futures)):
+				row = future.result()
+				rows.append(row)
+				writer.writerow(row)
+				f.flush()
+				print(
+					f"[{count+1}/{len(jobs)}] {row['target_name']}: "
+					f"{row['status']} in {row['seconds']}s"
+				)
+	return rows
+
+
+if __name__ == "__main__":
+	"""
+	>>> python sweep.py sweeps/paper.json --workers 8 --results results.csv
+	"""
+	parser = argparse.ArgumentParser(
+		description="Run qutop.py on every combination in a sweep spec"
+	)
+	parser.add_argument("spec", type=str, help="JSON sweep spec")
+	parser.add_argument("--workers", dest="workers", action="store",
+		default=1, type=int, help="number of jobs to run at once"
+	)
+	parser.add_argument("--results", dest="results", action="store",
+		default="sweep_results.csv", type=str, help="CSV file of results"
+	)
+	parser.add_argument("--log_dir", dest="log_dir", action="store",
+		default="sweep_logs", type=str, help="directory of per job logs"
+	)
+	parser.add_argument("--max_cores", dest="max_cores", action="store",
+		default=None, type=int,
+		help="cores shared by all jobs, all physical cores by default"
+	)
+	args = parser.parse_args()
+
+	with open(args.spec, "r") as f:
+		spec = json.load(f)
+	run_sweep(spec, args.results, args.workers, args.log_dir, args.max_cores)
@@ -0,0 +1,515 @@
+"""
+Backends for the synthesis stage. A backend synthesizes one block onto the
+edges of its kernel:
+
+	qsearch: LEAP and LEAP reoptimizing post processing in a qsearch Project
+		directory, assembled to QASM and rebased to cx and u3 with qiskit.
+	bqskit: LEAP followed by ScanningGateRemovalPass, run as bqskit passes in
+		the synthesizing process with the kernel as the coupling graph of the
+		machine model. Blocks never leave memory.
+
+Backends are picked with options["synth_backend"], see get_backend.
+
+With options["warm_start"], the bqskit backend first tries the block's own
+CNOT structure on the kernel (see warm_start_candidate). If the block already
+fits the kernel, it is a valid result with a known CNOT count. LEAP is then
+seeded with that structure less its last CNOT (see SeedLayerGenerator), so it
+searches from the block's own structure, both removing and adding CNOTs, and
+only keeps circuits with fewer CNOTs than the rewritten block. The rewritten
+block is returned if the search cannot beat it, or runs out of budget first.
+Backends without warm starts reject the option (see get_backend).
+
+Every block may be given a budget, options["block_time_budget"] seconds and,
+for the bqskit backend, options["block_expansion_budget"] LEAP node
+expansions. The bqskit backend stops expanding nodes once either runs out and
+LEAP returns its closest circuit; the qsearch backend is interrupted with
+SIGALRM and has no closest circuit to return. Backends that do not count
+expansions reject block_expansion_budget (see get_backend). A block out of
+budget falls back to the closest circuit if it is within SUCCESS_DISTANCE of
+the block, or else to the block itself routed onto its kernel (see
+synthesize_block).
+"""
+from __future__ import annotations
+from typing import Any, Iterator, Sequence
+from contextlib import contextmanager
+from signal import ITIMER_REAL, SIGALRM, setitimer, signal
+from threading import current_thread, main_thread
+from time import time
+
+from networkx import Graph, NetworkXNoPath, shortest_path
+from bqskit import Circuit
+from bqskit.ir.gates import CNOTGate, U3Gate
+from bqskit.ir.lang.qasm2.qasm2 import OPENQASM2Language
+from bqskit.passes.search.generator import LayerGenerator
+
+from resources import block_budget
+
+
+# Largest distance (see UnitaryMatrix.get_distance_from) between a block and
+# a circuit that is accepted as implementing it
+SUCCESS_DISTANCE = 1e-6
+
+
+class BudgetExceeded(TimeoutError):
+
+	def __init__(
+		self,
+		block_name : str,
+		partial : Circuit | None = None,
+	):
+		"""
+		Raised when a block runs out of its synthesis budget.
+
+		Arguments:
+			block_name (str): Name of the block.
+
+			partial (Circuit | None): Closest circuit found, if any.
+		"""
+		super().__init__(f"Block {block_name} ran out of its synthesis budget")
+		self.partial = partial
+
+
+@contextmanager
+def time_limit(
+	seconds : float | None,
+	block_name : str,
+) -> Iterator[None]:
+	"""
+	Raise BudgetExceeded in the body after `seconds`. Without a limit, or
+	outside of the main thread where SIGALRM can not be handled, the body
+	runs to completion.
+	"""
+	if seconds is None or current_thread() is not main_thread():
+		yield
+		return
+
+	def expire(signum, frame):
+		raise BudgetExceeded(block_name)
+
+	previous = signal(SIGALRM, expire)
+	setitimer(ITIMER_REAL, seconds)
+	try:
+		yield
+	finally:
+		setitimer(ITIMER_REAL, 0)
+		signal(SIGALRM, previous)
+
+
+class BudgetedLayerGenerator(LayerGenerator):
+
+	def __init__(
+		self,
+		layer_generator : LayerGenerator,
+		deadline : float | None = None,
+		max_expansions : int | None = None,
+		max_cnots : int | None = None,
+	):
+		"""
+		Wraps a layer generator so that no more successors are generated
+		once the deadline passed or max_expansions nodes were expanded. LEAP
+		then empties its frontier and returns its closest circuit. Running
+		out is noted as data["budget_exceeded"].
+
+		Arguments:
+			layer_generator (LayerGenerator): Generator to wrap.
+
+			deadline (float | None): time() after which nothing is expanded.
+
+			max_expansions (int | None): Number of nodes to expand.
+
+			max_cnots (int | None): Successors with more CNOTs are dropped.
+		"""
+		self.layer_generator = layer_generator
+		self.deadline = deadline
+		self.max_expansions = max_expansions
+		self.max_cnots = max_cnots
+		self.expansions = 0
+
+
+	def gen_initial_layer(self, target, data):
+		return self.layer_generator.gen_initial_layer(target, data)
+
+
+	def gen_successors(self, circuit, data):
+		self.expansions += 1
+		if (self.deadline is not None and time() > self.deadline) or \
+			(self.max_expansions is not None and \
+			self.expansions > self.max_expansions):
+			data["budget_exceeded"] = True
+			return []
+		successors = self.layer_generator.gen_successors(circuit, data)
+		if self.max_cnots is None:
+			return successors
+		return [s for s in successors if s.count(CNOTGate()) <= self.max_cnots]
+
+
+def route_block(
+	circuit : Circuit,
+	subtopology : Sequence[Sequence[int]],
+) -> Circuit:
+	"""
+	The block itself on its kernel. Two qudit gates between qudits that are
+	not adjacent in the kernel are moved next to each other with SWAPs, made
+	of three CNOTs, along a shortest path, and swapped back after.
+
+	Raises:
+		ValueError: If the qudits of a gate are not connected in the kernel.
+	"""
+	kernel = Graph()
+	kernel.add_nodes_from(range(circuit.num_qudits))
+	kernel.add_edges_from(subtopology)
+	routed = Circuit(circuit.num_qudits, circuit.radixes)
+
+	def swap(a, b):
+		for location in [(a,b), (b,a), (a,b)]:
+			routed.append_gate(CNOTGate(), location)
+
+	for op in circuit:
+		if op.num_qudits > 2:
+			raise ValueError(f"Can not route {op.num_qudits} qudit gate {op}")
+		if op.num_qudits == 1 or kernel.has_edge(*op.location):
+			routed.append(op)
+			continue
+		(u,v) = op.location
+		try:
+			path = shortest_path(kernel, u, v)
+		except NetworkXNoPath:
+			raise ValueError(f"Qudits {u} and {v} are not connected in kernel")
+		swaps = list(zip(path[:-2], path[1:-1]))
+		for (a,b) in swaps:
+			swap(a, b)
+		routed.append_gate(op.gate, (path[-2], v), op.params)
+		for (a,b) in reversed(swaps):
+			swap(a, b)
+	return routed
+
+
+def cnot_structure(
+	num_qudits : int,
+	cnots : Sequence[Sequence[int]],
+) -> Circuit:
+	"""
+	Uninstantiated circuit of U3s on every qudit followed by the given CNOTs,
+	each with U3s after it, as in LEAP's layers.
+	"""
+	structure = Circuit(num_qudits)
+	for q in range(num_qudits):
+		structure.append_gate(U3Gate(), [q])
+	for location in cnots:
+		structure.append_gate(CNOTGate(), location)
+		for q in location:
+			structure.append_gate(U3Gate(), [q])
+	return structure
+
+
+def warm_start_candidate(
+	circuit : Circuit,
+	subtopology : Sequence[Sequence[int]],
+	multistarts : int = 4,
+) -> Circuit | None:
+	"""
+	Rewrite a block onto its kernel without searching: keep its CNOTs and
+	replace every other gate by U3s after each CNOT, as in LEAP's layers,
+	then instantiate the result to the block's unitary.
+
+	Returns:
+		candidate (Circuit | None): The rewritten block, or None if a
+			multi-qudit gate of the block is not a CNOT on a kernel edge, or
+			the rewrite could not be instantiated.
+	"""
+	edges = set([(min(u,v), max(u,v)) for (u,v) in subtopology])
+	cnots = []
+	for op in circuit:
+		if op.num_qudits == 1:
+			continue
+		(u,v) = op.location
+		if op.gate != CNOTGate() or (min(u,v), max(u,v)) not in edges:
+			return None
+		cnots.append(op.location)
+
+	candidate = cnot_structure(circuit.num_qudits, cnots)
+	target = circuit.get_unitary()
+	candidate.instantiate(target, multistarts=multistarts)
+	if candidate.get_unitary().get_distance_from(target) > SUCCESS_DISTANCE:
+		return None
+	return candidate
+
+
+class SynthesisBackend:
+
+	# Whether several blocks may be synthesized at once in separate
+	# processes, see block_scheduler.py
+	parallel_blocks = True
+
+	# Whether the backend keeps to options["block_time_budget"] itself and
+	# raises BudgetExceeded, instead of being interrupted
+	enforces_budget = False
+
+	# Whether the backend can start from the block's own CNOT structure, see
+	# options["warm_start"]
+	supports_warm_start = False
+
+	# Whether the backend counts LEAP node expansions, see
+	# options["block_expansion_budget"]
+	supports_expansion_budget = False
+
+
+	def __init__(self):
+		"""
+		Synthesizes blocks onto their kernels. Subclasses implement at least
+		one of synthesize and synthesize_qasm.
+		"""
+		pass
+
+
+	def synthesize(
+		self,
+		block_name : str,
+		circuit : Circuit,
+		subtopology : Sequence[Sequence[int]],
+		options : dict[str, Any],
+	) -> Circuit:
+		"""
+		Synthesize a block onto its kernel.
+
+		Args:
+			block_name (str): Name of the block, e.g. "block_007".
+
+			circuit (Circuit): The block, on its own qudits.
+
+			subtopology (Sequence[Sequence[int]]): Kernel edges of the block.
+
+			options (dict[str, Any]): Options of the run.
+
+		Returns:
+			synthesized (Circuit): Block built from cx and u3 gates on the
+				kernel's edges.
+
+		Raises:
+			BudgetExceeded: If the block ran out of its budget.
+		"""
+		return OPENQASM2Language().decode(
+			self.synthesize_qasm(block_name, circuit, subtopology, options)
+		)
+
+
+	def synthesize_qasm(
+		self,
+		block_name : str,
+		circuit : Circuit,
+		subtopology : Sequence[Sequence[int]],
+		options : dict[str, Any],
+	) -> str:
+		"""Same as synthesize, but returns the block as QASM."""
+		return OPENQASM2Language().encode(
+			self.synthesize(block_name, circuit, subtopology, options)
+		)
+
+
+class QSearchBackend(SynthesisBackend):
+
+	def synthesize_qasm(
+		self,
+		block_name : str,
+		circuit : Circuit,
+		subtopology : Sequence[Sequence[int]],
+		options : dict[str, Any],
+	) -> str:
+		from qiskit import QuantumCircuit
+		from qiskit.compiler import transpile
+		from old_codebase import call_old_codebase_leap
+
+		qasm = call_old_codebase_leap(
+			circuit.get_unitary().numpy,
+			subtopology,
+			f"{options['synthesis_dir']}/{block_name}",
+			num_synth_procs=options.get("num_synth_procs", 1),
+			budget=block_budget(options),
+		)
+		return transpile(
+			QuantumCircuit().from_qasm_str(qasm),
+			basis_gates=['cx','u3']
+		).qasm()
+
+
+class BQSKitBackend(SynthesisBackend):
+
+	enforces_budget = True
+
+	supports_warm_start = True
+
+	supports_expansion_budget = True
+
+
+	def synthesize(
+		self,
+		block_name : str,
+		circuit : Circuit,
+		subtopology : Sequence[Sequence[int]],
+		options : dict[str, Any],
+	) -> Circuit:
+		from bqskit.compiler.machine import MachineModel
+		from bqskit.passes import (
+			LEAPSynthesisPass,
+			ScanningGateRemovalPass,
+			SeedLayerGenerator,
+			SimpleLayerGenerator,
+		)
+
+		budget = options.get("block_time_budget")
+		deadline = None if budget is None else time() + budget
+		max_expansions = options.get("block_expansion_budget")
+
+		candidate = None
+		max_cnots = None
+		if options.get("warm_start"):
+			candidate = warm_start_candidate(circuit, subtopology)
+		if candidate is not None:
+			max_cnots = candidate.count(CNOTGate()) - 1
+			if max_cnots < 1:
+				print(f"  Warm start of {block_name} can not be improved")
+				return candidate
+
+		edges = sorted(set([(min(u,v), max(u,v)) for (u,v) in subtopology]))
+		# Layer generators take their coupling graph from the machine model
+		data = {"machine_model" : MachineModel(circuit.num_qudits, edges)}
+		layer_generator = SimpleLayerGenerator(CNOTGate(), U3Gate())
+		if candidate is not None:
+			# The candidate itself would be accepted at once, so the search
+			# starts one CNOT short of it
+			cnots = [op.location for op in candidate if op.num_qudits == 2]
+			layer_generator = SeedLayerGenerator(
+				cnot_structure(circuit.num_qudits, cnots[:-1]),
+				layer_generator,
+			)
+		if deadline is not None or max_expansions is not None or \
+			max_cnots is not None:
+			layer_generator = BudgetedLayerGenerator(
+				layer_generator, deadline, max_expansions, max_cnots
+			)
+		# Without an executor in data, LEAP instantiates successors in this
+		# process
+		target = circuit.get_unitary()
+		synthesized = LEAPSynthesisPass(
+			layer_generator=layer_generator
+		).synthesize(target, data)
+		exceeded = data.get("budget_exceeded", False)
+		# Both budgeted and bounded searches give up with their closest
+		# circuit
+		distance = synthesized.get_unitary().get_distance_from(target)
+		if candidate is not None and (distance > SUCCESS_DISTANCE or \
+			synthesized.count(CNOTGate()) >= candidate.count(CNOTGate())):
+			print(f"  Search did not beat warm start of {block_name}")
+			synthesized = candidate
+		if exceeded:
+			raise BudgetExceeded(block_name, synthesized)
+		ScanningGateRemovalPass().run(synthesized, data)
+		return synthesized
+
+
+SYNTHESIS_BACKENDS = {
+	"qsearch" : QSearchBackend,
+	"bqskit" : BQSKitBackend,
+}
+
+
+def synthesize_block(
+	block_name : str,
+	circuit : Circuit,
+	subtopology : Sequence[Sequence[int]],
+	options : dict[str, Any],
+) -> tuple[str, str | None]:
+	"""
+	Synthesize a block with the run's backend, within the block's budget.
+
+	Returns:
+		qasm (str): The synthesized block.
+
+		fallback (str | None): None if the block was synthesized, "partial"
+			if it ran out of budget and the closest circuit found is used,
+			"original" if the block itself routed onto its kernel is used.
+	"""
+	backend = get_backend(options)
+	seconds = None if backend.enforces_budget else \
+		options.get("block_time_budget")
+	try:
+		with time_limit(seconds, block_name):
+			return (
+				backend.synthesize_qasm(
+					block_name, circuit, subtopology, options
+				),
+				None,
+			)
+	except BudgetExceeded as e:
+		partial = e.partial
+
+	if partial is not None and partial.get_unitary().get_distance_from(
+		circuit.get_unitary()
+	) <= SUCCESS_DISTANCE:
+		print(f"  Block {block_name} ran out of budget, using closest circuit")
+		return (OPENQASM2Language().encode(partial), "partial")
+	print(f"  Block {block_name} ran out of budget, using original block")
+	return (
+		OPENQASM2Language().encode(route_block(circuit, subtopology)),
+		"original",
+	)
+
+
+# Options that change what the synthesis stage writes, with their defaults
+SYNTHESIS_OPTIONS = {
+	"synth_backend" : "qsearch",
+	"warm_start" : False,
+	"block_time_budget" : None,
+	"block_expansion_budget" : None,
+	"predictor_file" : None,
+	"predict_threshold" : 0.05,
+	"predict_action" : "skip",
+}
+
+
+def synthesis_params(
+	options : dict[str, Any],
+) -> dict[str, Any]:
+	"""
+	The options of SYNTHESIS_OPTIONS that are not at their defaults, as
+	manifest parameters of the synthesis stage (see manifest.py). Leaving out
+	defaults keeps blocks synthesized before an option existed current.
+	Predictor settings only count when the predictor skips blocks, deferred
+	blocks are synthesized the same.
+	"""
+	skipping = options.get("predictor_file") is not None and \
+		options.get("predict_action", "skip") == "skip"
+	params = {}
+	for option, default in SYNTHESIS_OPTIONS.items():
+		if option.startswith("predict") and not skipping:
+			continue
+		if options.get(option, default) != default:
+			params[option] = options[option]
+	return params
+
+
+def get_backend(
+	options : dict[str, Any],
+) -> SynthesisBackend:
+	"""
+	The backend named by options["synth_backend"], qsearch if not set.
+
+	Raises:
+		ValueError: If there is no backend of that name, or it does not
+			support the options of the run.
+	"""
+	name = options.get("synth_backend") or "qsearch"
+	if name not in SYNTHESIS_BACKENDS:
+		raise ValueError(
+			f"Unknown synthesis backend {name}, expected one of "
+			f"{list(SYNTHESIS_BACKENDS)}"
+		)
+	backend = SYNTHESIS_BACKENDS[name]()
+	if options.get("warm_start") and not backend.supports_warm_start:
+		raise ValueError(f"The {name} backend does not support warm_start")
+	if options.get("block_expansion_budget") is not None and \
+		not backend.supports_expansion_budget:
+		raise ValueError(
+			f"The {name} backend does not support block_expansion_budget"
+		)
+	return backend
@@ -0,0 +1,404 @@
+"""
+Content addressed cache of synthesized blocks. Results are keyed by the
+block's gate list and the kernel it was synthesized to, so identical blocks
+from other benchmarks, blocksizes or kernel variants are never synthesized
+twice. Keys are computed on a canonical qudit labeling and entries are stored
+in that labeling, so a block that only differs by a relabeling of its qudits
+(and of its kernel) reuses the same entry.
+"""
+from __future__ import annotations
+from typing import Any, Iterator, Sequence
+from hashlib import sha256
+from itertools import permutations, product
+from math import factorial, prod
+from re import match, sub
+from os import getpid, listdir, makedirs, remove, replace, stat, utime, walk
+from os.path import exists, join
+import argparse
+
+from bqskit import Circuit
+
+from util import load_block_circuit, load_block_topology
+
+
+# Blocks with more labelings than this to compare are not cached
+MAX_RELABELINGS = 5040
+
+def canonical_gate_list(
+	circuit : Circuit,
+	perm : Sequence[int] | None = None,
+) -> list[tuple]:
+	"""
+	Describe a circuit as a list of (layer, location, gate, params) tuples.
+
+	Operations are assigned to their ASAP layer and sorted within a layer, so
+	circuits that only differ in the listed order of commuting operations on
+	disjoint qudits describe the same gate list. Parameters are rounded so
+	that QASM round trips do not change the description.
+
+	Args:
+		circuit (Circuit): Circuit to describe.
+
+		perm (Sequence[int] | None): If provided, qudit q is relabeled to
+			perm[q] in the description.
+	"""
+	perm = list(range(circuit.num_qudits)) if perm is None else perm
+	return sorted(
+		(layer, tuple(perm[q] for q in location), gate, params)
+		for (layer, location, gate, params) in _layered_ops(circuit)
+	)
+
+
+def _layered_ops(
+	circuit : Circuit,
+) -> list[tuple]:
+	frontier = [0 for _ in range(circuit.num_qudits)]
+	gate_list = []
+	for op in circuit:
+		layer = max([frontier[q] for q in op.location]) + 1
+		for q in op.location:
+			frontier[q] = layer
+		params = tuple(
+			format(round(float(p), 10) + 0.0, '.10f') for p in op.params
+		)
+		gate_list.append(
+			(layer, tuple(op.location), op.gate.qasm_name, params)
+		)
+	return gate_list
+
+
+def canonical_edges(
+	subtopology : Sequence[Sequence[int]],
+	perm : Sequence[int] | None = None,
+) -> list[tuple[int,int]]:
+	if perm is None:
+		return sorted(set((min(u,v), max(u,v)) for (u,v) in subtopology))
+	return sorted(set(
+		(min(perm[u],perm[v]), max(perm[u],perm[v])) for (u,v) in subtopology
+	))
+
+
+def _qudit_signatures(
+	layered_ops : Sequence[tuple],
+	subtopology : Sequence[Sequence[int]],
+	num_qudits : int,
+) -> list[tuple]:
+	"""
+	A label independent description of how each qudit is used. Two qudits
+	can only be swapped by a canonical relabeling if their signatures match.
+	"""
+	uses = [[] for _ in range(num_qudits)]
+	for (layer, location, gate, params) in layered_ops:
+		for position, q in enumerate(location):
+			uses[q].append((layer, position, len(location), gate, params))
+	degrees = [0 for _ in range(num_qudits)]
+	for (u,v) in set((min(u,v), max(u,v)) for (u,v) in subtopology):
+		degrees[u] += 1
+		degrees[v] += 1
+	return [(degrees[q], tuple(sorted(uses[q]))) for q in range(num_qudits)]
+
+
+def class_permutations(
+	classes : Sequence[Sequence[int]],
+) -> Iterator[list[int]]:
+	"""
+	All relabelings that send the i-th class (in signature order) to the
+	i-th block of canonical labels, permuting freely within each class.
+	"""
+	offsets = []
+	start = 0
+	for qudits in classes:
+		offsets.append(start)
+		start += len(qudits)
+	for orders in product(*[permutations(c) for c in classes]):
+		perm = [0 for _ in range(start)]
+		for offset, order in zip(offsets, orders):
+			for i, q in enumerate(order):
+				perm[q] = offset + i
+		yield perm
+
+
+def block_edges(
+	subtopology : Sequence[Sequence[int]],
+	num_qudits : int,
+) -> list[tuple[int,int]]:
+	"""
+	The kernel edges between qudits of the block. Kernels may be wider than
+	the block they were picked for (e.g. all to all kernels of the run's
+	blocksize), but a block can only be synthesized onto its own qudits.
+	"""
+	return [
+		(u,v) for (u,v) in subtopology if u < num_qudits and v < num_qudits
+	]
+
+
+def canonical_form(
+	circuit : Circuit,
+	subtopology : Sequence[Sequence[int]],
+) -> tuple[tuple, list[int]] | None:
+	"""
+	Find a relabeling of the block's qudits that does not depend on how the
+	block was originally labeled.
+
+	Qudits are first ordered by their signature, then every relabeling that
+	only permutes qudits with equal signatures is tried and the one with the
+	smallest description is kept. Relabeled copies of a block and its kernel
+	therefore share a canonical form. Only kernel edges between the block's
+	qudits are described (see block_edges).
+
+	Args:
+		circuit (Circuit): The block to be synthesized.
+
+		subtopology (Sequence[Sequence[int]]): Kernel edges of the block.
+
+	Returns:
+		description (tuple): The canonical description of the block.
+
+		perm (list[int]): Qudit q of the block is qudit perm[q] in the
+			canonical labeling.
+
+		Or None if there are more than MAX_RELABELINGS relabelings to try.
+	"""
+	num_qudits = circuit.num_qudits
+	subtopology = block_edges(subtopology, num_qudits)
+	layered_ops = _layered_ops(circuit)
+	signatures = _qudit_signatures(layered_ops, subtopology, num_qudits)
+	classes = {}
+	for q in range(num_qudits):
+		classes.setdefault(signatures[q], []).append(q)
+	classes = [classes[sig] for sig in sorted(classes.keys())]
+	if prod([factorial(len(c)) for c in classes]) > MAX_RELABELINGS:
+		return None
+
+	best = None
+	best_perm = None
+	for perm in class_permutations(classes):
+		description = (
+			sorted(
+				(layer, tuple(perm[q] for q in location), gate, params)
+				for (layer, location, gate, params) in layered_ops
+			),
+			canonical_edges(subtopology, perm),
+		)
+		if best is None or description < best:
+			best = description
+			best_perm = perm
+	return ((num_qudits,) + best, best_perm)
+
+
+def cache_key(
+	circuit : Circuit,
+	subtopology : Sequence[Sequence[int]],
+) -> tuple[str, list[int]] | None:
+	"""
+	Hash of a block and the kernel it is synthesized to, independent of how
+	the block's qudits are labeled.
+
+	Args:
+		circuit (Circuit): The block to be synthesized.
+
+		subtopology (Sequence[Sequence[int]]): Kernel edges of the block.
+
+	Returns:
+		key (str): Hex digest identifying the synthesis problem.
+
+		perm (list[int]): Relabeling from the block to the canonical labeling
+			that cache entries are stored in.
+
+		Or None if the block has too many labelings to be cached (see
+		canonical_form).
+	"""
+	canonical = canonical_form(circuit, subtopology)
+	if canonical is None:
+		return None
+	description, perm = canonical
+	return (sha256(repr(description).encode()).hexdigest(), perm)
+
+
+def relabel_qasm(
+	qasm : str,
+	perm : Sequence[int],
+) -> str:
+	"""
+	Rename qudit q[i] to q[perm[i]] in every operation of a QASM string.
+	"""
+	lines = []
+	for line in qasm.splitlines(keepends=True):
+		if match("qreg|creg", line):
+			lines.append(line)
+		else:
+			lines.append(
+				sub(r"q\[(\d+)\]", lambda m: f"q[{perm[int(m[1])]}]", line)
+			)
+	return "".join(lines)
+
+
+def inverse_permutation(perm : Sequence[int]) -> list[int]:
+	inverse = [0 for _ in range(len(perm))]
+	for q, p in enumerate(perm):
+		inverse[p] = q
+	return inverse
+
+
+def _entry_path(key : str, cache_dir : str) -> str:
+	return f"{cache_dir}/{key[:2]}/{key}.qasm"
+
+
+def cache_lookup(
+	key : str,
+	options : dict[str, Any],
+) -> str | None:
+	"""
+	Return the cached QASM for `key`, or None on a miss. Hits refresh the
+	entry's modification time, which eviction uses as its LRU clock.
+	"""
+	path = _entry_path(key, options["cache_dir"])
+	if not exists(path):
+		return None
+	try:
+		with open(path, "r") as f:
+			qasm = f.read()
+		utime(path)
+	except FileNotFoundError:
+		# Evicted by another process in the mean time
+		return None
+	return qasm
+
+
+# Bytes in each cache directory as last walked, plus what this process has
+# stored since. Other processes' stores are only seen at the next walk.
+_cache_bytes = {}
+
+
+def cache_store(
+	key : str,
+	qasm : str,
+	options : dict[str, Any],
+) -> None:
+	"""
+	Add a synthesized block to the cache, then evict the least recently used
+	entries if the cache grew larger than `options["cache_max_bytes"]`.
+
+	Workers storing the same key at once each write their own temporary file,
+	whichever is renamed last wins. The cache's size is only walked when
+	this process's running total of it (see _cache_bytes) exceeds the limit,
+	not after every store.
+	"""
+	path = _entry_path(key, options["cache_dir"])
+	makedirs(f"{options['cache_dir']}/{key[:2]}", exist_ok=True)
+	tmp_path = f"{path}.{getpid()}.tmp"
+	with open(tmp_path, "w") as f:
+		f.write(qasm)
+	try:
+		replace(tmp_path, path)
+	except FileNotFoundError:
+		# Another worker stored the same entry
+		return
+
+	max_bytes = options["cache_max_bytes"]
+	if max_bytes is None:
+		return
+	cache_dir = options["cache_dir"]
+	if cache_dir not in _cache_bytes:
+		_cache_bytes[cache_dir] = _cache_size(cache_dir)
+	else:
+		_cache_bytes[cache_dir] += len(qasm)
+	if _cache_bytes[cache_dir] > max_bytes:
+		evict(cache_dir, max_bytes)
+
+
+def _cache_entries(
+	cache_dir : str,
+) -> list[tuple[float, int, str]]:
+	entries = []
+	for root, _, files in walk(cache_dir):
+		for name in files:
+			if not name.endswith(".qasm"):
+				continue
+			path = join(root, name)
+			try:
+				info = stat(path)
+			except FileNotFoundError:
+				continue
+			entries.append((info.st_mtime, info.st_size, path))
+	return entries
+
+
+def _cache_size(cache_dir : str) -> int:
+	return sum([size for (_, size, _) in _cache_entries(cache_dir)])
+
+
+def evict(
+	cache_dir : str,
+	max_bytes : int | None,
+) -> int:
+	"""
+	Remove least recently used entries until the cache holds at most
+	`max_bytes` bytes.
+
+	Returns:
+		removed (int): Number of entries removed.
+	"""
+	if max_bytes is None:
+		return 0
+	entries = _cache_entries(cache_dir)
+	total = sum([size for (_, size, _) in entries])
+
+	removed = 0
+	for (_, size, path) in sorted(entries):
+		if total <= max_bytes:
+			break
+		try:
+			remove(path)
+			removed += 1
+		except FileNotFoundError:
+			pass
+		total -= size
+	_cache_bytes[cache_dir] = total
+	return removed
+
+
+if __name__ == "__main__":
+	"""
+	>>> python synthesis_cache.py \
+			block_files/qft_64_preoptimized_mesh_64_blocksize_4_scan \
+			subtopology_files/lines-qft_64_preoptimized_mesh_64_blocksize_4_scan_kernel \
+			synthesis_files/lines-qft_64_preoptimized_mesh_64_blocksize_4_scan_kernel
+
+	Adds already synthesized blocks to the cache so that any benchmark or
+	kernel variant containing the same block and kernel reuses them.
+	"""
+	parser = argparse.ArgumentParser(
+		description="Add existing synthesis results to the synthesis cache"
+	)
+	parser.add_argument("partition_dir", type=str)
+	parser.add_argument("subtopology_dir", type=str)
+	parser.add_argument("synthesis_dir", type=str)
+	parser.add_argument("--cache_dir", type=str, default="synthesis_cache")
+	parser.add_argument("--cache_size_mb", type=int, default=1024)
+	args = parser.parse_args()
+
+	options = {
+		"checkpoint_as_qasm" : True,
+		"cache_dir" : args.cache_dir,
+		"cache_max_bytes" : args.cache_size_mb * 2**20,
+	}
+	blocks = sorted([x for x in listdir(args.partition_dir) if x.endswith(".qasm")])
+	stored = 0
+	for block in blocks:
+		name = block.split(".qasm")[0]
+		synth_path = f"{args.synthesis_dir}/{block}"
+		kernel_path = f"{args.subtopology_dir}/{name}_kernel.pickle"
+		if not exists(synth_path) or not exists(kernel_path):
+			continue
+		keyed = cache_key(
+			load_block_circuit(f"{args.partition_dir}/{block}", options),
+			load_block_topology(kernel_path),
+		)
+		if keyed is None:
+			continue
+		key, perm = keyed
+		with open(synth_path, "r") as f:
+			cache_store(key, relabel_qasm(f.read(), perm), options)
+		stored += 1
+	print(f"Added {stored}/{len(blocks)} blocks to {args.cache_dir}")
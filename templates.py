@@ -0,0 +1,307 @@
+"""
+Kernel templates and the tables of their distinct labelings.
+
+A template is an unlabeled kernel shape given as an edge list over vertices
+0..n-1. Matching a block tries every labeling of every template, but most of
+the n! vertex permutations give a kernel that was already tried because of the
+template's automorphisms (a 4-star has 4 distinct labelings, not 24).
+kernel_table enumerates each distinct labeled kernel once per set of
+templates and caches it, with every kernel stored as an EdgeSet bitmask.
+"""
+from __future__ import annotations
+from typing import Sequence
+from functools import lru_cache
+from itertools import combinations, permutations
+
+import numpy as np
+from networkx import Graph, is_isomorphic
+
+from edge_set import EdgeSet, num_edge_bits
+
+
+LINE_2 = [(0,1)]
+LINE_3 = [(0,1), (1,2)]
+LINE_4 = [(0,1), (1,2), (2,3)]
+LINE_5 = [(0,1), (1,2), (2,3), (3,4)]
+ALLS_3 = [(0,1), (0,2), (1,2)]
+ALLS_4 = [(0,1), (0,2), (0,3), (1,2), (1,3), (2,3)]
+ALLS_5 = [(0,1), (0,2), (0,3), (0,4), (1,2), (1,3), (1,4), (2,3), (2,4), (3,4)]
+RING_4 = [(0,1), (1,2), (2,3), (0,3)]
+STAR_4 = [(0,1), (0,2), (0,3)]
+KITE_4 = [(0,1), (1,2), (2,3), (1,3)]
+THETA_4 = [(0,1), (1,2), (2,3), (0,3), (1,3)]
+STAR_5 = [(0,1), (0,2), (0,3), (0,4)]
+DIPPER_5 = [(0,1), (1,2), (2,3), (0,3), (0,4)]
+TEES_5 = [(0,1), (1,2), (1,3), (3,4)]
+DISCON_2_2 = [(0,1), (2,3)]
+DISCON_2_3 = [(0,1), (2,3), (3,4)]
+
+
+def line_template(n : int) -> list[tuple[int]]:
+	"""0 - 1 - ... - n-1"""
+	return [(i, i+1) for i in range(n - 1)]
+
+
+def tee_template(n : int) -> list[tuple[int]]:
+	"""A line of n-1 vertices with vertex n-1 hanging off vertex 1."""
+	return line_template(n - 1) + [(1, n - 1)]
+
+
+def heavy_hex_template(n : int) -> list[tuple[int]]:
+	"""
+	A fragment of a heavy hex lattice: a row of 5 qubits, the bridge qubit
+	hanging off its middle, and the rest of the qubits continuing from the
+	bridge into the next row.
+	"""
+	edges = line_template(5) + [(2, 5)]
+	return edges + [(v, v + 1) for v in range(5, n - 1)]
+
+
+def mesh_template(n : int) -> list[tuple[int]]:
+	"""
+	A 2 row patch of a mesh. Vertices are numbered along the first row and
+	back along the second, the last vertex of an odd n hangs off the end.
+	"""
+	width = n // 2
+	top = list(range(width))
+	bottom = list(range(2*width - 1, width - 1, -1))
+	edges = line_template(2 * width)
+	edges += [(top[i], bottom[i]) for i in range(width - 1)]
+	if n % 2 == 1:
+		edges.append((width - 1, n - 1))
+	return edges
+
+
+def alls_template(n : int) -> list[tuple[int]]:
+	return list(combinations(range(n), 2))
+
+
+# Template families of the larger blocksizes, by name
+LARGE_FAMILIES = {
+	"line" : line_template,
+	"tee" : tee_template,
+	"heavyhex" : heavy_hex_template,
+	"mesh" : mesh_template,
+	"all" : alls_template,
+}
+MAX_BLOCKSIZE = 8
+
+
+def topology_templates(
+	num_qudits : int,
+	topology : str,
+) -> list[list[tuple[int]]]:
+	"""
+	Templates that embed in the physical topology, used by
+	topology.match_kernel.
+	"""
+	if num_qudits == 2:
+		return [LINE_2]
+	elif num_qudits == 3:
+		return [LINE_3]
+	elif num_qudits == 4:
+		# 2-2-discon, 4-line, 4-ring, 4-star
+		if topology == "mesh":
+			return [DISCON_2_2, LINE_4, RING_4, STAR_4]
+		# 2-2-discon, 4-line, 4-star
+		elif topology == "falcon":
+			return [DISCON_2_2, LINE_4, STAR_4]
+		# 2-2-discon, 4-line
+		elif topology == "linear":
+			return [DISCON_2_2, LINE_4]
+	elif num_qudits == 5:
+		# 2-3-discon, 5-line, 5-tee, 5-dipper, 5-star
+		if topology == "mesh":
+			return [DISCON_2_3, LINE_5, TEES_5, DIPPER_5, STAR_5]
+		# 2-3-discon, 5-line, 5-tee
+		elif topology == "falcon":
+			return [DISCON_2_3, LINE_5, TEES_5]
+		# 5-line
+		elif topology == "linear":
+			return [LINE_5]
+	elif 6 <= num_qudits <= MAX_BLOCKSIZE:
+		# n-line, n-tee, mesh patch
+		if topology == "mesh":
+			return [
+				line_template(num_qudits),
+				tee_template(num_qudits),
+				mesh_template(num_qudits),
+			]
+		# n-line, heavy hex fragment
+		elif topology == "falcon":
+			return [line_template(num_qudits), heavy_hex_template(num_qudits)]
+		# n-line
+		elif topology == "linear":
+			return [line_template(num_qudits)]
+	raise RuntimeError(
+		f"No templates for {num_qudits} qudits on topology {topology}"
+	)
+
+
+def get_templates(category, num_qubits):
+	"""
+	Valid template categories are:
+		blocksize 3:
+			lines, alls
+		blocksize 4:
+			lines, stars, rings, alls, embedded, trees
+		blocksize 5:
+			lines, stars, tees, dippers, alls, embedded, trees
+		blocksizes 6 to 8:
+			lines, trees, heavyhex, mesh, alls, embedded
+
+	NOTE: embedded means embedded in a 2D nearest neighbor mesh
+	"""
+	if num_qubits < 2:
+		return []
+	elif num_qubits == 2:
+		return [LINE_2]
+	elif num_qubits == 3:
+		if category in ("lines", "stars", "rings", "embedded"):
+			return [LINE_3]
+		elif category == "alls":
+			return [ALLS_3]
+		else:
+			raise RuntimeError(f"Unrecognized category {category}")
+	elif num_qubits == 4:
+		if category == "lines":
+			return [LINE_4]
+		elif category == "stars":
+			return [STAR_4]
+		elif category == "rings":
+			return [RING_4]
+		elif category == "alls":
+			return [ALLS_4]
+		elif category == "embedded":
+			return [LINE_4, STAR_4, RING_4]
+		elif category == "trees":
+			return [LINE_4, STAR_4]
+		else:
+			raise RuntimeError(f"Unrecognized category {category}")
+	elif num_qubits == 5:
+		if category == "lines":
+			return [LINE_5]
+		elif category == "stars":
+			return [STAR_5]
+		elif category == "tees":
+			return [TEES_5]
+		elif category == "dippers":
+			return [TEES_5]
+		elif category == "alls":
+			return [ALLS_5]
+		elif category == "embedded":
+			return [LINE_5, STAR_5, TEES_5, DIPPER_5]
+		elif category == "trees":
+			return [LINE_5, STAR_5, TEES_5]
+		else:
+			raise RuntimeError(f"Unrecognized category {category}")
+	elif num_qubits <= MAX_BLOCKSIZE:
+		if category == "lines":
+			return [line_template(num_qubits)]
+		elif category == "trees":
+			return [
+				line_template(num_qubits),
+				tee_template(num_qubits),
+				heavy_hex_template(num_qubits),
+			]
+		elif category == "heavyhex":
+			return [heavy_hex_template(num_qubits)]
+		elif category == "mesh":
+			return [mesh_template(num_qubits)]
+		elif category == "alls":
+			return [alls_template(num_qubits)]
+		elif category == "embedded":
+			return [
+				line_template(num_qubits),
+				tee_template(num_qubits),
+				mesh_template(num_qubits),
+			]
+		else:
+			raise RuntimeError(f"Unrecognized category {category}")
+	else:
+		raise RuntimeError(
+			f"Only upto {MAX_BLOCKSIZE} qubits blocks supported."
+		)
+
+
+def family_name(
+	kernel_edges : Sequence[tuple[int]],
+	num_qudits : int,
+) -> str | None:
+	"""Name of the large template family `kernel_edges` is a labeling of."""
+	kernel = Graph(list(kernel_edges))
+	for name, family in LARGE_FAMILIES.items():
+		template = family(num_qudits)
+		if len(template) == kernel.number_of_edges() and \
+			is_isomorphic(Graph(template), kernel):
+			return name
+	return None
+
+
+class KernelTable:
+
+	def __init__(
+		self,
+		templates : Sequence[Sequence[tuple[int]]],
+		num_qudits : int,
+	):
+		"""
+		Every distinct labeled kernel of a set of templates.
+
+		Kernels are kept in the order a search over templates, then vertex
+		permutations, first reaches them. Of the permutations giving the same
+		kernel only the first is kept, along with the edge order it produces,
+		so picking the first best kernel of the table gives exactly the
+		kernel the full search would.
+
+		Arguments:
+			templates (Sequence[Sequence[tuple[int]]]): Template edge lists.
+				Templates are simple graphs, repeated edges are ignored.
+
+			num_qudits (int): Number of vertices of the kernels.
+		"""
+		self.num_qudits = num_qudits
+		self.masks = []
+		self.kernels = []
+		seen = set()
+		perms = list(permutations(range(num_qudits), num_qudits))
+		for template in templates:
+			for perm in perms:
+				kernel = [
+					(min(perm[u], perm[v]), max(perm[u], perm[v]))
+					for (u,v) in template
+				]
+				mask = EdgeSet(kernel).mask
+				if mask in seen:
+					continue
+				seen.add(mask)
+				self.masks.append(mask)
+				self.kernels.append(kernel)
+		self.num_candidates = len(templates) * len(perms)
+		# incidence[k,b] is 1 if kernel k has the edge of bit b
+		num_bits = num_edge_bits(num_qudits)
+		self.incidence = np.array(
+			[[(mask >> bit) & 1 for bit in range(num_bits)] for mask in self.masks],
+			dtype=np.int64,
+		).reshape(len(self.masks), num_bits)
+
+
+	def __len__(self) -> int:
+		return len(self.kernels)
+
+
+@lru_cache(maxsize=64)
+def _cached_table(
+	templates : tuple[tuple[tuple[int]]],
+	num_qudits : int,
+) -> KernelTable:
+	return KernelTable(templates, num_qudits)
+
+
+def kernel_table(
+	templates : Sequence[Sequence[tuple[int]]],
+	num_qudits : int,
+) -> KernelTable:
+	"""The KernelTable of `templates`, built once per process."""
+	key = tuple(tuple(tuple(edge) for edge in template) for template in templates)
+	return _cached_table(key, num_qudits)
@@ -0,0 +1,8 @@
+"""
+The modules under test live at the top of the repository and are imported
+by name, as the scripts import each other.
+"""
+from os.path import abspath, dirname
+import sys
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
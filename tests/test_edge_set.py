@@ -0,0 +1,48 @@
+from __future__ import annotations
+from itertools import combinations
+from random import Random
+
+from edge_set import EdgeSet, bit_edge, edge_bit, edge_frequencies
+
+
+def random_edges(rng, num_qudits):
+	pairs = list(combinations(range(num_qudits), 2))
+	return set(rng.sample(pairs, rng.randint(0, len(pairs))))
+
+
+def test_edge_bits_round_trip():
+	for (u,v) in combinations(range(10), 2):
+		assert bit_edge(edge_bit(u, v)) == (u,v)
+		assert edge_bit(v, u) == edge_bit(u, v)
+
+
+def test_set_operations_match_python_sets():
+	rng = Random(0)
+	for _ in range(100):
+		(a, b) = (random_edges(rng, 6), random_edges(rng, 6))
+		(x, y) = (EdgeSet(a), EdgeSet(b))
+		assert set(x) == a and len(x) == len(a)
+		assert set(x | y) == a | b
+		assert set(x & y) == a & b
+		assert set(x - y) == a - b
+		assert set(x ^ y) == a ^ b
+		assert (x <= y) == (a <= b)
+		assert EdgeSet.from_mask(x.mask) == x
+		assert all([(v,u) in x for (u,v) in a])
+
+
+def test_direction_and_self_loops_are_ignored():
+	assert EdgeSet([(2,0), (0,2), (1,1)]).edges() == [(0,2)]
+
+
+def test_induced_and_degrees():
+	edges = EdgeSet([(0,1), (1,2), (2,3), (0,3)])
+	assert edges.induced([0, 1, 2]).edges() == [(0,1), (1,2)]
+	assert edges.degrees(5) == [2, 2, 2, 2, 0]
+
+
+def test_score_counts_both_directions():
+	ops = [(0,1), (1,0), (1,2), (2,3)]
+	freqs = edge_frequencies(ops, 4)
+	assert EdgeSet([(0,1), (1,2)]).score(freqs) == 3
+	assert EdgeSet([(0,3)]).score(freqs) == 0
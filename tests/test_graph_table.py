@@ -0,0 +1,46 @@
+from __future__ import annotations
+from random import Random
+
+from graph_table import LABELLED_SHAPES, classify_kernel
+
+
+def num_vertices(template):
+	return max([max(edge) for edge in template]) + 1
+
+
+def test_relabeled_shapes_keep_their_name():
+	rng = Random(0)
+	for name, template in LABELLED_SHAPES.items():
+		n = num_vertices(template)
+		for _ in range(5):
+			perm = rng.sample(range(n), n)
+			kernel = [(perm[u], perm[v]) for (u,v) in template]
+			assert classify_kernel(kernel, n)[0] == name
+
+
+def test_isolated_qudits_are_ignored():
+	for name, template in LABELLED_SHAPES.items():
+		if "discon" in name:
+			continue
+		n = num_vertices(template)
+		shifted = [(u + 1, v + 1) for (u,v) in template]
+		assert classify_kernel(shifted, n + 1)[0] == name
+
+
+def test_empty_kernel():
+	assert classify_kernel([], 3)[0] == "empty"
+
+
+def test_automorphisms():
+	assert classify_kernel(LABELLED_SHAPES["4-star"], 4)[1] == 6
+	assert classify_kernel(LABELLED_SHAPES["4-line"], 4)[1] == 2
+	assert classify_kernel(LABELLED_SHAPES["3-line"], 4)[1] == 2
+
+
+def test_difficulty_follows_names():
+	difficulty = {
+		name : classify_kernel(template, num_vertices(template))[2]
+		for name, template in LABELLED_SHAPES.items()
+	}
+	assert difficulty["4-line"] < difficulty["4-star"] < difficulty["4-ring"]
+	assert difficulty["4-ring"] < difficulty["4-all"]
@@ -0,0 +1,116 @@
+from __future__ import annotations
+from itertools import permutations
+from random import Random
+
+from kernel_matching import (
+	best_permuted_kernel,
+	best_permuted_kernels,
+	search_permuted_kernel,
+)
+from templates import get_templates, topology_templates
+from topology import match_ops_kernel
+
+
+TOPOLOGIES = ["mesh", "falcon", "linear"]
+
+
+def baseline_edge_score(logical_ops, kernel):
+	return sum([
+		logical_ops.count((u,v)) + logical_ops.count((v,u)) for (u,v) in kernel
+	])
+
+
+def baseline_match_kernel(logical_ops, templates, num_qudits):
+	"""The serial search of the original topology.match_kernel."""
+	best_kernel = []
+	best_score = 0
+	for template in templates:
+		for perm in permutations(range(num_qudits), num_qudits):
+			kernel = [
+				(min(perm[u], perm[v]), max(perm[u], perm[v]))
+				for (u,v) in template
+			]
+			score = baseline_edge_score(logical_ops, kernel)
+			if score > best_score:
+				best_kernel = kernel
+				best_score = score
+	return best_kernel
+
+
+def random_blocks(seed, widths, count):
+	rng = Random(seed)
+	blocks = []
+	for _ in range(count):
+		num_qudits = rng.choice(widths)
+		logical_ops = [
+			tuple(rng.sample(range(num_qudits), 2))
+			for _ in range(rng.randint(1, 10))
+		]
+		blocks.append((logical_ops, num_qudits))
+	return blocks
+
+
+def test_best_permuted_kernel_matches_baseline():
+	for topology in TOPOLOGIES:
+		for (ops, n) in random_blocks(0, [2, 3, 4, 5], 200):
+			templates = topology_templates(n, topology)
+			assert best_permuted_kernel(ops, templates, n) == \
+				baseline_match_kernel(ops, templates, n)
+
+
+def test_best_permuted_kernels_matches_single_blocks():
+	blocks = random_blocks(1, [2, 3, 4, 5], 200)
+	templates = [topology_templates(n, "mesh") for (_, n) in blocks]
+	kernels = best_permuted_kernels(
+		[ops for (ops, _) in blocks], templates, [n for (_, n) in blocks]
+	)
+	for (ops, n), block_templates, kernel in zip(blocks, templates, kernels):
+		assert list(kernel) == baseline_match_kernel(ops, block_templates, n)
+
+
+def test_search_permuted_kernel_finds_best_score():
+	for category in ["lines", "trees"]:
+		for (ops, n) in random_blocks(2, [6], 20):
+			templates = get_templates(category, n)
+			assert baseline_edge_score(
+				ops, search_permuted_kernel(ops, templates, n)
+			) == baseline_edge_score(
+				ops, baseline_match_kernel(ops, templates, n)
+			)
+
+
+def test_match_ops_kernel_without_memo_matches_baseline():
+	for topology in TOPOLOGIES:
+		options = {
+			"blocksize" : 5, "topology" : topology, "kernel_memo_dir" : None
+		}
+		for (ops, n) in random_blocks(3, [2, 3, 4, 5], 100):
+			assert match_ops_kernel(ops, n, options) == \
+				baseline_match_kernel(ops, topology_templates(n, topology), n)
+
+
+def test_memoized_kernels_are_deterministic(tmp_path):
+	"""
+	Relabeled copies of a block get the same kernels whichever copy was seen
+	first, and score as well as the baseline's.
+	"""
+	rng = Random(4)
+	for index, (ops, n) in enumerate(random_blocks(5, [3, 4, 5], 100)):
+		perm = rng.sample(range(n), n)
+		copy = [(perm[u], perm[v]) for (u,v) in ops]
+		results = []
+		for order in [(ops, copy), (copy, ops)]:
+			options = {
+				"blocksize" : 5,
+				"topology" : "mesh",
+				"kernel_memo_dir" : str(tmp_path / f"{index}_{len(results)}"),
+			}
+			kernels = {id(o) : match_ops_kernel(o, n, options) for o in order}
+			results.append((kernels[id(ops)], kernels[id(copy)]))
+		assert results[0] == results[1]
+
+		templates = topology_templates(n, "mesh")
+		for block, kernel in zip((ops, copy), results[0]):
+			assert baseline_edge_score(block, kernel) == baseline_edge_score(
+				block, baseline_match_kernel(block, templates, n)
+			)
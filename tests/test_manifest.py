@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+from manifest import Manifest
+
+
+def write(path, text):
+	with open(path, "w") as f:
+		f.write(text)
+
+
+def test_missing_outputs_are_not_current(tmp_path):
+	manifest = Manifest(str(tmp_path / "manifest.json"))
+	write(tmp_path / "in", "a")
+	inputs = [str(tmp_path / "in")]
+	assert not manifest.is_current("stage", inputs, {}, [str(tmp_path / "out")])
+
+
+def test_untracked_outputs_are_adopted(tmp_path):
+	manifest = Manifest(str(tmp_path / "manifest.json"))
+	write(tmp_path / "in", "a")
+	write(tmp_path / "out", "b")
+	(inputs, outputs) = ([str(tmp_path / "in")], [str(tmp_path / "out")])
+	assert manifest.is_current("stage", inputs, {"x" : 1}, outputs)
+	assert "stage" in manifest.stages
+
+
+def test_changed_inputs_and_params(tmp_path):
+	manifest = Manifest(str(tmp_path / "manifest.json"))
+	write(tmp_path / "in", "a")
+	write(tmp_path / "out", "b")
+	(inputs, outputs) = ([str(tmp_path / "in")], [str(tmp_path / "out")])
+	manifest.record("stage", inputs, {"x" : 1}, outputs)
+	assert manifest.is_current("stage", inputs, {"x" : 1}, outputs)
+	assert not manifest.is_current("stage", inputs, {"x" : 2}, outputs)
+	write(tmp_path / "in", "changed")
+	assert not manifest.is_current("stage", inputs, {"x" : 1}, outputs)
+
+
+def test_save_and_reload(tmp_path):
+	manifest_file = str(tmp_path / "run" / "manifest.json")
+	manifest = Manifest(manifest_file)
+	write(tmp_path / "in", "a")
+	write(tmp_path / "out", "b")
+	(inputs, outputs) = ([str(tmp_path / "in")], [str(tmp_path / "out")])
+	manifest.record("synthesis/block_0", inputs, {}, outputs)
+	manifest.record("layout", inputs, {}, outputs)
+	manifest.save()
+
+	reloaded = Manifest(manifest_file)
+	assert reloaded.is_current("layout", inputs, {}, outputs)
+	reloaded.invalidate("synthesis/")
+	assert list(reloaded.stages) == ["layout"]
@@ -0,0 +1,103 @@
+from __future__ import annotations
+from itertools import combinations
+from random import Random
+
+import numpy as np
+from bqskit import Circuit
+from bqskit.ir.gates import CNOTGate, U3Gate
+from bqskit.ir.lang.qasm2.qasm2 import OPENQASM2Language
+
+from synthesis_cache import (
+	cache_key,
+	cache_lookup,
+	cache_store,
+	inverse_permutation,
+	relabel_qasm,
+)
+
+
+def random_block(rng, num_qudits, num_cnots):
+	circuit = Circuit(num_qudits)
+	for _ in range(num_cnots):
+		(u,v) = rng.sample(range(num_qudits), 2)
+		circuit.append_gate(CNOTGate(), (u,v))
+		for q in (u,v):
+			circuit.append_gate(
+				U3Gate(), [q], [round(rng.uniform(-3, 3), 3) for _ in range(3)]
+			)
+	return circuit
+
+
+def relabeled(circuit, perm):
+	copy = Circuit(circuit.num_qudits)
+	for op in circuit:
+		copy.append_gate(op.gate, [perm[q] for q in op.location], op.params)
+	return copy
+
+
+def kernel_of(circuit):
+	return sorted(set(
+		(min(op.location), max(op.location)) for op in circuit
+		if op.num_qudits == 2
+	))
+
+
+def test_cache_key_ignores_labeling():
+	rng = Random(0)
+	for _ in range(20):
+		num_qudits = rng.choice([2, 3, 4])
+		block = random_block(rng, num_qudits, rng.randint(1, 6))
+		perm = rng.sample(range(num_qudits), num_qudits)
+		kernel = kernel_of(block)
+		(key, _) = cache_key(block, kernel)
+		(other_key, _) = cache_key(
+			relabeled(block, perm), [(perm[u], perm[v]) for (u,v) in kernel]
+		)
+		assert key == other_key
+
+
+def test_cache_key_depends_on_kernel():
+	block = random_block(Random(1), 3, 4)
+	assert cache_key(block, [(0,1), (1,2)])[0] != \
+		cache_key(block, [(0,1), (1,2), (0,2)])[0]
+
+
+def test_relabel_qasm_round_trip():
+	rng = Random(2)
+	for _ in range(10):
+		block = random_block(rng, 4, 5)
+		qasm = OPENQASM2Language().encode(block)
+		(_, perm) = cache_key(block, kernel_of(block))
+		stored = relabel_qasm(qasm, perm)
+		assert relabel_qasm(stored, inverse_permutation(perm)) == qasm
+
+
+def test_entry_serves_relabeled_block(tmp_path):
+	"""A block stored once is served to a relabeled copy of it."""
+	options = {"cache_dir" : str(tmp_path), "cache_max_bytes" : None}
+	rng = Random(3)
+	block = random_block(rng, 4, 6)
+	(key, perm) = cache_key(block, kernel_of(block))
+	cache_store(
+		key, relabel_qasm(OPENQASM2Language().encode(block), perm), options
+	)
+
+	sigma = rng.sample(range(4), 4)
+	copy = relabeled(block, sigma)
+	(copy_key, copy_perm) = cache_key(copy, kernel_of(copy))
+	assert copy_key == key
+	served = OPENQASM2Language().decode(relabel_qasm(
+		cache_lookup(copy_key, options), inverse_permutation(copy_perm)
+	))
+	assert np.allclose(served.get_unitary(), copy.get_unitary())
+
+
+def test_kernel_wider_than_block():
+	"""All to all kernels of the blocksize may reference absent qudits."""
+	block = random_block(Random(4), 2, 3)
+	wide = list(combinations(range(4), 2))
+	assert cache_key(block, wide)[0] == cache_key(block, [(0,1)])[0]
+
+
+def test_too_many_relabelings():
+	assert cache_key(Circuit(8), []) is None
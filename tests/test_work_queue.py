@@ -0,0 +1,46 @@
+from __future__ import annotations
+from os import makedirs, utime
+from os.path import exists
+from time import time
+
+from work_queue import release, try_claim
+
+
+def claim_options(tmp_path):
+	makedirs(tmp_path / ".claims")
+	return {"synthesis_dir" : str(tmp_path)}
+
+
+def claim_path(tmp_path, block_name):
+	return tmp_path / ".claims" / f"{block_name}.claim"
+
+
+def test_claims_are_exclusive(tmp_path):
+	options = claim_options(tmp_path)
+	assert try_claim("block_0", options, 60)
+	assert not try_claim("block_0", options, 60)
+	assert try_claim("block_1", options, 60)
+
+
+def test_stale_claims_are_taken_over(tmp_path):
+	options = claim_options(tmp_path)
+	path = claim_path(tmp_path, "block_0")
+	with open(path, "w") as f:
+		f.write(f"otherhost:1 {time() - 600}\n")
+	utime(path, (time() - 600, time() - 600))
+	assert try_claim("block_0", options, 60)
+	with open(path, "r") as f:
+		assert not f.read().startswith("otherhost:1 ")
+
+
+def test_release_only_removes_own_claims(tmp_path):
+	options = claim_options(tmp_path)
+	path = claim_path(tmp_path, "block_0")
+	with open(path, "w") as f:
+		f.write(f"otherhost:1 {time()}\n")
+	release("block_0", options)
+	assert exists(path)
+
+	assert try_claim("block_1", options, 60)
+	release("block_1", options)
+	assert not exists(claim_path(tmp_path, "block_1"))
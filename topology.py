@@ -3,34 +3,24 @@ Takes a circuit (qasm file) and a physical topology and produces a hybrid
 logical-physical topology.
 """
 from __future__ import annotations
-import pickle
 from posix import listdir
-from typing import Any, Dict, Sequence, Tuple
-from re import match, findall
+from typing import Any, Sequence
 
 from bqskit.ir.lang.qasm2.qasm2 import OPENQASM2Language
 
 from util import get_mapping_results, get_original_count, get_remapping_results, load_block_circuit, load_block_topology
-from networkx import Graph, shortest_path_length
-import networkx
+from partition_store import open_partition
+from networkx import Graph
 from bqskit import Circuit
 from statistics import mean
-from itertools import permutations
-
-
-def check_multi(qasm_line) -> tuple[int] | None:
-	"""
-	Determine if a line of QASM code is a multi-qubit interaction. If it is, 
-	return a tuple of ints (control, target).
-	"""
-	if bool(match("cx", qasm_line)) or bool(match("swap", qasm_line)):
-		# line is in the form - cx q[<control>], q[<target>];
-		q = findall('\d+', qasm_line)
-		u = min(int(q[0]), int(q[1]))
-		v = max(int(q[0]), int(q[1]))
-		return (u,v)
-	else:
-		return None
+from kernel_matching import best_permuted_kernel
+from kernel_memo import memoized_kernel
+from edge_classes import classify_edges
+from interactions import get_logical_operations, get_num_vertex_uses
+from edge_set import edge_bit, edge_frequencies
+from collections import Counter
+from templates import MAX_BLOCKSIZE, LARGE_FAMILIES, topology_templates
+from graph_table import kernel_shape_name
 
 
 def is_same(a : Sequence[int], b : Sequence[int]) -> bool:
@@ -41,65 +31,6 @@ def is_same(a : Sequence[int], b : Sequence[int]) -> bool:
 		return False
 
 
-def get_logical_operations(
-	circuit: Circuit,
-	qudit_group: Sequence[int] | None = None,
-) -> Sequence[Sequence[int]]:
-	logical_operations = []
-	for op in circuit:
-		if len(op.location) > 1:
-			# TODO: handle multi qubit gates > size 2
-			if qudit_group is not None:
-				a = min([qudit_group[op.location[0]], 
-					qudit_group[op.location[1]]])
-				b = max([qudit_group[op.location[0]], 
-					qudit_group[op.location[1]]])
-			else:
-				a = min([op.location[0], op.location[1]])
-				b = max([op.location[0], op.location[1]])
-			logical_operations.append((a,b))
-	return logical_operations
-
-
-def get_frequencies(
-	circuit: Circuit,
-	qudit_group: Sequence[int] | None = None,
-) -> Dict[Tuple, int]:
-	frequencies = {}
-	logical_operations = []
-	for op in circuit:
-		if len(op.location) > 1:
-			# TODO: handle multi qubit gates
-			#for edge in combinations(op.location, 2):
-			#	logical_operations.append(edge)
-			if qudit_group is not None:
-				a = min([qudit_group[op.location[0]], 
-					qudit_group[op.location[1]]])
-				b = max([qudit_group[op.location[0]], 
-					qudit_group[op.location[1]]])
-			else:
-				a = min([op.location[0], op.location[1]])
-				b = max([op.location[0], op.location[1]])
-			logical_operations.append((a,b))
-	to_count = set(logical_operations)
-	for edge in to_count:
-		frequencies[edge] = logical_operations.count(edge)
-	return frequencies
-
-
-def is_internal(
-	physical_topology: Graph,
-	qudit_group: Sequence[int],
-	edge: tuple[int],
-) -> bool:
-	# Check for a path in the subgraph if no blocksize is provided
-	subgraph = physical_topology.subgraph(qudit_group)
-	try:
-		return shortest_path_length(subgraph,edge[0],edge[1]) < len(qudit_group)
-	except networkx.exception.NetworkXNoPath:
-		return False
-
-
 def get_external_edges(
 	logical_operations : Sequence[Sequence[int]],
 	physical_topology : Graph,
@@ -108,10 +39,7 @@ def get_external_edges(
 	"""
 	Gates that require a logical edge to be inserted into the hybrid topology.
 	"""
-	return [
-		(u,v) for (u,v) in logical_operations if not 
-		is_internal(physical_topology, qudit_group, (u,v))
-	]
+	return classify_edges(logical_operations, physical_topology, qudit_group)[2]
 
 
 def get_indirect_edges(
@@ -122,16 +50,7 @@ def get_indirect_edges(
 	"""
 	Gates that can be implemented on physical edges but non adjacent vertices.
 	"""
-	direct = get_direct_edges(logical_operations, physical_topology)
-	internal = [
-		edge for edge in logical_operations if 
-		is_internal(physical_topology, qudit_group, edge)
-	]
-	indirect = [
-		(u,v) for (u,v) in internal if 
-		(u,v) not in direct and (v,u) not in direct
-	]
-	return indirect 
+	return classify_edges(logical_operations, physical_topology, qudit_group)[1]
 
 
 def get_direct_edges(
@@ -142,8 +61,8 @@ def get_direct_edges(
 	Gates that correspond directly to edges in the physical topology.
 	"""
 	return [
-		(u,v) for (u,v) in logical_operations if (u,v) in 
-		physical_topology.edges or (v,u) in physical_topology.edges
+		(u,v) for (u,v) in logical_operations if
+		physical_topology.has_edge(u,v)
 	]
 
 
@@ -169,72 +88,16 @@ def possible_kernel_names(num_qudits, top_name) -> list[str]:
 		names.extend(["2-3-discon", "5-tee", "5-line"])
 	elif top_name == "linear" and num_qudits >= 5:
 		names.extend(["2-3-discon", "5-line"])
+
+	# Larger kernels are named after their template family
+	for n in range(6, num_qudits + 1):
+		names.extend([f"{n}-{family}" for family in LARGE_FAMILIES])
 	return names
 
 
 def kernel_type(kernel_edges, num_qudits) -> str:
-	kernel_name = "unknown"
-	degrees = get_num_vertex_uses(kernel_edges, num_qudits)
-	deg_list = sorted(list(degrees.values()))
-
-	# 2-line: only one with 1 edge
-	if len(kernel_edges) == 0:
-		kernel_name = "empty"
-	elif len(kernel_edges) == 1:
-		kernel_name = "2-line"
-	elif num_qudits == 3:
-		# 3-line: 2 edges and 3 distinct qubits
-		# 2-discon: 2 disconnected 2-lines, 2 edges and 4 distinct qubits
-		if len(kernel_edges) == 2: 
-			if deg_list[0] == 1 and deg_list[1] == 1 and deg_list[2] == 2:
-				kernel_name = "3-line"
-		elif len(kernel_edges) == 3:
-			kernel_name = "3-all"
-	elif num_qudits == 4:
-		# 3-line: 2 edges and 3 distinct qubits
-		# 2-discon: 2 disconnected 2-lines, 2 edges and 4 distinct qubits
-		if len(kernel_edges) == 2: 
-			if deg_list[0]==0 and deg_list[1]==1 and deg_list[2]==1 and deg_list[3]==2:
-				kernel_name = "3-line"
-			if all([deg_list[i] == 1 for i in range(0,4)]):
-				kernel_name = "2-2-discon"
-		# 4-star: 3 edges, one vertex with degree 3
-		# 4-line: 3 edges, degrees 1,1,2,2
-		elif len(kernel_edges) == 3:
-			if deg_list[3] == 3:
-				kernel_name = "4-star"
-			if deg_list[0] == deg_list[1] == 1 and deg_list[2] == deg_list[3] == 2:
-				kernel_name = "4-line"
-		# 4-ring: 4 edges
-		elif len(kernel_edges) == 4:
-			if deg_list[0] == 1 and deg_list[1] == deg_list[2] == 2 and deg_list[3] == 3:
-				kernel_name = "4-kite"
-			else:
-				kernel_name = "4-ring"
-		elif len(kernel_edges) == 5:
-			kernel_name = "4-theta"
-		elif len(kernel_edges) == 6:
-			kernel_name = "4-all"
-	elif num_qudits == 5:
-		# 2-3-discon
-		if len(kernel_edges) == 3:
-			kernel_name = "2-3-discon"
-		# 5-line, 5-tee, 5-star
-		elif len(kernel_edges) == 4:
-			if max(deg_list) == 4:
-				kernel_name = "5-star"
-			elif max(deg_list) == 3:
-				kernel_name = "5-tee"
-			else:
-				kernel_name = "5-line"
-		# 5-dipper
-		elif len(kernel_edges) == 5:
-			kernel_name = "5-dipper"
-
-		elif len(kernel_edges) == 10:
-			kernel_name = "5-all"
-
-	return kernel_name
+	"""Name of the kernel's shape, see graph_table.py."""
+	return kernel_shape_name(kernel_edges, num_qudits)
 
 
 def collect_stats(
@@ -271,13 +134,6 @@ def collect_stats(
 	)
 
 
-def get_num_vertex_uses(logical_operations, num_qudits) -> dict[int,int]:
-	degrees = {x:0 for x in range(num_qudits)}
-	for a,b in logical_operations:
-		degrees[a] += 1
-		degrees[b] += 1
-	return degrees
-
 # NOTE: only to be used for 4 qudits
 def best_line_kernel(op_set, freqs) -> Sequence[tuple[int]]:
 	edges = sorted(list(op_set), key=lambda x: freqs[x], reverse=True)
@@ -363,92 +219,54 @@ def match_kernel(
 	Stars
 		star-tl, star-br, star-tr, star-bl
 	"""
-	if options["blocksize"] > 5:
+	return match_circuit_kernel(
+		load_block_circuit(circuit_file, options),
+		qudit_group,
+		options,
+	)
+
+
+def match_circuit_kernel(
+	circuit : Circuit,
+	qudit_group : Sequence[int],
+	options : dict[str],
+) -> Sequence[Sequence[tuple[int]]]:
+	"""
+	Same as match_kernel, but for a block that is already loaded.
+	"""
+	return match_ops_kernel(
+		get_logical_operations(circuit), len(qudit_group), options
+	)
+
+
+def match_ops_kernel(
+	logical_ops : Sequence[tuple[int]],
+	num_qudits : int,
+	options : dict[str],
+) -> Sequence[Sequence[tuple[int]]]:
+	"""
+	Same as match_kernel, given the block's interactions.
+	"""
+	if options["blocksize"] > MAX_BLOCKSIZE:
 		raise RuntimeError(
-			"Only blocksizes up to 5 are currently supported."
+			f"Only blocksizes up to {MAX_BLOCKSIZE} are currently supported."
 		)
 
-	circuit = load_block_circuit(circuit_file, options)
-	logical_ops = get_logical_operations(circuit)
-	num_qudits = len(qudit_group)
-
 	# handle the only 1-qubit gates case to avoid trying all options
 	if len(logical_ops) == 0:
 		return []
 
-	if num_qudits == 2:
-		# 2-line
-		templates = [
-			[(0,1)],
-		]
-
-	elif num_qudits == 3:
-		# 3-line
-		templates = [
-			[(0,1), (1,2)],
-		]
-		
-	elif num_qudits == 4:
-		# 2-2-discon, 4-line, 4-ring, 4-star
-		if options['topology'] == "mesh":
-			templates = [
-				[(0,1), (2,3)],
-				[(0,1), (1,2), (2,3)], 
-				[(0,1), (1,2), (2,3), (0,3)],
-				[(0,1), (0,2), (0,3)],
-			]
-		# 2-2-discon, 4-line, 4-star
-		elif options['topology'] == "falcon":
-			templates = [
-				[(0,1), (2,3)],
-				[(0,1), (1,2), (2,3)], 
-				[(0,1), (0,2), (0,3)],
-			]
-		# 2-2-discon, 4-line, 4-star
-		elif options['topology'] == "linear":
-			templates = [
-				[(0,1), (2,3)],
-				[(0,1), (1,2), (2,3)], 
-			]
-
-	elif num_qudits == 5:
-		# 2-3-discon, 5-line, 5-tee, 5-dipper, 5-star
-		if options['topology'] == "mesh":
-			templates = [
-				[(0,1), (2,3), (3,4)],
-				[(0,1), (1,2), (2,3), (3,4)],
-				[(0,1), (1,2), (1,3), (3,4)],
-				[(0,1), (1,2), (2,3), (0,3), (0,4)],
-				[(0,1), (0,2), (0,3), (0,4)],
-			]
-		# 2-3-discon, 5-line, 5-tee
-		elif options['topology'] == "falcon":
-			templates = [
-				[(0,1), (2,3), (3,4)],
-				[(0,1), (1,2), (2,3), (3,4)],
-				[(0,1), (1,2), (1,3), (3,4)],
-			]
-		# 2-3-discon, 5-line
-		elif options['topology'] == "linear":
-			templates = [
-				#[(0,1), (2,3), (3,4)],
-				[(0,1), (1,2), (2,3), (3,4)],
-			]
-
-	vertex_list  = list(range(num_qudits))
-	vertex_perms = list(permutations(vertex_list, num_qudits))
-	best_kernel = []
-	best_score  = 0
-	for template in templates:
-		for perm in vertex_perms:
-			permuted_kernel = construct_permuted_kernel(template, perm)
-			edge_score, node_score = kernel_score_function(logical_ops, permuted_kernel)
-			#if edge_score + node_score > best_score:
-			if edge_score > best_score:
-				best_kernel = permuted_kernel
-				best_score = edge_score
-
-	return best_kernel
+	templates = topology_templates(num_qudits, options["topology"])
+	return memoized_kernel(
+		"topology.match_kernel",
+		(options["topology"], templates),
+		logical_ops,
+		num_qudits,
+		lambda perm: best_permuted_kernel(
+			[(perm[u], perm[v]) for (u,v) in logical_ops], templates, num_qudits
+		),
+		options.get("kernel_memo_dir"),
+	)
 
 
 def kernel_score_function(
@@ -458,24 +276,14 @@ def kernel_score_function(
 	"""
 	Return the "edge score" and "node score" of the kernel passed.
 	"""
+	freqs = edge_frequencies(logical_ops)
 	edge_score = sum([
-		logical_ops.count((u,v)) + logical_ops.count((v,u)) 
-		for (u,v) in kernel_edges
+		freqs[edge_bit(u, v)] for (u,v) in kernel_edges if u != v
 	])
 
-	vertices = list(set([u for (u,v) in kernel_edges] + [v for (u,v) in kernel_edges]))
-	op_occurances = [u for (u,v) in logical_ops] + [v for (u,v) in logical_ops]
-	kern_occurances = [u for (u,v) in kernel_edges] + [v for (u,v) in kernel_edges]
-
-	op_values	 = {n: 0 for n in vertices}
-	kernel_values = {n: 0 for n in vertices} 
-	for v in vertices:
-		op_values[v]	 = op_occurances.count(v)
-		kernel_values[v] = kern_occurances.count(v)
-	
-	node_score = 0
-	for x in vertices:
-		node_score += op_values[x] * kernel_values[x]
+	op_values = Counter([x for (u,v) in logical_ops for x in (u,v)])
+	kernel_values = Counter([x for (u,v) in kernel_edges for x in (u,v)])
+	node_score = sum([op_values[x] * kernel_values[x] for x in kernel_values])
 
 	return (edge_score, node_score)
 
@@ -499,11 +307,8 @@ def edge_score_function(
 		score (int): inner product between logical ops edge frequency vector
 			and the kernel_edges indicator vector.
 	"""
-	score = 0
-	for (u,v) in kernel_edges:
-		score += logical_ops.count((u,v))
-		score += logical_ops.count((v,u))
-	return score
+	freqs = edge_frequencies(logical_ops)
+	return sum([freqs[edge_bit(u, v)] for (u,v) in kernel_edges if u != v])
 
 
 def run_stats(
@@ -518,10 +323,10 @@ def run_stats(
 	sub_files = sorted(sub_files)
 
 	# Get the block files
+	partition = open_partition(options["partition_dir"])
 	if not post_stats:
 		block_dir = options["partition_dir"]
-		block_files = listdir(block_dir)
-		block_files.remove(f"structure.pickle")
+		block_files = [f"{name}.qasm" for name in partition.block_names]
 	else:
 		if not resynthesized:
 			block_dir = options["synthesis_dir"]
@@ -536,8 +341,8 @@ def run_stats(
 	block_files = sorted(block_files)
 
 	# Get the qudit group
-	with open(f"{options['partition_dir']}/structure.pickle", "rb") as f:
-		structure = pickle.load(f)
+	structure = partition.structure
+	partition.close()
 
 	active_qudits_list = []
 	cnots_list  = []
@@ -563,6 +368,9 @@ def run_stats(
 		depth_list.append(depth)
 		edge_score_list.append(score[0])
 		node_score_list.append(score[1])
+		# Shapes outside the topology's templates are not tallied separately
+		if kernel_name not in kernel_dict:
+			kernel_name = "unknown"
 		kernel_dict[kernel_name] += 1
 		kernel_coverage[kernel_name] += cnots
 	total_cnots = sum(cnots_list)
@@ -610,10 +418,10 @@ def run_stats_dict(
 	sub_files = sorted(sub_files)
 
 	# Get the block files
+	partition = open_partition(options["partition_dir"])
 	if not post_stats:
 		block_dir = options["partition_dir"]
-		block_files = listdir(block_dir)
-		block_files.remove(f"structure.pickle")
+		block_files = [f"{name}.qasm" for name in partition.block_names]
 	else:
 		if not resynthesized:
 			block_dir = options["synthesis_dir"]
@@ -628,8 +436,8 @@ def run_stats_dict(
 	block_files = sorted(block_files)
 
 	# Get the qudit group
-	with open(f"{options['partition_dir']}/structure.pickle", "rb") as f:
-		structure = pickle.load(f)
+	structure = partition.structure
+	partition.close()
 
 	active_qudits_list = []
 	cnots_list  = []
@@ -657,6 +465,9 @@ def run_stats_dict(
 		depth_list.append(depth)
 		edge_score_list.append(score[0])
 		node_score_list.append(score[1])
+		# Shapes outside the topology's templates are not tallied separately
+		if kernel_name not in kernel_dict:
+			kernel_name = "unknown"
 		kernel_dict[kernel_name] += 1
 		kernel_coverage[kernel_name] += cnots
 	total_cnots = sum(cnots_list)
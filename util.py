@@ -1,5 +1,8 @@
 from __future__ import annotations
 from posix import listdir
+from os import stat
+from functools import lru_cache
+from os.path import dirname, exists
 from re import S, match
 from typing import Any, Sequence
 import pickle
@@ -15,14 +18,44 @@ from bqskit.ir.lang.qasm2.qasm2	import OPENQASM2Language
 #from bqskit.passes.util.converttocnot import ToCNOTPass
 
 from mapping import find_num_qudits
+from block_format import is_current, load_npz, npz_path_for, save_npz
+from partition_store import find_block_qasm, open_partition, store_path_for
+
+def read_block_qasm(
+	block_path : str,
+) -> str:
+	"""
+	QASM of a block file. Blocks of partitions kept in a single file store
+	(see partition_store.py) are read from the store.
+	"""
+	if not exists(block_path):
+		qasm = find_block_qasm(block_path)
+		if qasm is not None:
+			return qasm
+	with open(block_path, "r") as f:
+		return f.read()
 
 def load_block_circuit(
 	block_path : str,
 	options : dict[str, Any]
 ) -> Circuit:
+	if options.get('checkpoint_format') == "npz":
+		# Load the binary copy of the block, making it on the first load
+		npz_path = npz_path_for(block_path)
+		source_path = block_path if exists(block_path) else \
+			store_path_for(dirname(block_path))
+		if is_current(npz_path, source_path):
+			return load_npz(npz_path)
+		circuit = load_block_circuit(
+			block_path, dict(options, checkpoint_format="qasm")
+		)
+		try:
+			save_npz(npz_path, circuit)
+		except ValueError:
+			pass
+		return circuit
 	if options['checkpoint_as_qasm']:
-		with open(block_path, "r") as f:
-			return OPENQASM2Language().decode(f.read())
+		return OPENQASM2Language().decode(read_block_qasm(block_path))
 	else:
 		with open(block_path, 'rb') as f:
 			return pickle.load(f)
@@ -36,11 +69,40 @@ def save_block_circuit(
 		qasm = OPENQASM2Language().encode(block_circuit)
 		with open(block_path, "w") as f:
 			f.write(qasm)
+		if options.get('checkpoint_format') == "npz":
+			try:
+				save_npz(npz_path_for(block_path), block_circuit)
+			except ValueError:
+				pass
 	else:
 		with open(block_path, 'wb') as f:
 			pickle.dump(block_circuit, f)
 
 
+def load_qasm_circuit(
+	qasm_path : str,
+) -> Circuit:
+	"""
+	Parse a QASM file, reusing the parsed circuit if the same unchanged file
+	was one of the last few loaded by this process, e.g. by a sweep job that
+	only differs in its partitioner. A copy is returned so callers can modify
+	it freely.
+	"""
+	info = stat(qasm_path)
+	return _parse_qasm_file(qasm_path, info.st_mtime, info.st_size).copy()
+
+
+# Parsed circuits can be several MB, long lived sweep workers only keep a few
+@lru_cache(maxsize=2)
+def _parse_qasm_file(
+	qasm_path : str,
+	mtime : float,
+	size : int,
+) -> Circuit:
+	with open(qasm_path, "r") as f:
+		return OPENQASM2Language().decode(f.read())
+
+
 def load_block_topology(
 	block_path : str,
 ) -> Graph | Sequence[tuple[int,int]]:
@@ -67,6 +129,9 @@ def save_circuit_structure(
 def load_circuit_structure(
 	partition_directory : str,
 ) -> Sequence[Sequence[int]]:
+	if not exists(f"{partition_directory}/structure.pickle"):
+		with open_partition(partition_directory) as partition:
+			return partition.structure
 	with open(f"{partition_directory}/structure.pickle", "rb") as f:
 		return pickle.load(f)
 
@@ -134,6 +199,7 @@ def setup_options(
 		"num_p" : num_p,
 		"partitioner" : partitioner,
 		"checkpoint_as_qasm" : True,
+		"checkpoint_format" : getattr(args, "checkpoint_format", "qasm"),
 		"direct_ops" : 0,
 		"indirect_ops" : 0,
 		"external_ops" : 0,
@@ -146,9 +212,29 @@ def setup_options(
 		"total_volume" : 0,
 		"router" : args.router,
 		"original_qasm_file" : qasm_file,
+		"synth_workers" : getattr(args, "synth_workers", 1),
+		"max_cores" : getattr(args, "max_cores", None),
+		"synth_backend" : getattr(args, "synth_backend", "qsearch"),
+		"warm_start" : getattr(args, "warm_start", False),
+		"block_time_budget" : getattr(args, "block_time_budget", None),
+		"block_expansion_budget" : getattr(args, "block_expansion_budget", None),
+		"predictor_file" : getattr(args, "predictor_file", None),
+		"predict_threshold" : getattr(args, "predict_threshold", 0.05),
+		"predict_action" : getattr(args, "predict_action", "skip"),
+		"cache_dir" : getattr(args, "cache_dir", None),
+		"cache_max_bytes" : getattr(args, "cache_size_mb", 1024) * 2**20,
+		"kernel_memo_dir" : getattr(args, "kernel_memo_dir", None),
+		"alltoall" : args.alltoall,
+		"logical_connectivity" : getattr(args, "logical_connectivity", False),
+		"in_memory" : getattr(args, "in_memory", False),
+		"write_checkpoints" : not getattr(args, "no_checkpoints", False),
+		"category" : getattr(args, "category", None),
 	}
 
 	target_name = qasm_file.split("qasm/")[-1].split(".qasm")[0]
+	category = getattr(args, "category", None)
+	if category is not None and not target_name.startswith(f"{category}-"):
+		target_name = f"{category}-{target_name}"
 	target_name += "_" + coupling_map
 	target_name += f"_blocksize_{args.blocksize}"
 
@@ -180,6 +266,9 @@ def setup_options(
 	options["nosynth_dir"] = options["synthesis_dir"] + f"_{args.router}_nosynth"
 	options["subtopology_dir"] = "subtopology_files/" + target_name
 	options["kernel_dir"] = f"kernels/{coupling_map}_blocksize_{args.blocksize}"
+	options["manifest_file"] = f"manifests/{target_name}.json"
+	options["profile_file"] = f"profiles/{target_name}.json"
+	options["report_file"] = f"reports/{target_name}.json"
 
 	options["unsynthesized_layout"] = f"unsynthesized_layout/{target_name}.qasm"
 	options["unsynthesized_qubit_remapping"] = f"unsynthesized_layout/{target_name}.pickle"
@@ -10,35 +10,23 @@ import pickle
 from posix import listdir
 import re
 from sys import intern
-from typing import Any, Dict, Sequence, Tuple
-from re import match, findall
+from typing import Any, Sequence
 from pickle import load
 
 from networkx.classes.function import degree
 
 from util import get_mapping_results, get_original_count, get_remapping_results, load_block_circuit, load_block_topology
-from networkx import Graph, shortest_path_length
-import networkx
+from networkx import Graph
 from networkx.algorithms.shortest_paths.generic import shortest_path
 from itertools import combinations
 from bqskit import Circuit
 from bqskit.ir.lang.qasm2.qasm2	import OPENQASM2Language
 from networkx.generators.ego import ego_graph
 
-
-def check_multi(qasm_line) -> tuple[int] | None:
-	"""
-	Determine if a line of QASM code is a multi-qubit interaction. If it is, 
-	return a tuple of ints (control, target).
-	"""
-	if bool(match("cx", qasm_line)) or bool(match("swap", qasm_line)):
-		# line is in the form - cx q[<control>], q[<target>];
-		q = findall('\d+', qasm_line)
-		u = min(int(q[0]), int(q[1]))
-		v = max(int(q[0]), int(q[1]))
-		return (u,v)
-	else:
-		return None
+from graph_table import kernel_shape_name
+from edge_classes import classify_edges
+from interactions import count_interactions, get_logical_operations, get_num_vertex_uses
+from kernel_memo import memoized_kernel
 
 
 def is_same(a : Sequence[int], b : Sequence[int]) -> bool:
@@ -49,65 +37,6 @@ def is_same(a : Sequence[int], b : Sequence[int]) -> bool:
 		return False
 
 
-def get_logical_operations(
-	circuit: Circuit,
-	qudit_group: Sequence[int] | None = None,
-) -> Sequence[Sequence[int]]:
-	logical_operations = []
-	for op in circuit:
-		if len(op.location) > 1:
-			# TODO: handle multi qubit gates
-			if qudit_group is not None:
-				a = min([qudit_group[op.location[0]], 
-					qudit_group[op.location[1]]])
-				b = max([qudit_group[op.location[0]], 
-					qudit_group[op.location[1]]])
-			else:
-				a = min([op.location[0], op.location[1]])
-				b = max([op.location[0], op.location[1]])
-			logical_operations.append((a,b))
-	return logical_operations
-
-
-def get_frequencies(
-	circuit: Circuit,
-	qudit_group: Sequence[int] | None = None,
-) -> Dict[Tuple, int]:
-	frequencies = {}
-	logical_operations = []
-	for op in circuit:
-		if len(op.location) > 1:
-			# TODO: handle multi qubit gates
-			#for edge in combinations(op.location, 2):
-			#	logical_operations.append(edge)
-			if qudit_group is not None:
-				a = min([qudit_group[op.location[0]], 
-					qudit_group[op.location[1]]])
-				b = max([qudit_group[op.location[0]], 
-					qudit_group[op.location[1]]])
-			else:
-				a = min([op.location[0], op.location[1]])
-				b = max([op.location[0], op.location[1]])
-			logical_operations.append((a,b))
-	to_count = set(logical_operations)
-	for edge in to_count:
-		frequencies[edge] = logical_operations.count(edge)
-	return frequencies
-
-
-def is_internal(
-	physical_topology: Graph,
-	qudit_group: Sequence[int],
-	edge: tuple[int],
-) -> bool:
-	# Check for a path in the subgraph if no blocksize is provided
-	subgraph = physical_topology.subgraph(qudit_group)
-	try:
-		return shortest_path_length(subgraph,edge[0],edge[1]) < len(qudit_group)
-	except networkx.exception.NetworkXNoPath:
-		return False
-
-
 def get_external_edges(
 	logical_operations : Sequence[Sequence[int]],
 	physical_topology : Graph,
@@ -116,10 +45,7 @@ def get_external_edges(
 	"""
 	Gates that require a logical edge to be inserted into the hybrid topology.
 	"""
-	return [
-		(u,v) for (u,v) in logical_operations if not 
-		is_internal(physical_topology, qudit_group, (u,v))
-	]
+	return classify_edges(logical_operations, physical_topology, qudit_group)[2]
 
 
 def get_indirect_edges(
@@ -130,16 +56,7 @@ def get_indirect_edges(
 	"""
 	Gates that can be implemented on physical edges but non adjacent vertices.
 	"""
-	direct = get_direct_edges(logical_operations, physical_topology)
-	internal = [
-		edge for edge in logical_operations if 
-		is_internal(physical_topology, qudit_group, edge)
-	]
-	indirect = [
-		(u,v) for (u,v) in internal if 
-		(u,v) not in direct and (v,u) not in direct
-	]
-	return indirect 
+	return classify_edges(logical_operations, physical_topology, qudit_group)[1]
 
 
 def get_direct_edges(
@@ -150,8 +67,8 @@ def get_direct_edges(
 	Gates that correspond directly to edges in the physical topology.
 	"""
 	return [
-		(u,v) for (u,v) in logical_operations if (u,v) in 
-		physical_topology.edges or (v,u) in physical_topology.edges
+		(u,v) for (u,v) in logical_operations if
+		physical_topology.has_edge(u,v)
 	]
 
 
@@ -167,9 +84,9 @@ def collect_stats_tuples(
 	blocksize = len(qudit_group) if blocksize is None else blocksize
 	logical_ops = get_logical_operations(circuit, qudit_group)
 
-	direct = get_direct_edges(logical_ops, physical_graph)
-	indirect = get_indirect_edges(logical_ops, physical_graph, qudit_group)
-	external = get_external_edges(logical_ops, physical_graph, qudit_group)
+	(direct, indirect, external) = classify_edges(
+		logical_ops, physical_graph, qudit_group
+	)
 
 	active_qudits = circuit.get_active_qudits()
 
@@ -198,24 +115,30 @@ def collect_stats_tuples(
 	return (pre_stats, subtopology_stats)
 
 
+# Coarse names of the shapes of up to 4 qudits, as these stats have always
+# reported them
+COARSE_NAMES = {
+	"empty" : "linear",
+	"2-line" : "linear",
+	"3-line" : "linear",
+	"2-2-discon" : "linear",
+	"3-all" : "linear",
+	"4-line" : "linear",
+	"4-star" : "star",
+	"4-ring" : "ring",
+	"4-kite" : "ring",
+	"4-theta" : "star",
+	"4-all" : "star",
+}
+
+
 def kernel_name(kernel, blocksize) -> str:
-	if len(kernel) == 4:
-		kernel_type = "ring"
-	elif len(kernel) < 3:
-		kernel_type = "linear"
-	else:
-		# kernel is a star if there is a degree 3 vertex
-		degrees = {x:0 for x in range(blocksize)}
-		for edge in kernel:
-			degrees[edge[0]] += 1
-			degrees[edge[1]] += 1
-		if max(degrees.values()) == 3:
-			kernel_type = "star"
-		elif max(degrees.values()) == 2:
-			kernel_type = "linear"
-		else:
-			kernel_type = "unknown"
-	return kernel_type
+	"""
+	Coarse name of the kernel's shape for kernels of up to 4 qudits, the
+	graph_table.py name otherwise.
+	"""
+	name = kernel_shape_name(kernel, blocksize)
+	return COARSE_NAMES.get(name, name)
 
 
 def collect_stats(
@@ -230,9 +153,9 @@ def collect_stats(
 	blocksize = len(qudit_group) if blocksize is None else blocksize
 	logical_ops = get_logical_operations(circuit, qudit_group)
 
-	direct = get_direct_edges(logical_ops, physical_graph)
-	indirect = get_indirect_edges(logical_ops, physical_graph, qudit_group)
-	external = get_external_edges(logical_ops, physical_graph, qudit_group)
+	(direct, indirect, external) = classify_edges(
+		logical_ops, physical_graph, qudit_group
+	)
 	
 	active_qudits = circuit.get_active_qudits()
 
@@ -269,13 +192,6 @@ def collect_stats(
 	return stats
 
 
-def get_num_vertex_uses(logical_operations, num_qudits) -> dict[int,int]:
-	degrees = {x:0 for x in range(num_qudits)}
-	for a,b in logical_operations:
-		degrees[a] += 1
-		degrees[b] += 1
-	return degrees
-
 # NOTE: only to be used for 4 qudits
 def best_line_kernel(op_set, freqs) -> Sequence[tuple[int]]:
 	edges = sorted(list(op_set), key=lambda x: freqs[x], reverse=True)
@@ -336,12 +252,12 @@ def select_linear_kernel(
 	circuit_file : str, 
 	qudit_group : Sequence[int],
 	options : dict[str],
+	perm : Sequence[int] | None = None,
 ) -> Graph | None:
 	# Convert the physical topology to a networkx graph
 	circuit = load_block_circuit(circuit_file, options)
-	logical_ops = get_logical_operations(circuit)
+	(logical_ops, freqs, _) = count_interactions(circuit, perm)
 	op_set = set(logical_ops)
-	freqs = get_frequencies(circuit)
 	return best_line_kernel(op_set, freqs)
 
 
@@ -349,6 +265,7 @@ def select_falcon_kernel(
 	circuit_file : str, 
 	qudit_group : Sequence[int],
 	options : dict[str],
+	perm : Sequence[int] | None = None,
 ) -> Graph | None:
 	"""
 	Given a qasm file and a physical topology, produce a hybrid topology where
@@ -365,6 +282,9 @@ def select_falcon_kernel(
 			is_qasm (bool): Whether the circuit_file is qasm or pickle.
 			kernel_dir (str): Directory in which the kernel files are stored.
 
+		perm (Sequence[int] | None): If given, qudit q of the block is
+			relabeled perm[q] (see kernel_memo.py).
+
 	Returns:
 		kernel_edge_set (set[tuple[int]]): Edges to be used for synthesis.
 	
@@ -380,11 +300,9 @@ def select_falcon_kernel(
 
 	# Convert the physical topology to a networkx graph
 	circuit = load_block_circuit(circuit_file, options)
-	logical_ops = get_logical_operations(circuit)
+	(logical_ops, freqs, vertex_uses) = count_interactions(circuit, perm)
 	op_set = set(logical_ops)
-	freqs = get_frequencies(circuit)
 
-	vertex_uses = get_num_vertex_uses(logical_ops, len(qudit_group))
 	vertex_degrees = get_num_vertex_uses(op_set, len(qudit_group))
 
 	# Handle the case where there are no multi-qubit gates
@@ -436,6 +354,7 @@ def select_mesh_kernel(
 	circuit_file : str, 
 	qudit_group : Sequence[int],
 	options : dict[str],
+	perm : Sequence[int] | None = None,
 ) -> Graph | None:
 	"""
 	Given a qasm file and a physical topology, produce a hybrid topology where
@@ -452,6 +371,9 @@ def select_mesh_kernel(
 			is_qasm (bool): Whether the circuit_file is qasm or pickle.
 			kernel_dir (str): Directory in which the kernel files are stored.
 
+		perm (Sequence[int] | None): If given, qudit q of the block is
+			relabeled perm[q] (see kernel_memo.py).
+
 	Returns:
 		kernel_edge_set (set[tuple[int]]): Edges to be used for synthesis.
 	
@@ -467,11 +389,9 @@ def select_mesh_kernel(
 
 	# Convert the physical topology to a networkx graph
 	circuit = load_block_circuit(circuit_file, options)
-	logical_ops = get_logical_operations(circuit)
+	(logical_ops, freqs, vertex_uses) = count_interactions(circuit, perm)
 	op_set = set(logical_ops)
-	freqs = get_frequencies(circuit)
 
-	vertex_uses = get_num_vertex_uses(logical_ops, len(qudit_group))
 	vertex_degrees = get_num_vertex_uses(op_set, len(qudit_group))
 
 	# Handle the case where there are no multi-qubit gates
@@ -611,9 +531,22 @@ def select_kernel(
 	qudit_group : Sequence[int],
 	options : dict[str],
 ) -> Graph | None:
+	"""
+	Select a kernel for the block in circuit_file. Selections are memoized,
+	see kernel_memo.py.
+	"""
 	if options["coupling_map"] == "mesh":
-		return select_mesh_kernel(circuit_file, qudit_group, options)
+		selector = select_mesh_kernel
 	elif options["coupling_map"] == "falcon":
-		return select_falcon_kernel(circuit_file, qudit_group, options)
+		selector = select_falcon_kernel
 	else:
-		return select_linear_kernel(circuit_file, qudit_group, options)
\ No newline at end of file
+		selector = select_linear_kernel
+	circuit = load_block_circuit(circuit_file, options)
+	return memoized_kernel(
+		f"weighted_topology.{selector.__name__}",
+		(options.get("blocksize"),),
+		get_logical_operations(circuit),
+		len(qudit_group),
+		lambda perm: selector(circuit_file, qudit_group, options, perm),
+		options.get("kernel_memo_dir"),
+	)
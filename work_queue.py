@@ -0,0 +1,381 @@
+"""
+File based work queue for block synthesis. Any number of worker processes, on
+one machine or on several machines sharing the filesystem, can drain the
+blocks of a partition together.
+
+A worker owns a block while its claim file exists in
+<synthesis_dir>/.claims. Claims are created with O_EXCL so only one worker
+gets each block, and are touched periodically while the block is being
+synthesized. A claim that has not been touched for `stale_after` seconds
+belongs to a worker that died and is handed out again. Claims hold the
+worker_id of their owner, and workers only touch or remove claims that still
+hold their own, so a worker that was only slow does not remove the claim of
+the worker that took its block over. A block is done once its checkpoint
+exists in the synthesis directory.
+
+Staleness is judged from the claim file's modification time, so the clocks of
+the machines sharing the filesystem should roughly agree.
+"""
+from __future__ import annotations
+from typing import Any, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from os import O_CREAT, O_EXCL, O_WRONLY, close, getpid, listdir, makedirs
+from os import open as os_open, remove, stat, utime, write
+from os.path import exists
+from socket import gethostname
+from threading import Event, Thread
+from time import sleep, time
+import argparse
+
+from old_codebase import synthesize
+from block_scheduler import block_costs
+from synthesis_backends import get_backend
+from resources import CoreBudget, limited_blas_threads, pin_blas_threads
+from partition_store import open_partition
+
+
+def _claim_dir(options : dict[str, Any]) -> str:
+	return f"{options['synthesis_dir']}/.claims"
+
+
+def worker_id() -> str:
+	return f"{gethostname()}:{getpid()}"
+
+
+def try_claim(
+	block_name : str,
+	options : dict[str, Any],
+	stale_after : float,
+) -> bool:
+	"""
+	Try to become the owner of `block_name`. Stale claims are taken over.
+
+	Returns:
+		claimed (bool): True if this process now owns the block.
+	"""
+	path = f"{_claim_dir(options)}/{block_name}.claim"
+	try:
+		age = time() - stat(path).st_mtime
+		if age < stale_after:
+			return False
+		if not _take_over(path, stale_after):
+			return False
+		print(f"    Reissuing {block_name}, claim was {age:.0f}s old")
+	except FileNotFoundError:
+		pass
+	try:
+		fd = os_open(path, O_CREAT | O_EXCL | O_WRONLY)
+	except FileExistsError:
+		return False
+	write(fd, f"{worker_id()} {time()}\n".encode())
+	close(fd)
+	return True
+
+
+def _take_over(
+	path : str,
+	stale_after : float,
+) -> bool:
+	"""
+	Remove the stale claim at `path`. Workers that found the same stale claim
+	race for a takeover marker created with O_EXCL, and the winner checks the
+	claim again before removing it: another worker may have taken it over
+	and claimed the block anew since it was found stale.
+
+	Returns:
+		removed (bool): True if this process removed the stale claim.
+	"""
+	marker = f"{path}.takeover"
+	try:
+		fd = os_open(marker, O_CREAT | O_EXCL | O_WRONLY)
+	except FileExistsError:
+		# Left behind by a worker that died while taking over
+		try:
+			if time() - stat(marker).st_mtime >= stale_after:
+				remove(marker)
+		except FileNotFoundError:
+			pass
+		return False
+	write(fd, f"{worker_id()} {time()}\n".encode())
+	close(fd)
+	try:
+		if time() - stat(path).st_mtime < stale_after:
+			return False
+		remove(path)
+		return True
+	except FileNotFoundError:
+		return True
+	finally:
+		remove(marker)
+
+
+def owns_claim(path : str) -> bool:
+	"""Whether the claim at `path` holds this process's worker_id."""
+	try:
+		with open(path, "r") as f:
+			return f.read().split(" ")[0] == worker_id()
+	except FileNotFoundError:
+		return False
+
+
+def release(
+	block_name : str,
+	options : dict[str, Any],
+) -> None:
+	"""Remove this process's claim on `block_name`, if it still holds it."""
+	path = f"{_claim_dir(options)}/{block_name}.claim"
+	if not owns_claim(path):
+		return
+	try:
+		remove(path)
+	except FileNotFoundError:
+		pass
+
+
+def _heartbeat(
+	path : str,
+	interval : float,
+	stop : Event,
+) -> None:
+	while not stop.wait(interval):
+		if not owns_claim(path):
+			print(f"    {worker_id()} lost its claim {path}")
+			return
+		try:
+			utime(path)
+		except FileNotFoundError:
+			return
+
+
+def unfinished_blocks(
+	block_names : Sequence[str],
+	options : dict[str, Any],
+) -> list[int]:
+	"""
+	Block numbers without a checkpoint. Unlike
+	block_scheduler.pending_blocks this leaves partial LEAP projects alone,
+	they may belong to a worker that is still running.
+	"""
+	return [
+		block_num for block_num, block_name in enumerate(block_names) if not
+		exists(f"{options['synthesis_dir']}/{block_name}.qasm")
+	]
+
+
+def record_failure(
+	block_name : str,
+	options : dict[str, Any],
+) -> int:
+	"""Count a failed attempt at `block_name` and return the total so far."""
+	path = f"{_claim_dir(options)}/{block_name}.failed"
+	with open(path, "a") as f:
+		f.write(f"{worker_id()} {time()}\n")
+	with open(path, "r") as f:
+		return len(f.readlines())
+
+
+def num_failures(
+	block_name : str,
+	options : dict[str, Any],
+) -> int:
+	path = f"{_claim_dir(options)}/{block_name}.failed"
+	if not exists(path):
+		return 0
+	with open(path, "r") as f:
+		return len(f.readlines())
+
+
+def drain(
+	block_names : Sequence[str],
+	structure : Sequence[Sequence[int]],
+	options : dict[str, Any],
+	heartbeat : float = 30,
+	stale_after : float = 300,
+	max_attempts : int = 3,
+) -> int:
+	"""
+	Claim and synthesize blocks until every block is done, has failed
+	`max_attempts` times, or is owned by a live worker.
+
+	Args:
+		block_names (Sequence[str]): Names of the blocks in the partition.
+
+		structure (Sequence[Sequence[int]]): Qudit group of each block.
+
+		options (dict[str, Any]): Options passed on to synthesize.
+
+		heartbeat (float): Seconds between touches of an owned claim.
+
+		stale_after (float): Seconds after which an untouched claim is
+			reissued.
+
+		max_attempts (int): Blocks that failed this many times are skipped.
+
+	Returns:
+		synthesized (int): Number of blocks this worker synthesized.
+	"""
+	makedirs(_claim_dir(options), exist_ok=True)
+	costs = block_costs(
+		range(len(block_names)), block_names, structure, options
+	)
+	synthesized = 0
+	while True:
+		block_list = [
+			block_num for block_num in unfinished_blocks(block_names, options)
+			if num_failures(block_names[block_num], options) < max_attempts
+		]
+		block_list = sorted(block_list, key=lambda x: costs[x], reverse=True)
+		claimed = None
+		for block_num in block_list:
+			if try_claim(block_names[block_num], options, stale_after):
+				claimed = block_num
+				break
+		if claimed is None:
+			return synthesized
+
+		block_name = block_names[claimed]
+		# Finished by another worker between listing and claiming
+		if exists(f"{options['synthesis_dir']}/{block_name}.qasm"):
+			release(block_name, options)
+			continue
+		print(f"    {worker_id()} synthesizing {block_name}")
+		stop = Event()
+		beat = Thread(
+			target=_heartbeat,
+			args=(
+				f"{_claim_dir(options)}/{block_name}.claim", heartbeat, stop
+			),
+			daemon=True,
+		)
+		beat.start()
+		try:
+			synthesize(block_name, structure[claimed], options)
+			synthesized += 1
+		except Exception as e:
+			attempts = record_failure(block_name, options)
+			print(
+				f"  WARNING: Block {block_name} failed "
+				f"(attempt {attempts}/{max_attempts}): {e}"
+			)
+		finally:
+			stop.set()
+			beat.join()
+			release(block_name, options)
+
+
+def wait_for_blocks(
+	block_names : Sequence[str],
+	structure : Sequence[Sequence[int]],
+	options : dict[str, Any],
+	num_workers : int = 1,
+	poll : float = 10,
+	stale_after : float = 300,
+	max_attempts : int = 3,
+) -> None:
+	"""
+	Drain the queue with `num_workers` local workers, then wait until workers
+	elsewhere finish the blocks they own. Claims left by dead workers are
+	picked up by the local workers while waiting.
+
+	Failure counts from earlier runs are cleared first, so every block gets
+	`max_attempts` new attempts.
+
+	Raises:
+		RuntimeError: If any block failed `max_attempts` times.
+	"""
+	makedirs(_claim_dir(options), exist_ok=True)
+	for name in listdir(_claim_dir(options)):
+		if name.endswith(".failed"):
+			remove(f"{_claim_dir(options)}/{name}")
+	if not get_backend(options).parallel_blocks:
+		num_workers = 1
+	budget = CoreBudget.for_machine(options.get("max_cores"))
+	num_workers = budget.block_workers(num_workers, len(block_names))
+	worker_options = dict(options)
+	worker_options["num_synth_procs"] = max([num_workers, 1])
+	while True:
+		if num_workers > 1:
+			with ProcessPoolExecutor(
+				max_workers=num_workers, initializer=pin_blas_threads
+			) as executor:
+				futures = [
+					executor.submit(
+						drain,
+						block_names,
+						structure,
+						worker_options,
+						stale_after=stale_after,
+						max_attempts=max_attempts,
+					) for _ in range(num_workers)
+				]
+				for future in futures:
+					future.result()
+		else:
+			with limited_blas_threads():
+				drain(
+					block_names,
+					structure,
+					worker_options,
+					stale_after=stale_after,
+					max_attempts=max_attempts,
+				)
+
+		left = unfinished_blocks(block_names, options)
+		failed = [
+			block_names[block_num] for block_num in left
+			if num_failures(block_names[block_num], options) >= max_attempts
+		]
+		if len(left) == len(failed):
+			break
+		print(
+			f"    Waiting on {len(left) - len(failed)} blocks claimed by "
+			"other workers..."
+		)
+		sleep(poll)
+
+	if len(failed) > 0:
+		raise RuntimeError(
+			f"Synthesis failed for {len(failed)} blocks: {failed}"
+		)
+
+
+if __name__ == '__main__':
+	"""
+	>>> python work_queue.py qasm/qft_64_preoptimized.qasm --blocksize 4 \
+			--partitioner scan --topology mesh --queue
+
+	Joins the queue of a qutop.py run with the same arguments, once that run
+	has partitioned the circuit and fitted kernels, and synthesizes blocks
+	until none are left. Run on as many processes or machines as needed.
+	Options of the run are set up from its arguments as qutop.py does (see
+	util.setup_options), only the arguments below are specific to the queue.
+	"""
+	import qutop
+	from util import setup_options
+
+	parser = argparse.ArgumentParser(
+		description="Synthesize blocks from a shared work queue, other "
+		"arguments are those of the qutop.py run to join"
+	)
+	parser.add_argument("--num_synth_procs", type=int, default=1,
+		help="number of workers sharing this machine's cores")
+	parser.add_argument("--stale_after", type=float, default=300,
+		help="seconds before an untouched claim is reissued")
+	(args, run_argv) = parser.parse_known_args()
+	run_args = qutop.parse_args(run_argv)
+
+	options = setup_options(run_args.qasm_file, run_args)
+	options["num_synth_procs"] = args.num_synth_procs
+	# Options the synthesis backend does not support fail before any block
+	get_backend(options)
+	with open_partition(options["partition_dir"]) as partition:
+		block_names = list(partition.block_names)
+		structure = partition.structure
+	pin_blas_threads()
+	synthesized = drain(
+		block_names,
+		structure,
+		options,
+		stale_after=args.stale_after,
+	)
+	print(f"{worker_id()} synthesized {synthesized} blocks")